@@ -1,14 +1,96 @@
+import atexit
+import logging
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
-from flask import Flask, request, render_template_string
+from flask import Flask, Response, jsonify, request, render_template_string
 
-from whoosh_searcher import WhooshEngine
+from cache import CachedEngine, QueryCache
+from engine import IndexNotBuiltError, engine_class
+from metrics import STAGE_SECONDS, Gauge, registry
 
 app = Flask(__name__)
-engine = WhooshEngine()
+# Движок выбирается переменной окружения: SEARCH_ENGINE=array flask run
+engine = CachedEngine(engine_class(os.environ.get("SEARCH_ENGINE", "whoosh"))(),
+                      QueryCache(max_entries=int(os.environ.get("CACHE_SIZE", 1024)),
+                                 ttl=float(os.environ.get("CACHE_TTL", 300))))
+atexit.register(engine.close)
 
-if not engine.ix:
-    engine.index()
+# Индекс не строится при импорте: под gunicorn его строит главный процесс
+#   до fork() (serve.py), иначе -- фоновый поток, запущенный первым запросом;
+#   пока его нет, всё, кроме служебных адресов, отвечает 503.
+#   Рабочие процессы gunicorn сами индекс не строят (INDEX_ON_REQUEST=0
+#   ставит serve.py): если главному процессу это не удалось, каждый начал бы
+#   свою сборку, и они гонялись бы за блокировку записи и манифест
+_indexing_lock = threading.Lock()
+_indexing_thread: threading.Thread = None
+
+
+def build_index():
+    """ Построить индекс, если его ещё нет; синхронно """
+    if not engine.ready:
+        try:
+            engine.index()
+        except Exception:
+            logging.exception("Index build failed.")
+
+
+def start_indexing():
+    """ Построить индекс в фоновом потоке (один раз на процесс) """
+    global _indexing_thread
+    with _indexing_lock:
+        if _indexing_thread is None and not engine.ready:
+            _indexing_thread = threading.Thread(target=build_index, daemon=True)
+            _indexing_thread.start()
+
+
+def indexing() -> bool:
+    return _indexing_thread is not None and _indexing_thread.is_alive()
+
+
+def index_on_request() -> bool:
+    """ Можно ли строить индекс по первому запросу (не под gunicorn) """
+    return os.environ.get("INDEX_ON_REQUEST", "1") != "0"
+
+
+# Статистика индекса и кэша считается один раз на запрос /metrics, а не на датчик
+index_stats = registry.per_scrape(lambda: engine.index_stats())
+cache_stats_snapshot = registry.per_scrape(lambda: engine.cache.stats())
+
+
+def index_stat(key: str):
+    def collect():
+        stats = index_stats()
+        return {(): stats[key]} if key in stats else {}
+    return collect
+
+
+def cache_stat(key: str):
+    return lambda: {(): cache_stats_snapshot()[key]}
+
+
+for name, documentation, function, kind in (
+        ("search_index_documents", "Documents in the index", index_stat("documents"), "gauge"),
+        ("search_index_segments", "Index segments searched per query", index_stat("segments"), "gauge"),
+        ("search_index_size_bytes", "Index size on disk", index_stat("size_bytes"), "gauge"),
+        ("search_cache_entries", "Query cache entries", cache_stat("entries"), "gauge"),
+        ("search_cache_hits_total", "Query cache hits", cache_stat("hits"), "counter"),
+        ("search_cache_misses_total", "Query cache misses", cache_stat("misses"), "counter"),
+        ("search_cache_evictions_total", "Query cache evictions", cache_stat("evictions"), "counter")):
+    registry.register(Gauge(name, documentation, function, kind))
+
+# Пул потоков для пакетных запросов к API; поисковики движка общие
+API_FIELDS = ("id", "title", "snippet", "text", "rank", "score", "docnum")
+API_DEFAULT_FIELDS = ("id", "title", "rank", "score")
+API_MAX_LIMIT = 100
+# глубже движок не ищет: offset + limit документов считаются на каждый запрос
+API_MAX_OFFSET = 1000
+API_MAX_BATCH = 64
+
+executor = ThreadPoolExecutor(max_workers=int(os.environ.get("API_WORKERS", 8)))
+atexit.register(executor.shutdown)
 
 HTML_TEMPLATE = '''
 <!DOCTYPE html>
@@ -61,7 +143,7 @@ HTML_TEMPLATE = '''
         <div class="result">
             <div class="title">{{ result.title }}</div>
             <div class="url">doc{{ result.id }}</div>
-            <div class="snippet">{{ result.text[:250] }}{% if result.text|length > 250 %}...{% endif %}</div>
+            <div class="snippet">{{ result.snippet }}</div>
         </div>
         {% else %}
         {% if query %}
@@ -82,6 +164,21 @@ HTML_TEMPLATE = '''
 '''
 
 
+# Адреса, которые отвечают и без индекса
+SERVICE_ENDPOINTS = {"ready", "metrics", "cache_stats", "static"}
+
+
+@app.before_request
+def ensure_index():
+    if engine.ready:
+        return None
+
+    if index_on_request():
+        start_indexing()
+    if request.endpoint not in SERVICE_ENDPOINTS:
+        return jsonify(error="Index is not built yet"), 503
+
+
 @app.route('/', methods=['GET', 'POST'])
 def search():
     query, results, search_time = '', [], 0.0
@@ -99,13 +196,124 @@ def search():
 
             search_time = time.time() - start_time
 
-    return render_template_string(
-        HTML_TEMPLATE,
-        query=query,
-        results=results,
-        time=search_time
-    )
+    with STAGE_SECONDS.time(stage="render"):
+        return render_template_string(
+            HTML_TEMPLATE,
+            query=query,
+            results=results,
+            time=search_time
+        )
+
+
+@app.route('/ready', methods=['GET'])
+def ready():
+    """ Проверка готовности для балансировщика: индекс загружен и открыт """
+    if indexing() or not engine.ready:
+        return jsonify(status="indexing" if indexing() else "loading"), 503
+    return jsonify(status="ready", generation=engine.generation, pid=os.getpid())
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """ Для Prometheus; у каждого рабочего процесса gunicorn свои значения """
+    return Response(registry.render(), content_type=registry.CONTENT_TYPE)
+
+
+@app.route('/cache', methods=['GET'])
+def cache_stats():
+    return jsonify(engine.cache.stats())
+
+
+def parse_api_params(params) -> dict:
+    """ limit, offset и fields из аргументов запроса или JSON-тела """
+    try:
+        limit = int(params.get("limit", 10))
+        offset = int(params.get("offset", 0))
+    except TypeError:
+        raise ValueError("Expected integer limit and offset")
+
+    if not 0 < limit <= API_MAX_LIMIT or not 0 <= offset <= API_MAX_OFFSET:
+        raise ValueError(f"Expected 0 < limit <= {API_MAX_LIMIT} and 0 <= offset <= {API_MAX_OFFSET}")
+
+    fields = params.get("fields", API_DEFAULT_FIELDS)
+    if isinstance(fields, str):
+        fields = [f for f in fields.split(",") if f]
+    elif not isinstance(fields, (list, tuple)) or not all(isinstance(f, str) for f in fields):
+        raise ValueError("Expected fields as a list of names or a comma-separated string")
+
+    unknown = set(fields) - set(API_FIELDS)
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(sorted(unknown))}")
+
+    return {"limit": limit, "offset": offset, "fields": list(fields)}
+
+
+def run_api_query(query: str, limit: int, offset: int, fields: list) -> dict:
+    """ Страница выдачи: движок ищет offset + limit документов, лишнее отрезаем """
+    start_time = time.perf_counter()
+    hits = engine.search(query, limit=offset + limit)[offset:offset + limit]
+
+    with STAGE_SECONDS.time(stage="render"):
+        results = [{field: hit[field] for field in fields} for hit in hits]
+
+    return {"query": query,
+            "offset": offset,
+            "limit": limit,
+            "results": results,
+            "time": time.perf_counter() - start_time}
+
+
+@app.route('/api/search', methods=['GET', 'POST'])
+def api_search():
+    params = request.get_json(silent=True)
+    if params is None:
+        params = request.values
+    elif not isinstance(params, dict):
+        return jsonify(error="Expected a JSON object"), 400
+
+    query = str(params.get("q", "")).strip()
+    if not query:
+        return jsonify(error="Empty query"), 400
+
+    try:
+        return jsonify(run_api_query(query, **parse_api_params(params)))
+    except ValueError as e:
+        # в том числе BadQueryError: запрос не разобрался
+        return jsonify(error=str(e)), 400
+    except IndexNotBuiltError as e:
+        return jsonify(error=str(e)), 503
+
+
+@app.route('/api/batch', methods=['POST'])
+def api_batch():
+    """ {"queries": [...], "limit": 10, "offset": 0, "fields": [...]} """
+    params = request.get_json(silent=True)
+    if not isinstance(params, dict):
+        return jsonify(error="Expected a JSON object"), 400
+
+    # строка -- тоже последовательность, но запросами были бы её буквы
+    queries = params.get("queries")
+    if not isinstance(queries, list) or not all(isinstance(q, str) for q in queries):
+        return jsonify(error="Expected queries as a list of strings"), 400
+
+    queries = [q.strip() for q in queries]
+    if not queries or len(queries) > API_MAX_BATCH or not all(queries):
+        return jsonify(error=f"Expected 1..{API_MAX_BATCH} non-empty queries"), 400
+
+    try:
+        options = parse_api_params(params)
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+
+    futures = [executor.submit(run_api_query, query, **options) for query in queries]
+    try:
+        return jsonify(responses=[future.result() for future in futures])
+    except ValueError as e:
+        return jsonify(error=str(e)), 400
+    except IndexNotBuiltError as e:
+        return jsonify(error=str(e)), 503
 
 
 if __name__ == '__main__':
+    # Только для разработки; в продакшне -- python serve.py
     app.run(debug=True)
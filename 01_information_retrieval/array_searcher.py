@@ -0,0 +1,410 @@
+import json
+import logging
+import os
+import re
+from array import array
+from collections import Counter
+from typing import Dict, List
+
+import numpy as np
+from tqdm import tqdm
+
+from docstore import DocStore
+from engine import IndexNotBuiltError, StoredIndexEngine, read_documents
+from metrics import STAGE_SECONDS, log_sampled
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(),  # Logs to console
+        logging.FileHandler('array.log', mode='a', encoding='utf-8')
+    ]
+)
+
+TOKEN_RE = re.compile(r"\w+")
+
+# Постинги терма разбиты на блоки по BLOCK_SIZE: для каждого блока известны
+#   последний номер документа и максимальный вклад в BM25
+BLOCK_SIZE = 128
+# Запас на погрешность float32 при сравнении оценок с верхними границами
+PRUNE_SLACK = 1e-6
+# Отсечение включается с этого числа документов. Выигрыш зависит прежде всего
+#   от размера коллекции, а не от длины списков запроса: полный подсчёт
+#   проходит по массиву оценок всех документов. Замер на синтетических
+#   коллекциях (закон Ципфа, 40-200 слов в документе, 200 запросов по 2-5 слов,
+#   top-10, одно ядро) -- среднее время полного подсчёта / с отсечением:
+#   5 тыс. документов -- 0.28 / 0.38 мс, 20 тыс. -- 0.45 / 0.47 мс,
+#   50 тыс. -- 0.73 / 0.54 мс, 200 тыс. -- 2.80 / 1.10 мс;
+#   на Cranfield (1400 документов) отсечение медленнее почти вдвое: 0.56 / 1.00 мс
+PRUNE_MIN_DOCS = 30000
+
+
+def tokenize(text: str) -> List[str]:
+    """ Самая простая токенизация: слова в нижнем регистре """
+    return TOKEN_RE.findall(text.lower())
+
+
+class ArrayIndex(object):
+    """
+        Инвертированный индекс в "плоских" массивах:
+          постинги всех термов лежат подряд в `doc_gaps` и `tfs`,
+          границы списка терма с номером t -- offsets[t]:offsets[t + 1];
+          номера документов закодированы разностями (первая -- как есть)
+
+        Блоки терма t -- block_offsets[t]:block_offsets[t + 1], в block_last --
+          последний номер документа каждого блока, по нему блок ищется
+          без раскодирования всего списка
+
+        На диске каждый массив -- свой .npy, при загрузке он отображается
+          в память: страницы общие у всех процессов, открывших индекс
+    """
+
+    ARRAYS = ("offsets", "doc_gaps", "tfs", "doc_lens", "block_offsets", "block_last")
+
+    def __init__(self,
+                 vocab: Dict[str, int],
+                 offsets: np.ndarray,
+                 doc_gaps: np.ndarray,
+                 tfs: np.ndarray,
+                 doc_lens: np.ndarray,
+                 docnos: List[str],
+                 block_offsets: np.ndarray = None,
+                 block_last: np.ndarray = None):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_gaps = doc_gaps
+        self.tfs = tfs
+        self.doc_lens = doc_lens
+        self.docnos = docnos
+
+        if block_offsets is None:
+            block_offsets, block_last = self._build_blocks()
+        self.block_offsets = block_offsets
+        self.block_last = block_last
+
+        n_docs = len(doc_lens)
+        dfs = np.diff(offsets)
+        # idf как в BM25F у Whoosh (whoosh.scoring.bm25): log(N / (df + 1)) + 1
+        self.idf = (np.log(n_docs / (dfs + 1.0)) + 1.0).astype(np.float32)
+        self.avgdl = float(doc_lens.mean()) if n_docs else 0.0
+
+    def doc_count(self) -> int:
+        return len(self.doc_lens)
+
+    def postings(self, term_id: int):
+        """ Раскодируем постинги одного терма: (номера документов, частоты) """
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        docs = np.cumsum(self.doc_gaps[start:end], dtype=np.int64)
+        return docs, self.tfs[start:end]
+
+    def all_postings(self):
+        """ Все постинги подряд: (номер терма, номер документа) для каждого """
+        dfs = np.diff(self.offsets)
+        starts = self.offsets[:-1]
+        sums = np.cumsum(self.doc_gaps, dtype=np.int64)
+        # накопленная сумма до начала списка терма -- не его документы
+        docs = sums - np.repeat(sums[starts] - self.doc_gaps[starts], dfs)
+        return np.repeat(np.arange(len(dfs)), dfs), docs
+
+    def block_starts(self) -> np.ndarray:
+        """ Позиция первого постинга каждого блока """
+        blocks = np.diff(self.block_offsets)
+        within = np.arange(self.block_offsets[-1]) - np.repeat(self.block_offsets[:-1], blocks)
+        return np.repeat(self.offsets[:-1], blocks) + within * BLOCK_SIZE
+
+    def _build_blocks(self):
+        block_offsets = np.zeros(len(self.offsets), dtype=np.int64)
+        block_offsets[1:] = np.cumsum((np.diff(self.offsets) + BLOCK_SIZE - 1) // BLOCK_SIZE)
+        self.block_offsets = block_offsets
+
+        _, docs = self.all_postings()
+        block_ends = np.append(self.block_starts()[1:], self.offsets[-1])
+        # последний блок терма кончается там же, где его список
+        block_ends = np.minimum(block_ends, np.repeat(self.offsets[1:], np.diff(block_offsets)))
+        return block_offsets, docs[block_ends - 1].astype(np.uint32)
+
+    def postings_blocks(self, term_id: int, blocks: np.ndarray):
+        """ Раскодируем только блоки `blocks` терма (номера внутри терма, по возрастанию) """
+        starts = self.offsets[term_id] + blocks * BLOCK_SIZE
+        lens = np.minimum(starts + BLOCK_SIZE, self.offsets[term_id + 1]) - starts
+        firsts = np.cumsum(lens) - lens
+        positions = np.repeat(starts - firsts, lens) + np.arange(lens.sum())
+
+        gaps = self.doc_gaps[positions].astype(np.int64)
+        sums = np.cumsum(gaps)
+        # первая разность блока -- от последнего документа предыдущего
+        bases = np.where(blocks > 0, self.block_last[self.block_offsets[term_id] + blocks - 1], 0)
+        docs = sums - np.repeat(sums[firsts] - gaps[firsts] - bases, lens)
+        return docs, self.tfs[positions]
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+
+        # Пишем рядом и подменяем: старые файлы ещё могут быть отображены в память
+        for name in self.ARRAYS:
+            array_path = os.path.join(path, f"{name}.npy")
+            with open(array_path + ".new", "wb") as wf:
+                np.save(wf, getattr(self, name))
+            os.replace(array_path + ".new", array_path)
+
+        terms = sorted(self.vocab, key=self.vocab.get)
+        with open(os.path.join(path, "terms.json.new"), "w", encoding="utf-8") as wf:
+            json.dump({"terms": terms, "docnos": self.docnos}, wf, ensure_ascii=False)
+        os.replace(os.path.join(path, "terms.json.new"), os.path.join(path, "terms.json"))
+
+    @classmethod
+    def load(cls, path: str) -> "ArrayIndex":
+        arrays = {name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+                  for name in cls.ARRAYS}
+
+        with open(os.path.join(path, "terms.json"), "r", encoding="utf-8") as rf:
+            meta = json.load(rf)
+
+        return cls(vocab={t: i for i, t in enumerate(meta["terms"])},
+                   docnos=meta["docnos"],
+                   **arrays)
+
+
+class ArrayEngine(StoredIndexEngine):
+    """
+        Индекс в массивах NumPy, отображённых в память (тексты -- в DocStore),
+          BM25 считается векторно сразу по всему списку постингов терма;
+          запрос -- дизъюнкция слов (OR), а не AND, как у MultifieldParser
+
+        search(..., prune=True) -- MaxScore с блочными верхними границами:
+          термы идут по убыванию максимального вклада; пока сумма границ
+          оставшихся термов не меньше текущей k-й оценки, список терма считается
+          целиком, дальше новые документы в top-k попасть уже не могут, и
+          оставшиеся термы только дополняют оценки кандидатов, раскодируя лишь
+          блоки, где кандидат ещё может добрать до порога. top-k тот же, что
+          при полном переборе (prune=False); включается, только если
+          в коллекции не меньше `prune_min_docs` документов (по умолчанию --
+          PRUNE_MIN_DOCS или переменная окружения PRUNE_MIN_DOCS)
+    """
+
+    def __init__(self, index_path="arrayindex", k1: float = 1.2, b: float = 0.75,
+                 prune_min_docs: int = None):
+        super().__init__(index_storage_path=index_path)
+        self.k1, self.b = k1, b
+        self.prune_min_docs = prune_min_docs if prune_min_docs is not None \
+            else int(os.environ.get("PRUNE_MIN_DOCS", PRUNE_MIN_DOCS))
+
+        self.ix: ArrayIndex = None
+        self.norm: np.ndarray = None
+        self.block_max: np.ndarray = None
+        self.term_max: np.ndarray = None
+        self.docs: DocStore = None
+
+        if os.path.exists(self.ix_path):
+            logging.info("Pre-built array index found, loading.")
+            try:
+                self._set_index(ArrayIndex.load(self.ix_path))
+                self.docs = DocStore(os.path.join(self.ix_path, "docstore"))
+                logging.info(f"A total of {self.ix.doc_count()} documents in the index")
+            except Exception:
+                logging.exception("Error upon reading the array index. Should rebuild.")
+                self.ix = None
+
+    def _set_index(self, ix: ArrayIndex):
+        self.ix = ix
+        # Знаменатель BM25 без tf от запроса не зависит, считаем заранее
+        self.norm = (self.k1 * (1.0 - self.b + self.b * ix.doc_lens / max(ix.avgdl, 1e-9))
+                     ).astype(np.float32)
+
+        # Верхние границы вклада блока и терма зависят от k1 и b, поэтому
+        #   считаются здесь, один раз и векторно по всем постингам
+        term_ids, docs = ix.all_postings()
+        contributions = self._contributions(term_ids, docs, ix.tfs)
+        self.block_max = np.maximum.reduceat(contributions, ix.block_starts()) \
+            if len(contributions) else np.zeros(0, dtype=np.float32)
+        self.term_max = np.maximum.reduceat(self.block_max, ix.block_offsets[:-1]) \
+            if len(self.block_max) else np.zeros(0, dtype=np.float32)
+
+    def _contributions(self, term_ids, docs: np.ndarray, tfs: np.ndarray) -> np.ndarray:
+        """ Вклад терма в BM25 документа для каждого постинга """
+        tfs = tfs.astype(np.float32)
+        return self.ix.idf[term_ids] * tfs * (self.k1 + 1.0) / (tfs + self.norm[docs])
+
+    def index(self, csv_file="data/all-ru.csv"):
+        """ Индекс строится с нуля: массивы не дополняются """
+
+        # term -> (номера документов, частоты), компактные массивы из `array`
+        doc_ids: Dict[str, array] = {}
+        freqs: Dict[str, array] = {}
+        doc_lens = array("I")
+        docnos = []
+
+        os.makedirs(self.ix_path, exist_ok=True)
+        if self.docs is None:
+            self.docs = DocStore(os.path.join(self.ix_path, "docstore"))
+        docs_writer = self.docs.writer(rebuild=True)
+
+        for docnum, (docno, title, text) in enumerate(tqdm(read_documents(csv_file),
+                                                           "lines indexed")):
+            tokens = tokenize(title) + tokenize(text)
+            doc_lens.append(len(tokens))
+
+            for term, tf in Counter(tokens).items():
+                if term not in doc_ids:
+                    doc_ids[term], freqs[term] = array("I"), array("H")
+                doc_ids[term].append(docnum)
+                freqs[term].append(min(tf, 0xFFFF))
+
+            docnos.append(docno)
+            docs_writer.add(docno, title, text)
+
+        terms = sorted(doc_ids)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(doc_ids[t]) for t in terms])
+
+        doc_gaps = np.empty(offsets[-1], dtype=np.uint32)
+        tfs = np.empty(offsets[-1], dtype=np.uint16)
+
+        for i, term in enumerate(terms):
+            docs = np.frombuffer(doc_ids[term], dtype=np.uint32)
+            doc_gaps[offsets[i]:offsets[i + 1]] = np.diff(docs, prepend=0)
+            tfs[offsets[i]:offsets[i + 1]] = np.frombuffer(freqs[term], dtype=np.uint16)
+
+        ix = ArrayIndex(vocab={t: i for i, t in enumerate(terms)},
+                        offsets=offsets,
+                        doc_gaps=doc_gaps,
+                        tfs=tfs,
+                        doc_lens=np.frombuffer(doc_lens, dtype=np.uint32).copy(),
+                        docnos=docnos)
+        ix.save(self.ix_path)
+        docs_writer.commit()
+        # дальше работаем с отображёнными в память файлами, а не с копией в куче
+        self._set_index(ArrayIndex.load(self.ix_path))
+        self.generation += 1
+
+    def search(self, query_string: str, limit: int = 10, prune: bool = True):
+
+        if self.ix is None:
+            raise IndexNotBuiltError("Index has not been built.")
+
+        with STAGE_SECONDS.time(stage="parse"):
+            term_ids = {self.ix.vocab[t] for t in tokenize(query_string) if t in self.ix.vocab}
+            # термы с наибольшим возможным вкладом -- первыми
+            term_ids = sorted(term_ids, key=lambda t: (-self.term_max[t], t))
+
+        with STAGE_SECONDS.time(stage="search"):
+            if prune and self.ix.doc_count() >= self.prune_min_docs:
+                scores, hits = self._search_maxscore(term_ids, limit)
+            else:
+                scores = np.zeros(self.ix.doc_count(), dtype=np.float32)
+                for term_id in term_ids:
+                    docs, tfs = self.ix.postings(term_id)
+                    # номера документов в постинге уникальны, так что можно без np.add.at
+                    scores[docs] += self._contributions(term_id, docs, tfs)
+                hits = np.flatnonzero(scores)
+
+            if len(hits) > limit:
+                # все, кто делит k-ю оценку, остаются до сортировки, иначе
+                #   из равных попадали бы в выдачу случайные
+                kth = np.partition(scores[hits], len(hits) - limit)[len(hits) - limit]
+                hits = hits[scores[hits] >= kth]
+
+            # при равных оценках -- по номеру документа
+            hits = hits[np.lexsort((hits, -scores[hits]))][:limit]
+
+        if log_sampled():
+            logging.info(f"q:[{query_string}] "
+                         f"hits:[{';'.join(self.ix.docnos[d] for d in hits)}]")
+
+        with STAGE_SECONDS.time(stage="fetch"):
+            return [self.docs.get(self.ix.docnos[docnum],
+                                  rank=rank,
+                                  score=float(scores[docnum]),
+                                  docnum=int(docnum)) for rank, docnum in enumerate(hits)]
+
+    def index_stats(self) -> dict:
+        stats = super().index_stats()
+        if self.ix is not None:
+            stats.update(documents=self.ix.doc_count(), segments=1)
+        return stats
+
+    def _search_maxscore(self, term_ids: List[int], limit: int):
+        """ Оценки и кандидаты, среди которых заведомо весь top-`limit` """
+        scores = np.zeros(self.ix.doc_count(), dtype=np.float32)
+        # remaining[i] -- сколько ещё могут добавить термы i, i + 1, ...
+        remaining = np.append(np.cumsum([self.term_max[t] for t in term_ids][::-1])[::-1], 0.0)
+
+        # текущий top-k: после очередного терма новый top-k -- среди старого
+        #   и только что обновлённых документов, остальные оценки не менялись
+        top = np.zeros(0, dtype=np.int64)
+
+        def threshold(docs: np.ndarray) -> float:
+            nonlocal top
+            positions = np.minimum(np.searchsorted(docs, top), max(len(docs) - 1, 0))
+            pool = np.concatenate((top[docs[positions] != top], docs)) if len(docs) else top
+            if len(pool) < limit:
+                top = pool
+                return 0.0
+            best = np.argpartition(scores[pool], len(pool) - limit)[len(pool) - limit:]
+            top = np.sort(pool[best])
+            return float(scores[top].min()) * (1.0 - PRUNE_SLACK)
+
+        # 1) термы, которые ещё могут привести в top-k новый документ
+        i, theta = 0, 0.0
+        while i < len(term_ids) and remaining[i] >= theta:
+            docs, tfs = self.ix.postings(term_ids[i])
+            scores[docs] += self._contributions(term_ids[i], docs, tfs)
+            theta = threshold(docs)
+            i += 1
+
+        # 2) остальные только дополняют оценки кандидатов
+        cut = theta - remaining[i]
+        candidates = np.flatnonzero(scores >= cut) if cut > 0 else np.flatnonzero(scores)
+
+        for j in range(i, len(term_ids)):
+            term_id = term_ids[j]
+            first, last = self.ix.block_offsets[term_id], self.ix.block_offsets[term_id + 1]
+            block_last = self.ix.block_last[first:last]
+
+            # в каком блоке терма мог бы быть кандидат
+            blocks = np.searchsorted(block_last, candidates)
+            inside = blocks < len(block_last)
+            bound = scores[candidates] + remaining[j + 1]
+            bound[inside] += self.block_max[first + blocks[inside]]
+            keep = bound >= theta
+            candidates, blocks, inside = candidates[keep], blocks[keep], inside[keep]
+
+            needed = np.zeros(len(block_last), dtype=bool)
+            needed[blocks[inside]] = True
+            needed = np.flatnonzero(needed)
+
+            if 2 * len(needed) > len(block_last):
+                # нужна большая часть блоков -- проще раскодировать список целиком,
+                #   лишние оценки не у кандидатов ни на что не влияют
+                docs, tfs = self.ix.postings(term_id)
+            elif len(needed):
+                docs, tfs = self.ix.postings_blocks(term_id, needed)
+                positions = np.minimum(np.searchsorted(docs, candidates), len(docs) - 1)
+                found = docs[positions] == candidates
+                docs, tfs = docs[positions[found]], tfs[positions[found]]
+            else:
+                docs = None
+
+            if docs is not None and len(docs):
+                scores[docs] += self._contributions(term_id, docs, tfs)
+                theta = threshold(docs)
+            candidates = candidates[scores[candidates] + remaining[j + 1] >= theta]
+
+        return scores, candidates
+
+
+if __name__ == "__main__":
+    CsvFile = "data/all-ru.csv"
+    IndexDir = "arrayindex"
+
+    engine = ArrayEngine(IndexDir)
+    engine.index(CsvFile)
+    logging.info(f"Indexing complete! Index contains {engine.ix.doc_count()} documents.")
+
+    hits = engine.search("мимо сферы")
+
+    for hit in hits:
+        title = hit["title"].replace("\n", " ")
+        print(f'{hit["docnum"]:4d}: {hit["rank"]:2d})'
+              f'\t[{hit["score"]:03.3f}]\t{title}')
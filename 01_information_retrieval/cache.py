@@ -0,0 +1,148 @@
+""" Кэш результатов поиска между app.py и движком """
+import threading
+import time
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import Hashable, List, Mapping, Optional, Tuple
+
+from engine import StoredIndexEngine
+
+
+class QueryCache(object):
+    """
+        LRU-кэш выдачи: не больше `max_entries` записей,
+          каждая живёт не дольше `ttl` секунд;
+          при смене поколения индекса кэш сбрасывается целиком
+
+        Сами документы выдачи не копируются, а делятся между всеми, кому
+          достался этот запрос, поэтому хранятся только неизменяемыми:
+          StoredDocument -- Mapping без записи, обычные словари
+          заворачиваются в MappingProxyType
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+
+        # key -> (момент устаревания, кортеж результатов); порядок -- от давних к свежим
+        self._entries: OrderedDict = OrderedDict()
+        self._generation = None
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(query: str, limit: int) -> Tuple[str, int]:
+        """
+            Запросы, отличающиеся только пробелами, считаем одинаковыми;
+              регистр не трогаем: в синтаксисе Whoosh AND/OR/NOT и имена
+              полей от него зависят
+        """
+        return " ".join(query.split()), limit
+
+    def get(self, key: Hashable, generation: int) -> Optional[List[Mapping]]:
+        with self._lock:
+            entry = self._entries.get(key) if self._check_generation(generation) else None
+
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                    self.evictions += 1
+                self.misses += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            # каждому вызывающему -- свой список; документы в нём общие, но неизменяемые
+            return list(entry[1])
+
+    def put(self, key: Hashable, generation: int, results: List[Mapping]):
+        results = tuple(MappingProxyType(dict(hit)) if isinstance(hit, dict) else hit
+                        for hit in results)
+        with self._lock:
+            if not self._check_generation(generation):
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, results)
+            self._entries.move_to_end(key)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _check_generation(self, generation: int) -> bool:
+        """ False, если поколение устарело (индекс уже перестроен) """
+        if self._generation is not None and generation < self._generation:
+            return False
+        if generation != self._generation:
+            self._entries.clear()
+            self._generation = generation
+        return True
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {"entries": len(self._entries),
+                    "hits": self.hits,
+                    "misses": self.misses,
+                    "evictions": self.evictions,
+                    "hit_rate": self.hits / lookups if lookups else 0.0}
+
+
+class CachedEngine(StoredIndexEngine):
+    """ Обёртка над любым движком: повторные запросы отдаются из кэша """
+
+    def __init__(self, engine: StoredIndexEngine, cache: QueryCache = None):
+        # ix_path и generation -- не свои, а обёрнутого движка
+        self.engine = engine
+        self.cache = cache if cache is not None else QueryCache()
+
+    @property
+    def ix_path(self) -> str:
+        return self.engine.ix_path
+
+    @property
+    def generation(self) -> int:
+        return self.engine.generation
+
+    @property
+    def ix(self):
+        return self.engine.ix
+
+    @property
+    def ready(self) -> bool:
+        """ Индекс построен или загружен, можно искать """
+        return bool(self.engine.ix)
+
+    def index(self, *args, **kwargs):
+        self.engine.index(*args, **kwargs)
+
+    def search(self, query: str, limit: int = 10):
+        key = QueryCache.make_key(query, limit)
+        # Поколение запоминаем до поиска: если индекс успеют перестроить,
+        #   результат уйдёт в кэш со старым поколением и будет отброшен
+        generation = self.engine.generation
+        results = self.cache.get(key, generation)
+
+        if results is None:
+            results = self.engine.search(query, limit=limit)
+            self.cache.put(key, generation, results)
+
+        return results
+
+    def index_stats(self) -> dict:
+        return self.engine.index_stats()
+
+    def before_fork(self):
+        self.engine.before_fork()
+
+    def after_fork(self):
+        self.engine.after_fork()
+
+    def close(self):
+        self.engine.close()
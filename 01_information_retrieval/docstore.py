@@ -0,0 +1,193 @@
+""" Хранилище документов отдельно от индекса: в индексе остаются только постинги """
+import mmap
+import os
+from collections.abc import Mapping
+from typing import Callable, Dict, Optional, Tuple
+
+FIELDS = ("snippet", "title", "text")
+
+
+class StoredDocument(Mapping):
+    """
+        Документ из хранилища: поля читаются из отображённого в память файла
+          только при первом обращении, остальное (id, rank, score...) --
+          в `extra`; в шаблоне работает и как result.title, и как result["title"]
+
+        `lazy` -- поля, которые считаются функцией от документа при первом
+          обращении (например, сниппет с подсветкой) и перекрывают сохранённые
+    """
+
+    def __init__(self, data: mmap.mmap, record: Tuple[int, int, int, int], extra: dict,
+                 lazy: Dict[str, Callable[["StoredDocument"], object]] = None):
+        self._data = data
+        self._record = record
+        self._extra = dict(extra)
+        self._lazy = dict(lazy or {})
+        self._fields = {}
+
+    def __getitem__(self, key):
+        if key in self._extra:
+            return self._extra[key]
+        if key in self._lazy:
+            value = self._extra[key] = self._lazy[key](self)
+            return value
+        return self.stored(key)
+
+    def stored(self, key: str) -> str:
+        """ Поле в том виде, в каком оно записано в хранилище """
+        if key not in FIELDS:
+            raise KeyError(key)
+
+        value = self._fields.get(key)
+        if value is None:
+            # запись -- это подряд идущие snippet, title, text
+            offset, *lengths = self._record
+            i = FIELDS.index(key)
+            start = offset + sum(lengths[:i])
+            value = self._data[start:start + lengths[i]].decode("utf-8") if lengths[i] else ""
+            self._fields[key] = value
+        return value
+
+    def __iter__(self):
+        yield from self._extra
+        yield from (f for f in self._lazy if f not in self._extra)
+        yield from (f for f in FIELDS if f not in self._extra and f not in self._lazy)
+
+    def __len__(self):
+        return len(set(self._extra) | set(self._lazy) | set(FIELDS))
+
+
+class DocStore(object):
+    """
+        Документы по docno: docs.dat -- подряд записанные поля в UTF-8,
+          docs.idx -- строки "docno<TAB>смещение<TAB>длины полей в байтах";
+          оба файла только дописываются, более поздняя строка индекса
+          перекрывает раннюю, смещение -1 означает удаление; место
+          перезаписанных и удалённых документов возвращает compact()
+
+        Сниппет (начало текста) считается при записи,
+          так что для выдачи не нужно читать и резать весь текст
+    """
+
+    def __init__(self, path: str, snippet_chars: int = 250):
+        self.path = path
+        self.snippet_chars = snippet_chars
+        self.data_path = os.path.join(path, "docs.dat")
+        self.idx_path = os.path.join(path, "docs.idx")
+
+        # (записи, данные) -- одним кортежем: после compact() смещения
+        #   новых записей верны только для новых данных
+        self._view: Tuple[Dict[str, Tuple[int, int, int, int]], Optional[mmap.mmap]] = ({}, None)
+
+        os.makedirs(self.path, exist_ok=True)
+        self.refresh()
+
+    def refresh(self):
+        """ Перечитываем индекс и заново отображаем данные после записи """
+        records = {}
+
+        if os.path.exists(self.idx_path):
+            with open(self.idx_path, "r", encoding="utf-8") as rf:
+                for line in rf:
+                    docno, offset, *lengths = line.rstrip("\n").split("\t")
+                    if int(offset) < 0:
+                        records.pop(docno, None)
+                    else:
+                        records[docno] = (int(offset), *map(int, lengths))
+
+        data = None
+        if os.path.exists(self.data_path) and os.path.getsize(self.data_path) > 0:
+            with open(self.data_path, "rb") as f:
+                data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        # Старое отображение не закрываем: его ещё могут читать
+        #   документы, выданные до обновления
+        self._view = records, data
+
+    def __len__(self):
+        return len(self._view[0])
+
+    def __contains__(self, docno: str):
+        return docno in self._view[0]
+
+    def get(self, docno: str, lazy: Dict[str, Callable[[StoredDocument], object]] = None,
+            **extra) -> StoredDocument:
+        records, data = self._view
+        return StoredDocument(data, records[docno], {"id": docno, **extra}, lazy)
+
+    def make_snippet(self, text: str) -> str:
+        if len(text) > self.snippet_chars:
+            return text[:self.snippet_chars] + "..."
+        return text
+
+    def writer(self, rebuild: bool = False) -> "DocStoreWriter":
+        return DocStoreWriter(self, rebuild)
+
+    def compact(self, max_garbage: float = 0.5) -> bool:
+        """
+            Если больше `max_garbage` данных занято перезаписанными
+              и удалёнными документами, переписать файлы только с живыми
+              записями (в порядке смещений) и подменить ими старые
+
+            Одновременно с писателем вызывать нельзя
+        """
+        records, data = self._view
+        size = len(data) if data is not None else 0
+        live = sum(sum(lengths) for _, *lengths in records.values())
+        if size - live <= max_garbage * size:
+            return False
+
+        writer = DocStoreWriter(self, rebuild=True)
+        for docno, (offset, *lengths) in sorted(records.items(), key=lambda item: item[1][0]):
+            writer.add_encoded(docno, data[offset:offset + sum(lengths)], lengths)
+        writer.commit()
+        return True
+
+    def close(self):
+        self._view = {}, None
+
+
+class DocStoreWriter(object):
+    """
+        Дописывает документы в хранилище; при rebuild=True пишет новые файлы
+          рядом и подменяет ими старые в commit(), так что уже отображённые
+          в память данные остаются читаемыми
+    """
+
+    def __init__(self, store: DocStore, rebuild: bool = False):
+        self.store = store
+        self.rebuild = rebuild
+
+        suffix = ".new" if rebuild else ""
+        self._data_path = store.data_path + suffix
+        self._idx_path = store.idx_path + suffix
+
+        mode = "wb" if rebuild else "ab"
+        self._data_file = open(self._data_path, mode)
+        self._idx_file = open(self._idx_path, mode)
+        self._offset = self._data_file.seek(0, os.SEEK_END)
+
+    def add(self, docno: str, title: str, text: str):
+        fields = [self.store.make_snippet(text), title, text]
+        encoded = [value.encode("utf-8") for value in fields]
+        self.add_encoded(docno, b"".join(encoded), [len(value) for value in encoded])
+
+    def add_encoded(self, docno: str, record: bytes, lengths):
+        """ Запись, уже закодированная подряд: snippet, title, text """
+        self._data_file.write(record)
+        lengths = "\t".join(str(length) for length in lengths)
+        self._idx_file.write(f"{docno}\t{self._offset}\t{lengths}\n".encode("utf-8"))
+        self._offset += len(record)
+
+    def delete(self, docno: str):
+        self._idx_file.write(f"{docno}\t-1\t0\t0\t0\n".encode("utf-8"))
+
+    def commit(self):
+        self._data_file.close()
+        self._idx_file.close()
+
+        if self.rebuild:
+            os.replace(self._data_path, self.store.data_path)
+            os.replace(self._idx_path, self.store.idx_path)
+
+        self.store.refresh()
@@ -1,12 +1,75 @@
 """ Setting up the interface for search engines for Cranfield """
+import csv
+import importlib
+import os
+from typing import Iterator, Tuple
+
+
+def read_documents(csv_file_path: str) -> Iterator[Tuple[str, str, str]]:
+    """ Читаем коллекцию построчно: (docno, title, text) """
+
+    with open(csv_file_path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+
+        # Пропускаем заголовок
+        next(reader)
+
+        for docno, title, text in reader:
+            yield docno.strip(), title.strip(), text.strip()
+
+
+# Движки по именам: модуль импортируется, только когда движок выбран, --
+#   иначе app.py и evaluate.py тянули бы зависимости всех движков сразу
+#   (pymorphy2 для whoosh, gensim для vector)
+ENGINES = {
+    "whoosh": "whoosh_searcher.WhooshEngine",
+    "array": "array_searcher.ArrayEngine",
+    "vector": "vector_searcher.VectorEngine",
+    "hybrid": "hybrid_searcher.HybridEngine"
+}
+
+
+def engine_class(name: str):
+    """ Класс движка по имени из ENGINES """
+    module_name, _, class_name = ENGINES[name].rpartition(".")
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+class IndexNotBuiltError(Exception):
+    """ Поиск до того, как индекс построен или загружен """
+
+
+class BadQueryError(ValueError):
+    """ Запрос, который движок не может разобрать или выполнить """
 
 
 class StoredIndexEngine(object):
     def __init__(self, index_storage_path: str = "indexdir"):
         self.ix_path = index_storage_path
+        # увеличивается после каждого (пере)индексирования
+        self.generation = 0
 
     def index(self, csv_file_path: str = "data/all.csv"):
         raise NotImplementedError
 
     def search(self, query: str, limit: int):
         raise NotImplementedError
+
+    def index_stats(self) -> dict:
+        """ Размер индекса для метрик: байты на диске (и документы, сегменты -- у наследников) """
+        size = 0
+        for root, _, files in os.walk(self.ix_path):
+            size += sum(os.path.getsize(os.path.join(root, name)) for name in files)
+        return {"size_bytes": size}
+
+    def before_fork(self):
+        """ Перед fork() рабочих процессов сервера: дождаться фоновых задач """
+        pass
+
+    def after_fork(self):
+        """ В рабочем процессе после fork(): переоткрыть то, что нельзя делить с родителем """
+        pass
+
+    def close(self):
+        """ Освобождение ресурсов (файлов, поисковиков), если они есть """
+        pass
@@ -0,0 +1,140 @@
+""" Прогон запросов Cranfield через движок: качество и скорость одной командой """
+import argparse
+import csv
+import json
+import logging
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from engine import ENGINES, StoredIndexEngine, engine_class
+
+
+def read_queries(path: str = "data/qry-ru.csv") -> List[Tuple[str, str]]:
+    """
+        (номер запроса, текст запроса в одну строку)
+
+        В qrel.json запросы пронумерованы подряд, с единицы,
+          а в qry-ru.csv остались исходные номера Cranfield с пропусками,
+          так что номер -- порядковый
+    """
+    with open(path, "r", encoding="utf-8") as f:
+        reader = csv.reader(f)
+        next(reader)
+        return [(str(i), " ".join(text.split())) for i, (_, text) in enumerate(reader, 1)]
+
+
+def read_qrels(path: str = "data/qrel.json") -> Dict[str, Dict[str, int]]:
+    """ номер запроса -> {docno: оценка релевантности}, нулевые оценки отбрасываем """
+    with open(path, "r", encoding="utf-8") as f:
+        raw = json.load(f)
+    return {qid: {str(j["i"]): j["r"] for j in judgements if j["r"] > 0}
+            for qid, judgements in raw.items()}
+
+
+def average_precision(ranked: List[str], relevant: Dict[str, int]) -> float:
+    if not relevant:
+        return 0.0
+    found, precision_sum = 0, 0.0
+    for k, docno in enumerate(ranked, 1):
+        if docno in relevant:
+            found += 1
+            precision_sum += found / k
+    return precision_sum / len(relevant)
+
+
+def ndcg_at_k(ranked: List[str], relevant: Dict[str, int], k: int = 10) -> float:
+    dcg = sum(relevant.get(docno, 0) / math.log2(i + 2) for i, docno in enumerate(ranked[:k]))
+    ideal = sorted(relevant.values(), reverse=True)[:k]
+    idcg = sum(grade / math.log2(i + 2) for i, grade in enumerate(ideal))
+    return dcg / idcg if idcg else 0.0
+
+
+def precision_at_k(ranked: List[str], relevant: Dict[str, int], k: int = 10) -> float:
+    return sum(1 for docno in ranked[:k] if docno in relevant) / k
+
+
+def recall(ranked: List[str], relevant: Dict[str, int]) -> float:
+    if not relevant:
+        return 0.0
+    return sum(1 for docno in ranked if docno in relevant) / len(relevant)
+
+
+def evaluate(engine: StoredIndexEngine,
+             queries: List[Tuple[str, str]],
+             qrels: Dict[str, Dict[str, int]],
+             depth: int = 100,
+             concurrency: int = 1,
+             warmup: int = 0) -> Dict[str, float]:
+    """
+        Все запросы прогоняются через engine.search с limit=depth
+          в `concurrency` потоков; MAP и recall считаются по глубине depth
+    """
+
+    def timed_search(query: str):
+        start_time = time.perf_counter()
+        hits = engine.search(query, limit=depth)
+        return [str(hit["id"]) for hit in hits], time.perf_counter() - start_time
+
+    # Прогреваем кэши (файловые, поисковиков и т.д.), время не учитываем
+    for _, query in queries[:warmup]:
+        engine.search(query, limit=depth)
+
+    start_time = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(lambda q: timed_search(q[1]), queries))
+    wall_time = time.perf_counter() - start_time
+
+    judged = [(qrels.get(qid, {}), ranked) for (qid, _), (ranked, _) in zip(queries, runs)]
+    latencies = np.array([latency for _, latency in runs]) * 1000.0
+
+    return {
+        "queries": len(queries),
+        "MAP": float(np.mean([average_precision(r, rel) for rel, r in judged])),
+        "nDCG@10": float(np.mean([ndcg_at_k(r, rel, 10) for rel, r in judged])),
+        "P@10": float(np.mean([precision_at_k(r, rel, 10) for rel, r in judged])),
+        f"recall@{depth}": float(np.mean([recall(r, rel) for rel, r in judged])),
+        "QPS": len(queries) / wall_time,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "p99_ms": float(np.percentile(latencies, 99)),
+    }
+
+
+if __name__ == "__main__":
+    """
+        python evaluate.py --engine array --concurrency 4
+    """
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--engine", choices=sorted(ENGINES), default="whoosh")
+    arg_parser.add_argument("--index-path", default=None)
+    arg_parser.add_argument("--documents", default="data/all-ru.csv")
+    arg_parser.add_argument("--queries", default="data/qry-ru.csv")
+    arg_parser.add_argument("--qrels", default="data/qrel.json")
+    arg_parser.add_argument("--depth", type=int, default=100)
+    arg_parser.add_argument("--concurrency", type=int, default=1)
+    arg_parser.add_argument("--warmup", type=int, default=10)
+    args = arg_parser.parse_args()
+
+    engine_type = engine_class(args.engine)
+    engine = engine_type(args.index_path) if args.index_path else engine_type()
+
+    if not engine.ix:
+        engine.index(args.documents)
+
+    # Логирование каждого запроса исказит замеры
+    logging.getLogger().setLevel(logging.WARNING)
+
+    report = evaluate(engine,
+                      read_queries(args.queries),
+                      read_qrels(args.qrels),
+                      depth=args.depth,
+                      concurrency=args.concurrency,
+                      warmup=args.warmup)
+    engine.close()
+
+    for metric, value in report.items():
+        print(f"{metric:>12}\t{value:.4f}" if isinstance(value, float) else f"{metric:>12}\t{value}")
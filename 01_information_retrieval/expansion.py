@@ -0,0 +1,212 @@
+""" Расширение запроса синонимами из заранее собранной таблицы """
+import argparse
+import logging
+import mmap
+import os
+from collections import defaultdict
+from typing import Dict, List, Tuple
+
+import numpy as np
+from whoosh.query import Or, Query, Term
+
+from lemmatizer import flush_lemma_cache, get_lemma_cache
+
+
+class ExpansionTable(object):
+    """
+        Таблица терм -> [(расширение, вес)], отображённая в память:
+          expansions.dat -- строки "терм<TAB>расширение:вес,..." по возрастанию
+          байтов терма, expansions.idx.npy -- смещения начал строк;
+          поиск -- двоичный, в память ничего не загружается
+    """
+
+    def __init__(self, path: str):
+        self.data_path = os.path.join(path, "expansions.dat")
+        self.offsets = np.load(os.path.join(path, "expansions.idx.npy"), mmap_mode="r")
+
+        self._data = b""
+        if os.path.getsize(self.data_path) > 0:
+            with open(self.data_path, "rb") as f:
+                self._data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def _line(self, i: int) -> bytes:
+        return self._data[self.offsets[i]:self.offsets[i + 1] - 1]
+
+    def lookup(self, term: str) -> List[Tuple[str, float]]:
+        key = term.encode("utf-8")
+        lo, hi = 0, len(self)
+
+        while lo < hi:
+            mid = (lo + hi) // 2
+            line = self._line(mid)
+            current = line[:line.index(b"\t")]
+
+            if current == key:
+                expansions = line[len(key) + 1:].decode("utf-8")
+                return [(word, float(weight)) for word, weight in
+                        (item.rsplit(":", 1) for item in expansions.split(","))]
+            if current < key:
+                lo = mid + 1
+            else:
+                hi = mid
+
+        return []
+
+    @staticmethod
+    def build(path: str, expansions: Dict[str, Dict[str, float]], max_per_term: int = 10):
+        """ Записываем таблицу; у каждого терма -- самые весомые расширения """
+        os.makedirs(path, exist_ok=True)
+        offsets = [0]
+
+        with open(os.path.join(path, "expansions.dat"), "wb") as wf:
+            for term in sorted(expansions, key=lambda t: t.encode("utf-8")):
+                best = sorted(expansions[term].items(), key=lambda x: -x[1])[:max_per_term]
+                if not best:
+                    continue
+                items = ",".join(f"{word}:{weight:.3f}" for word, weight in best)
+                line = f"{term}\t{items}\n".encode("utf-8")
+                wf.write(line)
+                offsets.append(offsets[-1] + len(line))
+
+        np.save(os.path.join(path, "expansions.idx.npy"), np.array(offsets, dtype=np.int64))
+
+
+def is_single_word(word: str) -> bool:
+    # в таблице -- только отдельные слова, без разделителей формата
+    return bool(word) and not any(c in word for c in " \t,:")
+
+
+def synonyms_from_dictionary(path: str, weight: float = 1.0) -> Dict[str, Dict[str, float]]:
+    """
+        Словарь синонимов: строки "слово<TAB>синоним1,синоним2,...";
+          всё лемматизируется, словосочетания пропускаются
+    """
+    expansions = defaultdict(dict)
+    lemma_cache = get_lemma_cache()
+
+    with open(path, "r", encoding="utf-8") as rf:
+        for line in rf:
+            word, _, synonyms = line.strip().lower().partition("\t")
+            if not is_single_word(word):
+                continue
+            word = lemma_cache(word)
+            for synonym in synonyms.split(","):
+                synonym = synonym.strip()
+                if is_single_word(synonym) and lemma_cache(synonym) != word:
+                    expansions[word][lemma_cache(synonym)] = weight
+
+    return expansions
+
+
+def synonyms_from_vectors(model_path: str, topn: int = 5, min_similarity: float = 0.6,
+                          max_vocab: int = 50000, batch_size: int = 1024) -> Dict[str, Dict[str, float]]:
+    """ Ближайшие соседи по косинусу для самых частотных слов модели, вес -- близость """
+    from gensim.utils import SaveLoad
+
+    model = SaveLoad.load(model_path)
+    wv = getattr(model, "wv", model)
+    words = wv.index_to_key[:max_vocab]
+    vectors = wv.get_normed_vectors()[:len(words)]
+
+    expansions = defaultdict(dict)
+
+    for start in range(0, len(words), batch_size):
+        similarities = vectors[start:start + batch_size] @ vectors.T
+        # самого себя исключаем
+        similarities[np.arange(len(similarities)), np.arange(start, start + len(similarities))] = -1.0
+        top = np.argpartition(-similarities, topn, axis=1)[:, :topn]
+
+        for row, neighbours in enumerate(top):
+            word = words[start + row]
+            for j in neighbours:
+                if similarities[row, j] >= min_similarity and is_single_word(words[j]):
+                    expansions[word][words[j]] = float(similarities[row, j])
+
+    return expansions
+
+
+# Настройки QueryExpander из переменных окружения: параметр -> (переменная, тип)
+EXPANDER_SETTINGS = {
+    "weight": ("EXPANSION_WEIGHT", float),
+    "max_weight": ("EXPANSION_MAX_WEIGHT", float),
+    "max_per_term": ("EXPANSION_MAX_PER_TERM", int),
+    "max_clauses": ("EXPANSION_MAX_CLAUSES", int)
+}
+
+
+def expander_settings_from_env() -> Dict[str, float]:
+    """ Только заданные переменные; для остальных -- умолчания QueryExpander """
+    return {name: kind(os.environ[variable])
+            for name, (variable, kind) in EXPANDER_SETTINGS.items() if variable in os.environ}
+
+
+class QueryExpander(object):
+    """
+        Каждый терм запроса заменяется на OR(терм, расширения...):
+          вес расширения = min(weight * вес из таблицы, max_weight) * вес терма;
+          на терм не больше `max_per_term` расширений, а всего в запросе --
+          не больше `max_clauses` термов, так что время поиска предсказуемо
+    """
+
+    def __init__(self, table: ExpansionTable, weight: float = 0.5, max_weight: float = 0.5,
+                 max_per_term: int = 3, max_clauses: int = 64):
+        self.table = table
+        self.weight = weight
+        self.max_weight = max_weight
+        self.max_per_term = max_per_term
+        self.max_clauses = max_clauses
+
+    def expand(self, query: Query) -> Query:
+        budget = self.max_clauses - sum(1 for _ in query.leaves())
+
+        def expand_term(q: Query) -> Query:
+            nonlocal budget
+
+            if not isinstance(q, Term) or budget <= 0:
+                return q
+
+            alternatives = [Term(q.fieldname, word, boost=min(self.weight * w, self.max_weight) * q.boost)
+                            for word, w in self.table.lookup(q.text)[:min(self.max_per_term, budget)]]
+            if not alternatives:
+                return q
+
+            budget -= len(alternatives)
+            return Or([q] + alternatives)
+
+        return query.accept(expand_term)
+
+
+if __name__ == "__main__":
+    """
+        python expansion.py --synonyms synonyms.tsv \\
+                            --model ../05_distributional_semantics/word2vec.model
+    """
+    logging.basicConfig(level=logging.INFO)
+
+    arg_parser = argparse.ArgumentParser(description=__doc__)
+    arg_parser.add_argument("--synonyms", default=None, help="word<TAB>syn1,syn2,... per line")
+    arg_parser.add_argument("--model", default=None, help="gensim model saved with .save()")
+    arg_parser.add_argument("--topn", type=int, default=5)
+    arg_parser.add_argument("--min-similarity", type=float, default=0.6)
+    arg_parser.add_argument("--output", default="expansions")
+    args = arg_parser.parse_args()
+
+    table = defaultdict(dict)
+    sources = []
+
+    if args.model:
+        sources.append(synonyms_from_vectors(args.model, args.topn, args.min_similarity))
+    # словарные синонимы важнее соседей по векторам, поэтому идут последними
+    if args.synonyms:
+        sources.append(synonyms_from_dictionary(args.synonyms))
+
+    for source in sources:
+        for term, expansions in source.items():
+            table[term].update(expansions)
+
+    ExpansionTable.build(args.output, table)
+    flush_lemma_cache()
+    logging.info(f"{len(ExpansionTable(args.output))} terms written to {args.output}")
@@ -0,0 +1,143 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+from engine import StoredIndexEngine
+from metrics import STAGE_SECONDS, log_sampled
+from vector_searcher import DEFAULT_MODEL, DocumentEmbedder
+from whoosh_searcher import WhooshEngine
+
+
+class VectorCache(object):
+    """ LRU-кэш векторов документов-кандидатов: docno -> вектор """
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._vectors: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, docno: str):
+        with self._lock:
+            vector = self._vectors.get(docno)
+            if vector is not None:
+                self._vectors.move_to_end(docno)
+            return vector
+
+    def put(self, docno: str, vector: np.ndarray):
+        with self._lock:
+            self._vectors[docno] = vector
+            self._vectors.move_to_end(docno)
+            while len(self._vectors) > self.max_entries:
+                self._vectors.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._vectors.clear()
+
+
+class HybridEngine(StoredIndexEngine):
+    """
+        Двухэтапный поиск:
+          1) BM25 (Whoosh, слова через OR) отбирает `candidates` документов;
+          2) только они переранжируются по косинусной близости векторов,
+             итоговый порядок -- reciprocal rank fusion двух ранжирований:
+             score = 1 / (rrf_k + лексический ранг) + 1 / (rrf_k + векторный ранг)
+
+        У каждого этапа свой бюджет времени (мс): если отбор кандидатов
+          его превысил, переранжирования не будет; если переранжирование
+          не уложилось, оставшиеся кандидаты получают только лексическую часть оценки
+    """
+
+    def __init__(self,
+                 index_path="indexdir",
+                 model_path: str = None,
+                 candidates: int = 100,
+                 rrf_k: int = 60,
+                 lexical_budget_ms: float = 100.0,
+                 rerank_budget_ms: float = 50.0,
+                 vector_cache_size: int = 10000):
+        super().__init__(index_storage_path=index_path)
+        self.lexical = WhooshEngine(index_path, or_group=True)
+        self.embedder = DocumentEmbedder(model_path or os.environ.get("VECTOR_MODEL", DEFAULT_MODEL))
+        self.vectors = VectorCache(vector_cache_size)
+
+        self.candidates = candidates
+        self.rrf_k = rrf_k
+        self.lexical_budget_ms = lexical_budget_ms
+        self.rerank_budget_ms = rerank_budget_ms
+
+    @property
+    def ix(self):
+        return self.lexical.ix
+
+    def index(self, *args, **kwargs):
+        self.lexical.index(*args, **kwargs)
+        self.vectors.clear()
+        self.generation += 1
+
+    def _document_vector(self, hit) -> np.ndarray:
+        vector = self.vectors.get(hit["id"])
+        if vector is None:
+            vector = self.embedder.embed(f'{hit["title"]} {hit["text"]}')
+            self.vectors.put(hit["id"], vector)
+        return vector
+
+    def search(self, query_string: str, limit: int = 10):
+        start_time = time.perf_counter()
+        candidates = self.lexical.search(query_string, limit=max(limit, self.candidates))
+        lexical_ms = (time.perf_counter() - start_time) * 1000.0
+
+        rerank_start = time.perf_counter()
+        fused = np.array([1.0 / (self.rrf_k + rank + 1) for rank in range(len(candidates))])
+
+        # если ни одного слова запроса нет в модели, векторный порядок
+        #   ничего не значит -- остаётся лексический
+        query = self.embedder.embed(query_string) \
+            if candidates and lexical_ms <= self.lexical_budget_ms else None
+
+        if query is not None and query.any():
+            deadline = rerank_start + self.rerank_budget_ms / 1000.0
+
+            # векторы кандидатов в лексическом порядке, пока хватает времени
+            similarities = []
+            for hit in candidates:
+                if time.perf_counter() > deadline:
+                    break
+                similarities.append(float(self._document_vector(hit) @ query))
+
+            dense_order = np.argsort(-np.array(similarities), kind="stable")
+            fused[dense_order] += 1.0 / (self.rrf_k + np.arange(len(dense_order)) + 1)
+            reranked = len(similarities)
+        else:
+            reranked = 0
+
+        rerank_ms = (time.perf_counter() - rerank_start) * 1000.0
+        STAGE_SECONDS.observe(rerank_ms / 1000.0, stage="rerank")
+        if log_sampled():
+            logging.info(f"q:[{query_string}] lexical={lexical_ms:.1f}ms "
+                         f"rerank={rerank_ms:.1f}ms ({reranked}/{len(candidates)} candidates)")
+
+        order = np.argsort(-fused, kind="stable")[:limit]
+        return [self.lexical.docs.get(candidates[i]["id"],
+                                      rank=rank,
+                                      score=float(fused[i]),
+                                      docnum=candidates[i]["docnum"],
+                                      # сниппет кандидата строится, только если его покажут
+                                      lazy={"snippet": lambda _, hit=candidates[i]: hit["snippet"]})
+                for rank, i in enumerate(order)]
+
+    def index_stats(self) -> dict:
+        return self.lexical.index_stats()
+
+    def before_fork(self):
+        self.lexical.before_fork()
+
+    def after_fork(self):
+        self.lexical.after_fork()
+
+    def close(self):
+        self.lexical.close()
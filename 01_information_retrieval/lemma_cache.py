@@ -0,0 +1,124 @@
+""" Кэш лемм на диске: словарь слово -> лемма, общий для процессов и перезапусков """
+import atexit
+import os
+import threading
+from multiprocessing.util import Finalize
+from typing import Dict, List, Tuple
+
+# Анализатор pymorphy2 создаётся (и сам pymorphy2 импортируется) при первом
+#   разборе слова, которого нет в кэше
+_morph = None
+_morph_lock = threading.Lock()
+
+
+def get_morph():
+    global _morph
+    with _morph_lock:
+        if _morph is None:
+            from pymorphy2 import MorphAnalyzer
+            _morph = MorphAnalyzer()
+        return _morph
+
+
+class LemmaCache(object):
+    """
+        Словарь слово -> лемма, общий для всех сборок индекса и перезапусков
+          приложения; опирается на то, что лемма не зависит от контекста
+
+        На диске это журнал строк "слово<TAB>лемма", в который только дописывают
+          (O_APPEND): дописывать могут сразу несколько процессов, например,
+          процессы многопроцессного писателя Whoosh
+
+        Тот же кэш использует лемматизация корпусов в 03_information_theory:
+          леммы там считают процессы пула, а в кэш их добавляет update()
+    """
+
+    def __init__(self, path: str = "lemmas.tsv", flush_every: int = 10000):
+        self.path = path
+        self.flush_every = flush_every
+
+        self._lemmas: Dict[str, str] = {}
+        self._pending: List[Tuple[str, str]] = []
+        self._lock = threading.Lock()
+
+        if os.path.exists(self.path):
+            lines = 0
+            with open(self.path, "r", encoding="utf-8") as rf:
+                for line in rf:
+                    word, _, lemma = line.rstrip("\n").partition("\t")
+                    if lemma:
+                        self._lemmas[word] = lemma
+                    lines += 1
+
+            # Процессы могли записать одни и те же слова, ужимаем журнал
+            if lines > 2 * len(self._lemmas):
+                self._compact()
+
+        # В дочерних процессах multiprocessing atexit не срабатывает;
+        #   os.register_at_fork срабатывает и для них, и для рабочих процессов gunicorn
+        atexit.register(self.flush)
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _compact(self):
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as wf:
+            wf.writelines(f"{word}\t{lemma}\n" for word, lemma in self._lemmas.items())
+        os.replace(tmp_path, self.path)
+
+    def _after_fork(self):
+        # несохранённое принадлежит родителю, он и запишет
+        self._pending = []
+        self._lock = threading.Lock()
+        Finalize(self, self.flush, exitpriority=10)
+
+    def __len__(self):
+        return len(self._lemmas)
+
+    def __call__(self, word: str) -> str:
+        lemma = self._lemmas.get(word)
+
+        if lemma is None:
+            lemma = get_morph().parse(word)[0].normal_form
+
+            with self._lock:
+                self._lemmas[word] = lemma
+                self._pending.append((word, lemma))
+
+                if len(self._pending) >= self.flush_every:
+                    self._flush()
+
+        return lemma
+
+    def lemmas(self) -> Dict[str, str]:
+        """ Копия словаря, например, для процессов пула """
+        with self._lock:
+            return dict(self._lemmas)
+
+    def update(self, lemmas: Dict[str, str]):
+        """ Добавить леммы, посчитанные не через этот кэш """
+        with self._lock:
+            for word, lemma in lemmas.items():
+                if self._lemmas.get(word) != lemma:
+                    self._lemmas[word] = lemma
+                    self._pending.append((word, lemma))
+
+            if len(self._pending) >= self.flush_every:
+                self._flush()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+
+        data = "".join(f"{word}\t{lemma}\n" for word, lemma in self._pending).encode("utf-8")
+        # одна запись в режиме O_APPEND не перемешается с записями других процессов
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, data)
+        finally:
+            os.close(fd)
+
+        self._pending = []
@@ -0,0 +1,43 @@
+""" Лемматизация для индексирования и разбора запросов, с кэшем лемм на диске """
+import os
+import threading
+
+from whoosh.analysis import Filter, LowercaseFilter, RegexTokenizer
+
+from lemma_cache import LemmaCache
+
+# Кэш лемм создаётся при первой лемматизации, а не при импорте: движкам без
+#   лемматизации (array) не нужны ни словари pymorphy2, ни файл кэша
+_lemma_cache: LemmaCache = None
+_init_lock = threading.Lock()
+
+
+def get_lemma_cache() -> LemmaCache:
+    """ Общий для процесса кэш лемм; файл -- переменная окружения LEMMA_CACHE """
+    global _lemma_cache
+    with _init_lock:
+        if _lemma_cache is None:
+            _lemma_cache = LemmaCache(os.environ.get("LEMMA_CACHE", "lemmas.tsv"))
+        return _lemma_cache
+
+
+def flush_lemma_cache():
+    """ Дописать новые леммы на диск, если кэш вообще создавался """
+    if _lemma_cache is not None:
+        _lemma_cache.flush()
+
+
+class LemmaFilter(Filter):
+    """ Заменяет каждый токен его нормальной формой (pymorphy2) """
+
+    def __call__(self, tokens):
+        # сам фильтр хранится в схеме индекса (pickle), так что кэш -- не в нём
+        lemmatize = get_lemma_cache()
+        for t in tokens:
+            t.text = lemmatize(t.text)
+            yield t
+
+
+def LemmaAnalyzer():
+    """ Токенизация по словам, нижний регистр, лемматизация """
+    return RegexTokenizer() | LowercaseFilter() | LemmaFilter()
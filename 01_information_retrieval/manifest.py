@@ -0,0 +1,43 @@
+""" Что уже лежит в индексе: отпечаток исходного файла и хэши документов """
+import hashlib
+import json
+import os
+from typing import Dict
+
+
+def content_hash(title: str, text: str) -> str:
+    return hashlib.blake2b(f"{title}\x00{text}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+def file_fingerprint(path: str) -> dict:
+    stat = os.stat(path)
+    return {"path": os.path.abspath(path), "size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+class IndexManifest(object):
+    """
+        Хранится в папке индекса как manifest.json:
+          source -- отпечаток CSV, из которого индекс строился в последний раз,
+          hashes -- docno -> хэш заголовка и текста
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.source: dict = {}
+        self.hashes: Dict[str, str] = {}
+
+        if os.path.exists(self.path):
+            with open(self.path, "r", encoding="utf-8") as rf:
+                data = json.load(rf)
+            self.source, self.hashes = data["source"], data["hashes"]
+
+    def is_unchanged(self, csv_file: str) -> bool:
+        return bool(self.source) and self.source == file_fingerprint(csv_file)
+
+    def save(self, csv_file: str):
+        self.source = file_fingerprint(csv_file)
+
+        tmp_path = self.path + ".new"
+        with open(tmp_path, "w", encoding="utf-8") as wf:
+            json.dump({"source": self.source, "hashes": self.hashes}, wf)
+        os.replace(tmp_path, self.path)
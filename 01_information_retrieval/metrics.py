@@ -0,0 +1,155 @@
+""" Метрики поиска в текстовом формате Prometheus: гистограммы задержек и датчики """
+import os
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterator, List, Tuple
+
+# Границы корзин в секундах: от 0.1 мс до 2.5 с
+DEFAULT_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01,
+                   0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+# Доля запросов, которые попадают в лог целиком (с номерами найденных документов)
+QUERY_LOG_SAMPLE = float(os.environ.get("QUERY_LOG_SAMPLE", 0.01))
+
+
+def log_sampled() -> bool:
+    """ Писать ли в лог этот запрос: под нагрузкой лог не должен тормозить поиск """
+    return random.random() < QUERY_LOG_SAMPLE
+
+
+def format_labels(labels: Dict[str, str]) -> str:
+    if not labels:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+               for v in labels.values())
+    return "{" + ",".join(f'{k}="{v}"' for k, v in zip(labels, escaped)) + "}"
+
+
+class Histogram(object):
+    """
+        Гистограмма с фиксированными корзинами; у каждого набора меток
+          свои счётчики. Метрики у каждого процесса свои: под gunicorn
+          /metrics показывает тот рабочий процесс, который ответил
+    """
+
+    def __init__(self, name: str, documentation: str, buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+
+        # метки -> (счётчики по корзинам, сумма, количество)
+        self._series: Dict[Tuple[Tuple[str, str], ...], List] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(sorted(labels.items()))
+        # последняя корзина -- +Inf
+        i = bisect_left(self.buckets, value)
+
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][i] += 1
+            series[1] += value
+            series[2] += 1
+
+    @contextmanager
+    def time(self, **labels) -> Iterator[None]:
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, **labels)
+
+    def collect(self) -> List[str]:
+        with self._lock:
+            series = [(key, list(counts), total, count)
+                      for key, (counts, total, count) in self._series.items()]
+
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        for key, counts, total, count in sorted(series):
+            labels = dict(key)
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{self.name}_bucket{format_labels({**labels, 'le': le})} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(labels)} {total}")
+            lines.append(f"{self.name}_count{format_labels(labels)} {count}")
+        return lines
+
+
+class Gauge(object):
+    """
+        Значение считается в момент запроса /metrics: функция -> {метки: значение};
+          kind="counter" -- для уже накопленных где-то счётчиков (имя на _total)
+    """
+
+    def __init__(self, name: str, documentation: str,
+                 function: Callable[[], Dict[Tuple[Tuple[str, str], ...], float]],
+                 kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.function = function
+        self.kind = kind
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for key, value in sorted(self.function().items()):
+            lines.append(f"{self.name}{format_labels(dict(key))} {float(value)}")
+        return lines
+
+
+class Registry(object):
+    """ Все метрики процесса; render() -- ответ для /metrics """
+
+    CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+        # результаты per_scrape-функций текущего render() в этом потоке
+        self._local = threading.local()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics[metric.name] = metric
+        return metric
+
+    def render(self) -> str:
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        self._local.scrape = {}
+        try:
+            return "\n".join(line for metric in metrics for line in metric.collect()) + "\n"
+        finally:
+            del self._local.scrape
+
+    def per_scrape(self, function: Callable[[], dict]) -> Callable[[], dict]:
+        """
+            Функция, которая за один render() вызывается один раз, сколько бы
+              датчиков ни брали из неё значения (например, index_stats движка)
+        """
+        def collect():
+            scrape = getattr(self._local, "scrape", None)
+            if scrape is None:
+                return function()
+            if function not in scrape:
+                scrape[function] = function()
+            return scrape[function]
+        return collect
+
+
+registry = Registry()
+
+# Этапы: parse -- разбор запроса, search -- поиск и ранжирование,
+#   fetch -- хранимые поля выдачи и сниппеты, rerank -- второй этап hybrid,
+#   render -- шаблон или JSON (заголовки и тексты из DocStore читаются лениво, здесь же)
+STAGE_SECONDS = registry.register(
+    Histogram("search_stage_seconds", "Time spent in each stage of a search request")
+)
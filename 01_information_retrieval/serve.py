@@ -0,0 +1,70 @@
+"""
+    Продакшн-запуск приложения под gunicorn:
+
+        python serve.py
+        gunicorn -c serve.py app:app
+
+    Приложение (и индекс) загружается один раз в главном процессе (preload_app),
+      рабочие процессы получают его через fork(): массивы индексов отображены
+      в память и общие, остальное делится копированием при записи.
+      Число процессов -- по числу ядер, в каждом -- несколько потоков
+
+    Настройки -- переменными окружения: BIND, WEB_CONCURRENCY, WEB_THREADS,
+      WEB_TIMEOUT, а также SEARCH_ENGINE и прочие из app.py
+"""
+import multiprocessing
+import os
+
+from gunicorn.app.base import BaseApplication
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+threads = int(os.environ.get("WEB_THREADS", 4))
+worker_class = "gthread"
+preload_app = True
+timeout = int(os.environ.get("WEB_TIMEOUT", 30))
+# по SIGTERM рабочие процессы дорабатывают начатые запросы
+graceful_timeout = 30
+keepalive = 5
+
+
+def on_starting(server):
+    # индекс строится один раз, в главном процессе, до fork() рабочих процессов;
+    #   сами рабочие процессы его не строят, а отвечают 503 (см. app.py)
+    os.environ["INDEX_ON_REQUEST"] = "0"
+    from app import build_index
+    build_index()
+
+
+def pre_fork(server, worker):
+    from app import engine
+    engine.before_fork()
+
+
+def post_fork(server, worker):
+    from app import engine
+    engine.after_fork()
+    server.log.info(f"Worker {worker.pid} ready")
+
+
+def worker_exit(server, worker):
+    # пул поисковиков и кэш лемм закрываются в каждом процессе
+    from app import engine
+    engine.close()
+
+
+class SearchApplication(BaseApplication):
+    """ gunicorn с настройками из этого модуля, без отдельного конфига """
+
+    def load_config(self):
+        settings = {key: value for key, value in globals().items() if key in self.cfg.settings}
+        for key, value in settings.items():
+            self.cfg.set(key, value)
+
+    def load(self):
+        from app import app
+        return app
+
+
+if __name__ == "__main__":
+    SearchApplication().run()
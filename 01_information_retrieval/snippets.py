@@ -0,0 +1,110 @@
+""" Сниппеты с подсветкой слов запроса по смещениям, сохранённым в индексе """
+import threading
+from collections import OrderedDict, defaultdict
+from itertools import groupby
+from typing import Dict, FrozenSet, Iterable, Tuple
+
+from markupsafe import Markup, escape
+from whoosh.analysis import Token
+from whoosh.highlight import BasicFragmentScorer, HtmlFormatter, PinpointFragmenter
+from whoosh.searching import Searcher
+
+from docstore import StoredDocument
+
+# терм -> ((позиция, первый символ, символ за последним), ...) в тексте документа
+Spans = Dict[str, Tuple[Tuple[int, int, int], ...]]
+
+
+def matched_spans(searcher: Searcher, fieldname: str,
+                  hits: Iterable[Tuple[int, FrozenSet[str]]]) -> Dict[int, Spans]:
+    """
+        Смещения совпавших термов в документах выдачи: (docnum, термы) -> {docnum: Spans}
+
+        Поле индексируется с chars=True, так что смещения лежат прямо
+          в постингах; как Highlighter._load_chars у Whoosh, на каждый терм --
+          один проход по его списку постингов, текст не читается и не разбирается
+    """
+    field = searcher.schema[fieldname]
+    docnums = defaultdict(list)
+    spans = {}
+    for docnum, terms in hits:
+        spans[docnum] = {}
+        for term in terms:
+            docnums[term].append(docnum)
+
+    for term, term_docnums in docnums.items():
+        matcher = searcher.postings(fieldname, field.to_bytes(term))
+        for docnum in sorted(term_docnums):
+            if not matcher.is_active():
+                break
+            matcher.skip_to(docnum)
+            if matcher.is_active() and matcher.id() == docnum:
+                spans[docnum][term] = tuple(matcher.value_as("characters"))
+
+    return spans
+
+
+class SnippetBuilder(object):
+    """
+        Лучший фрагмент текста с подсвеченными словами запроса
+
+        Смещения совпавших слов берутся из постингов, пока поисковик ещё
+          в руках (matched_spans), а сниппет строится при первом обращении
+          к полю snippet (см. StoredDocument): текст читается из DocStore
+          и режется по этим смещениям, ничего не токенизируя заново. Для
+          документов, которые не показываются (API без поля snippet,
+          кандидаты hybrid), текст не читается вовсе.
+          Кэш: (docno, совпавшие термы) -> сниппет
+    """
+
+    def __init__(self, fieldname: str, maxchars: int = 250, surround: int = 60,
+                 cache_size: int = 10000):
+        self.fieldname = fieldname
+        self.fragmenter = PinpointFragmenter(maxchars=maxchars, surround=surround, autotrim=True)
+        self.scorer = BasicFragmentScorer()
+        self.formatter = HtmlFormatter(tagname="b")
+        self.cache_size = cache_size
+
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, document: StoredDocument, spans: Spans) -> Markup:
+        key = (document["id"], frozenset(spans))
+
+        with self._lock:
+            snippet = self._cache.get(key)
+            if snippet is not None:
+                self._cache.move_to_end(key)
+                return snippet
+
+        fragment = self.highlight(document[self.fieldname], spans) if spans else ""
+
+        # Слова запроса нашлись только в заголовке -- берём начало текста
+        snippet = Markup(fragment) if fragment else escape(document.stored("snippet"))
+
+        with self._lock:
+            self._cache[key] = snippet
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+        return snippet
+
+    def highlight(self, text: str, spans: Spans) -> str:
+        # токены совпавших слов -- как в Highlighter.highlight_hit у Whoosh
+        charlimit = self.fragmenter.charlimit
+        tokens = sorted((Token(text=term, pos=pos, startchar=startchar, endchar=endchar)
+                         for term, term_spans in spans.items()
+                         for pos, startchar, endchar in term_spans
+                         if not charlimit or endchar <= charlimit),
+                        key=lambda t: t.startchar)
+        tokens = [max(group, key=lambda t: t.endchar - t.startchar)
+                  for _, group in groupby(tokens, lambda t: t.startchar)]
+
+        # лучший фрагмент, при равных оценках -- первый (top_fragments у Whoosh
+        #   разрешает равенство по id() объектов, то есть как повезёт)
+        best = max(self.fragmenter.fragment_matches(text, tokens), key=self.scorer, default=None)
+        return self.formatter.format([best]) if best is not None else ""
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
@@ -0,0 +1,105 @@
+""" Проверки API в app.py: python -m pytest test_app.py """
+import csv
+
+import pytest
+
+import app
+from array_searcher import ArrayEngine
+from cache import CachedEngine, QueryCache
+
+DOCUMENTS = [
+    ("1", "крыло", "поток воздуха над крылом"),
+    ("2", "поток", "поток за крылом"),
+    ("3", "сопло", "течение в сопле"),
+]
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    with open(tmp_path / "docs.csv", "w", encoding="utf-8", newline="") as wf:
+        writer = csv.writer(wf)
+        writer.writerow(["docno", "title", "text"])
+        writer.writerows(DOCUMENTS)
+
+    engine = CachedEngine(ArrayEngine(str(tmp_path / "arrayindex"), prune_min_docs=0), QueryCache())
+    engine.index(str(tmp_path / "docs.csv"))
+    monkeypatch.setattr(app, "engine", engine)
+    return app.app.test_client()
+
+
+def test_search_by_query_string_and_json(client):
+    response = client.get("/api/search", query_string={"q": "поток", "fields": "id,title"})
+    assert response.status_code == 200
+    results = response.get_json()["results"]
+    assert {hit["id"] for hit in results} == {"1", "2"}
+    assert all(set(hit) == {"id", "title"} for hit in results)
+
+    response = client.post("/api/search", json={"q": "сопло", "limit": 1, "fields": ["id"]})
+    assert response.status_code == 200
+    assert response.get_json()["results"] == [{"id": "3"}]
+
+
+@pytest.mark.parametrize("body", [["поток"], "поток", 3, None])
+def test_search_rejects_json_that_is_not_an_object(client, body):
+    response = client.post("/api/search", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+@pytest.mark.parametrize("params", [
+    {"q": ""},
+    {"q": "поток", "limit": 0},
+    {"q": "поток", "limit": "много"},
+    {"q": "поток", "offset": [1]},
+    {"q": "поток", "fields": ["id", "password"]},
+    {"q": "поток", "fields": {"id": 1}},
+])
+def test_search_rejects_bad_params(client, params):
+    response = client.post("/api/search", json=params)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batch_answers_every_query(client):
+    response = client.post("/api/batch", json={"queries": ["поток", "сопло"], "fields": ["id"]})
+    assert response.status_code == 200
+    responses = response.get_json()["responses"]
+    assert [r["query"] for r in responses] == ["поток", "сопло"]
+    assert responses[1]["results"] == [{"id": "3"}]
+
+
+@pytest.mark.parametrize("body", [
+    ["поток"],
+    "поток",
+    {"queries": "abc"},
+    {"queries": {"q": "поток"}},
+    {"queries": ["поток", 3]},
+    {"queries": []},
+    {"queries": ["поток", " "]},
+    {"queries": ["поток"] * (app.API_MAX_BATCH + 1)},
+    {"queries": ["поток"], "limit": app.API_MAX_LIMIT + 1},
+])
+def test_batch_rejects_malformed_bodies(client, body):
+    response = client.post("/api/batch", json=body)
+    assert response.status_code == 400
+    assert "error" in response.get_json()
+
+
+def test_batch_rejects_body_that_is_not_json(client):
+    response = client.post("/api/batch", data="queries=поток")
+    assert response.status_code == 400
+
+
+def test_worker_without_index_answers_503(tmp_path, monkeypatch):
+    engine = CachedEngine(ArrayEngine(str(tmp_path / "arrayindex")), QueryCache())
+    monkeypatch.setattr(app, "engine", engine)
+    # как в рабочем процессе gunicorn: индекс строит только главный процесс
+    monkeypatch.setenv("INDEX_ON_REQUEST", "0")
+    monkeypatch.setattr(app, "start_indexing", lambda: pytest.fail("worker started a build"))
+    client = app.app.test_client()
+
+    assert client.get("/ready").status_code == 503
+    assert client.get("/api/search", query_string={"q": "поток"}).status_code == 503
+    assert client.post("/api/batch", json={"queries": ["поток"]}).status_code == 503
+    assert client.post("/", data={"query": "поток"}).status_code == 503
+    assert client.get("/metrics").status_code == 200
@@ -0,0 +1,82 @@
+""" Проверки ArrayEngine: python -m pytest test_array_searcher.py """
+import csv
+import os
+import subprocess
+import sys
+
+import numpy as np
+import pytest
+
+from array_searcher import ArrayEngine
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def write_collection(path, n_docs=400, vocabulary=300, seed=0):
+    """ Коллекция со словами по закону Ципфа: у частых термов длинные списки постингов """
+    rng = np.random.default_rng(seed)
+    words = [f"w{i}" for i in range(vocabulary)]
+    weights = 1.0 / np.arange(1, vocabulary + 1)
+    weights /= weights.sum()
+
+    with open(path, "w", encoding="utf-8", newline="") as wf:
+        writer = csv.writer(wf)
+        writer.writerow(["docno", "title", "text"])
+        for docno in range(1, n_docs + 1):
+            title = " ".join(rng.choice(words, 3, p=weights))
+            text = " ".join(rng.choice(words, int(rng.integers(5, 80)), p=weights))
+            writer.writerow([docno, title, text])
+    return words
+
+
+@pytest.fixture(scope="module")
+def collection(tmp_path_factory):
+    path = tmp_path_factory.mktemp("array")
+    words = write_collection(str(path / "docs.csv"))
+    engine = ArrayEngine(str(path / "arrayindex"), prune_min_docs=0)
+    engine.index(str(path / "docs.csv"))
+    return engine, words
+
+
+def test_maxscore_matches_full_scoring(collection):
+    engine, words = collection
+    rng = np.random.default_rng(1)
+
+    for _ in range(100):
+        query = " ".join(rng.choice(words[:60] + words[-60:], int(rng.integers(1, 6))))
+        for limit in (1, 10, 50):
+            pruned = engine.search(query, limit=limit, prune=True)
+            full = engine.search(query, limit=limit, prune=False)
+            assert [hit["id"] for hit in pruned] == [hit["id"] for hit in full], query
+            assert np.allclose([hit["score"] for hit in pruned], [hit["score"] for hit in full])
+
+
+def test_unknown_words_find_nothing(collection):
+    engine, _ = collection
+    assert engine.search("неизвестное слово", limit=10) == []
+
+
+def test_index_is_loaded_from_disk(collection):
+    engine, words = collection
+    reloaded = ArrayEngine(engine.ix_path, prune_min_docs=0)
+    query = " ".join(words[:3])
+    assert [hit["id"] for hit in reloaded.search(query, limit=20)] == \
+           [hit["id"] for hit in engine.search(query, limit=20)]
+
+
+def test_array_engine_does_not_need_pymorphy(tmp_path):
+    # pymorphy2 недоступен: импорт модуля должен бы упасть, если бы он был нужен
+    write_collection(str(tmp_path / "docs.csv"), n_docs=20)
+    script = (
+        "import sys\n"
+        "sys.modules['pymorphy2'] = None\n"
+        "from engine import engine_class\n"
+        f"engine = engine_class('array')({str(tmp_path / 'arrayindex')!r})\n"
+        f"engine.index({str(tmp_path / 'docs.csv')!r})\n"
+        "assert engine.search('w0 w1', limit=5)\n"
+        "assert 'lemmatizer' not in sys.modules\n"
+    )
+    env = dict(os.environ, PYTHONPATH=HERE)
+    subprocess.run([sys.executable, "-c", script], cwd=str(tmp_path), env=env, check=True,
+                   stderr=subprocess.DEVNULL)
+    assert not (tmp_path / "lemmas.tsv").exists()
@@ -0,0 +1,46 @@
+""" Проверки cache.py: python -m pytest test_cache.py """
+import pytest
+
+from cache import CachedEngine, QueryCache
+from engine import StoredIndexEngine
+
+
+class DictEngine(StoredIndexEngine):
+    """ Движок, который отдаёт обычные словари """
+
+    def __init__(self):
+        super().__init__()
+        self.ix = True
+        self.calls = 0
+
+    def search(self, query: str, limit: int = 10):
+        self.calls += 1
+        return [{"id": str(i), "score": 1.0 / (i + 1)} for i in range(limit)]
+
+
+def test_cached_hits_cannot_be_changed():
+    engine = CachedEngine(DictEngine())
+    first = engine.search("поток", limit=3)
+    # словари первого ответа -- собственные, кэш хранит свои копии
+    first[0]["score"] = -1.0
+
+    second = engine.search("поток", limit=3)
+    third = engine.search("  поток ", limit=3)
+    assert engine.engine.calls == 1
+    assert second[0]["score"] == 1.0
+    with pytest.raises(TypeError):
+        second[0]["score"] = -1.0
+
+    # списки у каждого свои
+    second.pop()
+    assert len(third) == 3
+
+
+def test_new_generation_drops_entries():
+    cache = QueryCache()
+    cache.put(("поток", 10), 1, [{"id": "1"}])
+    assert cache.get(("поток", 10), 1) == [{"id": "1"}]
+    assert cache.get(("поток", 10), 2) is None
+    # результат, посчитанный на старом индексе, в кэш не попадает
+    cache.put(("поток", 10), 1, [{"id": "1"}])
+    assert cache.get(("поток", 10), 2) is None
@@ -0,0 +1,32 @@
+""" Проверки lemma_cache.py: python -m pytest test_lemma_cache.py """
+from lemma_cache import LemmaCache
+
+
+def test_updates_are_appended_and_reloaded(tmp_path):
+    path = str(tmp_path / "lemmas.tsv")
+    cache = LemmaCache(path)
+    cache.update({"дети": "ребёнок", "бегали": "бегать"})
+    cache.update({"дети": "ребёнок"})
+    cache.flush()
+
+    reloaded = LemmaCache(path)
+    assert reloaded.lemmas() == {"дети": "ребёнок", "бегали": "бегать"}
+    # известные слова pymorphy2 не разбирает
+    assert reloaded("дети") == "ребёнок"
+    # повторно добавленное в журнал не попадает
+    with open(path, encoding="utf-8") as rf:
+        assert len(rf.readlines()) == 2
+
+
+def test_flush_every_writes_without_explicit_flush(tmp_path):
+    path = str(tmp_path / "lemmas.tsv")
+    cache = LemmaCache(path, flush_every=2)
+    cache.update({"a": "a", "b": "b"})
+    assert LemmaCache(path).lemmas() == {"a": "a", "b": "b"}
+
+
+def test_duplicated_log_is_compacted(tmp_path):
+    path = tmp_path / "lemmas.tsv"
+    path.write_text("дети\tребёнок\n" * 5, encoding="utf-8")
+    assert LemmaCache(str(path)).lemmas() == {"дети": "ребёнок"}
+    assert path.read_text(encoding="utf-8") == "дети\tребёнок\n"
@@ -0,0 +1,92 @@
+""" Проверки snippets.py: python -m pytest test_snippets.py """
+import pytest
+from whoosh.analysis import StandardAnalyzer
+from whoosh.fields import ID, TEXT, Schema
+from whoosh.filedb.filestore import RamStorage
+from whoosh.qparser import OrGroup, QueryParser
+
+from docstore import DocStore
+from snippets import SnippetBuilder, matched_spans
+
+TEXTS = {
+    "1": "Крыло в скользящем потоке. " + "Прочий текст без нужных слов. " * 20 + "Опять крыло и поток.",
+    "2": "Здесь нет ничего & <интересного>.",
+    "3": "Поток, поток и ещё раз поток.",
+}
+
+
+class ForbiddenAnalyzer(object):
+    """ Анализатор, который нельзя вызывать: сниппеты не должны разбирать текст заново """
+
+    def __call__(self, *args, **kwargs):
+        raise AssertionError("text was re-analyzed")
+
+
+@pytest.fixture
+def index(tmp_path):
+    schema = Schema(docno=ID(stored=True, unique=True),
+                    text=TEXT(analyzer=StandardAnalyzer(), phrase=True, chars=True))
+    ix = RamStorage().create_index(schema)
+    with ix.writer() as writer:
+        for docno, text in TEXTS.items():
+            writer.add_document(docno=docno, text=text)
+
+    docs = DocStore(str(tmp_path / "docstore"))
+    docs_writer = docs.writer()
+    for docno, text in TEXTS.items():
+        docs_writer.add(docno, "", text)
+    docs_writer.commit()
+    return ix, docs
+
+
+def search_snippets(ix, docs, query_string):
+    query = QueryParser("text", ix.schema, group=OrGroup).parse(query_string)
+    # после разбора запроса анализатор больше не нужен
+    ix.schema["text"].analyzer = ForbiddenAnalyzer()
+    builder = SnippetBuilder("text", maxchars=80, surround=20)
+
+    with ix.searcher() as searcher:
+        results = searcher.search(query, terms=True)
+        hits = [(hit["docno"], hit.docnum,
+                 frozenset(text.decode("utf-8") for field, text in hit.matched_terms() if field == "text"))
+                for hit in results]
+        spans = matched_spans(searcher, "text", [(docnum, terms) for _, docnum, terms in hits])
+
+    # поисковик уже закрыт: сниппеты строятся только по смещениям и тексту из DocStore
+    return {docno: builder(docs.get(docno), spans[docnum]) for docno, docnum, _ in hits}
+
+
+def test_spans_point_at_matched_words(index):
+    ix, _ = index
+    with ix.searcher() as searcher:
+        docnum = searcher.document_number(docno="3")
+        spans = matched_spans(searcher, "text", [(docnum, frozenset({"поток"}))])[docnum]
+    assert [TEXTS["3"][start:end] for _, start, end in spans["поток"]] == ["Поток", "поток", "поток"]
+
+
+def test_snippets_highlight_from_stored_offsets(index):
+    ix, docs = index
+    snippets = search_snippets(ix, docs, "крыло поток")
+
+    assert set(snippets) == {"1", "3"}
+    # без лемматизации "потоке" -- не "поток": лучший фрагмент -- в конце,
+    #   где рядом оба слова, а не в начале с одним
+    assert snippets["1"].endswith("Опять <b class=\"match term2\">крыло</b> "
+                                  "и <b class=\"match term1\">поток</b>")
+    assert "Крыло" not in snippets["1"]
+    assert snippets["3"].count("<b") == 3
+
+
+def test_snippet_falls_back_to_escaped_prefix(index):
+    _, docs = index
+    builder = SnippetBuilder("text")
+    snippet = builder(docs.get("2"), {})
+    assert snippet == "Здесь нет ничего &amp; &lt;интересного&gt;."
+
+
+def test_snippets_are_cached(index):
+    _, docs = index
+    builder = SnippetBuilder("text")
+    spans = {"поток": ((0, 0, 5),)}
+    first = builder(docs.get("3"), spans)
+    assert builder(docs.get("3"), spans) is first
@@ -0,0 +1,255 @@
+import json
+import logging
+import os
+import re
+from typing import List
+
+import numpy as np
+from gensim.utils import SaveLoad
+from tqdm import tqdm
+
+from docstore import DocStore
+from engine import IndexNotBuiltError, StoredIndexEngine, read_documents
+from lemmatizer import flush_lemma_cache, get_lemma_cache
+from metrics import STAGE_SECONDS, log_sampled
+
+logging.basicConfig(
+    level=logging.INFO,
+    format='%(asctime)s - %(levelname)s - %(message)s',
+    handlers=[
+        logging.StreamHandler(),  # Logs to console
+        logging.FileHandler('vectors.log', mode='a', encoding='utf-8')
+    ]
+)
+
+TOKEN_RE = re.compile(r"\w+")
+
+# см. 05_distributional_semantics/example02_word2vec.py
+DEFAULT_MODEL = "../05_distributional_semantics/word2vec.model"
+
+
+class DocumentEmbedder(object):
+    """
+        Вектор текста -- среднее векторов его лемм (модели из 05_distributional_semantics
+          учатся на лемматизированном sentences.txt), нормированное на единицу
+    """
+
+    def __init__(self, model_path: str):
+        # Word2Vec, FastText или просто KeyedVectors, сохранённые через .save();
+        #   большие матрицы gensim хранит отдельными .npy, они отображаются
+        #   в память и общие у всех рабочих процессов сервера
+        model = SaveLoad.load(model_path, mmap="r")
+        self.wv = getattr(model, "wv", model)
+        self.dim = self.wv.vector_size
+
+    def lemmas(self, text: str) -> List[str]:
+        lemmatize = get_lemma_cache()
+        return [lemmatize(token) for token in TOKEN_RE.findall(text.lower())]
+
+    def embed(self, text: str) -> np.ndarray:
+        # FastText умеет и в слова не из словаря, Word2Vec -- нет
+        known = [lemma for lemma in self.lemmas(text) if lemma in self.wv]
+        if not known:
+            return np.zeros(self.dim, dtype=np.float32)
+
+        vector = np.mean([self.wv[lemma] for lemma in known], axis=0).astype(np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+
+def spherical_kmeans(vectors: np.ndarray, n_clusters: int, iterations: int = 10,
+                     seed: int = 42) -> np.ndarray:
+    """ k-средних по косинусной близости, возвращает нормированные центроиды """
+    rng = np.random.default_rng(seed)
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+
+    for _ in range(iterations):
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+
+        # опустевшие кластеры заново засеиваем случайными векторами
+        empty = np.flatnonzero(np.bincount(assignment, minlength=n_clusters) == 0)
+        sums[empty] = vectors[rng.choice(len(vectors), len(empty))]
+
+        norms = np.linalg.norm(sums, axis=1, keepdims=True)
+        centroids = sums / np.maximum(norms, 1e-12)
+
+    return centroids.astype(np.float32)
+
+
+class IVFIndex(object):
+    """ Матрица векторов, упорядоченная по кластерам, и центроиды кластеров """
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as rf:
+            meta = json.load(rf)
+
+        self.dim = meta["dim"]
+        # строка матрицы -> docno и номер документа в коллекции (как docnum у других движков)
+        self.docnos: List[str] = meta["docnos"]
+        self.docnums = np.asarray(meta["docnums"], dtype=np.int64)
+        self.centroids = np.load(os.path.join(path, "centroids.npy"))
+        # строки кластера c -- list_offsets[c]:list_offsets[c + 1]
+        self.list_offsets = np.load(os.path.join(path, "list_offsets.npy"))
+        self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32,
+                                 mode="r", shape=(len(self.docnos), self.dim))
+
+    def doc_count(self) -> int:
+        return len(self.docnos)
+
+    def rows(self, cluster: int) -> slice:
+        return slice(self.list_offsets[cluster], self.list_offsets[cluster + 1])
+
+
+class VectorEngine(StoredIndexEngine):
+    """
+        Векторный поиск: документы -- усреднённые векторы слов,
+          близость -- косинусная (скалярное произведение нормированных векторов)
+
+        Приближённый поиск -- IVF: векторы разбиты на `nlist` кластеров,
+          запрос сравнивается только с документами `nprobe` ближайших кластеров;
+          матрица (float32, отображена в память) упорядочена по кластерам,
+          так что каждый кластер -- непрерывный кусок строк.
+          search(..., exact=True) -- полный перебор, для проверки
+    """
+
+    def __init__(self, index_path="vectorindex", model_path: str = None, nprobe: int = 8):
+        super().__init__(index_storage_path=index_path)
+        self.embedder = DocumentEmbedder(model_path or os.environ.get("VECTOR_MODEL", DEFAULT_MODEL))
+        self.nprobe = nprobe
+
+        self.ix: IVFIndex = None
+        self.docs: DocStore = None
+
+        if os.path.exists(os.path.join(self.ix_path, "meta.json")):
+            logging.info("Pre-built vector index found, loading.")
+            try:
+                self._load()
+                logging.info(f"A total of {self.ix.doc_count()} documents in the index")
+            except Exception:
+                logging.exception("Error upon reading the vector index. Should rebuild.")
+                self.ix = None
+
+    def _load(self):
+        ix = IVFIndex(self.ix_path)
+
+        if ix.dim != self.embedder.dim:
+            raise Exception(f"Index built with dim={ix.dim}, model has {self.embedder.dim}")
+
+        self.docs = DocStore(os.path.join(self.ix_path, "docstore"))
+        self.ix = ix
+
+    def index(self, csv_file="data/all-ru.csv", nlist: int = None):
+        """ Индекс строится с нуля; по умолчанию nlist ~ 4 * sqrt(число документов) """
+        os.makedirs(self.ix_path, exist_ok=True)
+
+        if self.docs is None:
+            self.docs = DocStore(os.path.join(self.ix_path, "docstore"))
+        docs_writer = self.docs.writer(rebuild=True)
+
+        docnos, vectors = [], []
+
+        for docno, title, text in tqdm(read_documents(csv_file), "lines embedded"):
+            docnos.append(docno)
+            vectors.append(self.embedder.embed(f"{title} {text}"))
+            docs_writer.add(docno, title, text)
+
+        vectors = np.vstack(vectors)
+        nlist = min(nlist or int(4 * np.sqrt(len(vectors))), len(vectors))
+        centroids = spherical_kmeans(vectors, nlist)
+
+        # Упорядочиваем строки по кластерам
+        assignment = np.argmax(vectors @ centroids.T, axis=1)
+        order = np.argsort(assignment, kind="stable")
+        list_offsets = np.zeros(nlist + 1, dtype=np.int64)
+        list_offsets[1:] = np.cumsum(np.bincount(assignment, minlength=nlist))
+
+        # Пишем рядом и подменяем: старую матрицу ещё могут читать
+        matrix_path = os.path.join(self.ix_path, "vectors.f32")
+        matrix = np.memmap(matrix_path + ".new", dtype=np.float32, mode="w+", shape=vectors.shape)
+        matrix[:] = vectors[order]
+        matrix.flush()
+        del matrix
+        os.replace(matrix_path + ".new", matrix_path)
+
+        np.save(os.path.join(self.ix_path, "centroids.npy"), centroids)
+        np.save(os.path.join(self.ix_path, "list_offsets.npy"), list_offsets)
+        with open(os.path.join(self.ix_path, "meta.json"), "w", encoding="utf-8") as wf:
+            json.dump({"dim": int(vectors.shape[1]),
+                       "docnos": [docnos[i] for i in order],
+                       "docnums": order.tolist()}, wf, ensure_ascii=False)
+
+        docs_writer.commit()
+        flush_lemma_cache()
+        self._load()
+        self.generation += 1
+
+    def search(self, query_string: str, limit: int = 10, exact: bool = False):
+
+        if self.ix is None:
+            raise IndexNotBuiltError("Index has not been built.")
+
+        with STAGE_SECONDS.time(stage="parse"):
+            query = self.embedder.embed(query_string)
+
+        # ни одного слова запроса нет в модели: все близости нулевые,
+        #   и любая выдача была бы случайной
+        if not query.any():
+            return []
+
+        ix = self.ix
+
+        with STAGE_SECONDS.time(stage="search"):
+            if exact:
+                rows = np.arange(ix.doc_count())
+                scores = ix.vectors @ query
+            else:
+                nprobe = min(self.nprobe, len(ix.centroids))
+                probes = np.argpartition(-(ix.centroids @ query), nprobe - 1)[:nprobe]
+                rows = np.concatenate([np.arange(ix.rows(c).start, ix.rows(c).stop) for c in probes])
+                scores = np.concatenate([ix.vectors[ix.rows(c)] @ query for c in probes])
+
+            if len(rows) > limit:
+                top = np.argpartition(-scores, limit - 1)[:limit]
+                rows, scores = rows[top], scores[top]
+
+            ranking = np.argsort(-scores, kind="stable")
+            rows, scores = rows[ranking], scores[ranking]
+
+        if log_sampled():
+            logging.info(f"q:[{query_string}] "
+                         f"hits:[{';'.join(ix.docnos[row] for row in rows)}]")
+
+        with STAGE_SECONDS.time(stage="fetch"):
+            return [self.docs.get(ix.docnos[row],
+                                  rank=rank,
+                                  score=float(score),
+                                  docnum=int(ix.docnums[row]))
+                    for rank, (row, score) in enumerate(zip(rows, scores))]
+
+    def index_stats(self) -> dict:
+        stats = super().index_stats()
+        if self.ix is not None:
+            stats["documents"] = self.ix.doc_count()
+        return stats
+
+    def close(self):
+        flush_lemma_cache()
+
+
+if __name__ == "__main__":
+    """
+        Сначала обучите и сохраните модель: 05_distributional_semantics/example02_word2vec.py
+    """
+    engine = VectorEngine()
+    engine.index("data/all-ru.csv")
+
+    approximate = [hit["id"] for hit in engine.search("мимо сферы", limit=10)]
+    exact = [hit["id"] for hit in engine.search("мимо сферы", limit=10, exact=True)]
+    print(f"recall@10 of IVF vs brute force: {len(set(approximate) & set(exact)) / 10:.2f}")
+
+    for hit in engine.search("мимо сферы"):
+        title = hit["title"].replace("\n", " ")
+        print(f'{hit["docnum"]:4d}: {hit["rank"]:2d})'
+              f'\t[{hit["score"]:03.3f}]\t{title}')
@@ -1,17 +1,28 @@
-import csv
 import logging
 import os
+import queue
 import shutil
+import threading
+import time
+from contextlib import contextmanager
+from functools import partial
+from typing import Iterator
 
 from tqdm import tqdm
 from whoosh import index
 from whoosh.fields import Schema, ID, TEXT
 from whoosh.index import Index
-from whoosh.qparser import MultifieldParser, QueryParser
-from whoosh.query import Query
+from whoosh.qparser import AndGroup, MultifieldParser, OrGroup, QueryParser, QueryParserError
+from whoosh.query import Query, QueryError
 from whoosh.searching import Searcher, Results
 
-from engine import StoredIndexEngine
+from docstore import DocStore
+from engine import BadQueryError, IndexNotBuiltError, StoredIndexEngine, read_documents
+from expansion import ExpansionTable, QueryExpander, expander_settings_from_env
+from lemmatizer import LemmaAnalyzer, flush_lemma_cache
+from manifest import IndexManifest, content_hash
+from metrics import STAGE_SECONDS, log_sampled
+from snippets import SnippetBuilder, matched_spans
 
 logging.basicConfig(
     level=logging.INFO,
@@ -23,21 +34,136 @@ logging.basicConfig(
 )
 
 
+class SearcherPool(object):
+    """
+        Пул "тёплых" поисковиков: читатели сегментов открываются один раз
+          и переиспользуются между запросами; каждый поисковик в любой момент
+          занят не более чем одним потоком, так что пул можно делить
+          между потоками Flask
+    """
+
+    def __init__(self, ix: Index, size: int = 4):
+        self.ix = ix
+        self.size = size
+        # номер поколения индекса, увеличивается после каждого коммита
+        self.generation = 0
+
+        self._idle = queue.LifoQueue()
+        self._lock = threading.Lock()
+        self._created = 0
+        # выданные потокам поисковики; те, что были выданы во время close(),
+        #   закрываются при возврате, а не возвращаются в пул
+        self._busy = set()
+        self._retired = set()
+
+    def reset(self, ix: Index):
+        """ Индекс изменился: поисковики обновятся при следующей выдаче """
+        with self._lock:
+            self.ix = ix
+            self.generation += 1
+
+    @contextmanager
+    def searcher(self) -> Iterator[Searcher]:
+        generation, ix, searcher = self._acquire()
+        try:
+            yield searcher
+        finally:
+            self._release(generation, ix, searcher)
+
+    def _release(self, generation: int, ix: Index, searcher: Searcher):
+        with self._lock:
+            self._busy.discard(searcher)
+            retired = searcher in self._retired
+            if retired:
+                self._retired.discard(searcher)
+                self._created -= 1
+
+        if retired:
+            searcher.close()
+        else:
+            self._idle.put((generation, ix, searcher))
+
+    def _acquire(self):
+        try:
+            generation, ix, searcher = self._idle.get_nowait()
+        except queue.Empty:
+            with self._lock:
+                can_create = self._created < self.size
+                if can_create:
+                    self._created += 1
+                    searcher = self.ix.searcher()
+                    self._busy.add(searcher)
+                    return self.generation, self.ix, searcher
+            # все поисковики заняты -- ждём, пока какой-нибудь освободится
+            generation, ix, searcher = self._idle.get()
+
+        with self._lock:
+            current_generation, current_ix = self.generation, self.ix
+
+        if generation != current_generation:
+            if ix is current_ix:
+                # refresh() переоткрывает только изменившиеся сегменты
+                searcher = searcher.refresh()
+            else:
+                searcher.close()
+                searcher = current_ix.searcher()
+
+        with self._lock:
+            self._busy.add(searcher)
+        return current_generation, current_ix, searcher
+
+    def close(self):
+        """ Закрыть свободные поисковики сейчас, занятые -- когда их вернут """
+        with self._lock:
+            self._retired |= self._busy
+
+        while True:
+            try:
+                _, _, searcher = self._idle.get_nowait()
+            except queue.Empty:
+                break
+            searcher.close()
+
+            with self._lock:
+                self._created -= 1
+
+
 class WhooshEngine(StoredIndexEngine):
 
-    def __init__(self, index_path="indexdir"):
+    def __init__(self, index_path="indexdir", or_group: bool = False, expansions_path: str = None,
+                 expander_settings: dict = None):
         super().__init__(index_storage_path=index_path)
+        # По умолчанию слова запроса соединяются через AND,
+        #   для отбора кандидатов (hybrid_searcher.py) удобнее OR
+        self.group = OrGroup if or_group else AndGroup
+
+        # Таблица расширений запроса собирается заранее: python expansion.py ...;
+        #   веса и ограничения расширения (weight, max_weight, max_per_term,
+        #   max_clauses) -- в expander_settings или в переменных EXPANSION_*
+        self.expander: QueryExpander = None
+        expansions_path = expansions_path or os.environ.get("QUERY_EXPANSIONS")
+        if expansions_path and os.path.exists(expansions_path):
+            settings = {**expander_settings_from_env(), **(expander_settings or {})}
+            self.expander = QueryExpander(ExpansionTable(expansions_path), **settings)
+            logging.info(f"{len(self.expander.table)} query expansion entries loaded "
+                         f"(weight={self.expander.weight}, max_clauses={self.expander.max_clauses}).")
 
-        # Задаём схему как в БД -- для индекса,
-        #   "тяжёлые" объекты можно было бы хранить отдельно
+        # Задаём схему как в БД -- для индекса, а "тяжёлые" объекты
+        #   хранятся отдельно, в DocStore (подпапка docstore в папке индекса);
+        #   тексты и запросы лемматизируются одним и тем же анализатором
         self.schema = Schema(
             docno=ID(stored=True, unique=True),  # уникальный ключ
-            title=TEXT(stored=True),  # заголовок
-            text=TEXT(stored=True)  # текст документа
+            title=TEXT(analyzer=LemmaAnalyzer()),  # заголовок
+            # текст документа; смещения слов (chars) хранятся для сниппетов
+            text=TEXT(analyzer=LemmaAnalyzer(), phrase=True, chars=True)
         )
 
         self.ix: Index = None
         self.parser: QueryParser = None
+        self.searchers: SearcherPool = None
+        self.docs: DocStore = None
+        self._merge_thread: threading.Thread = None
+        self.snippets = SnippetBuilder("text")
 
         # Если папка с файлами индекса уже есть,
         #   попробуем загрузить из неё индекс
@@ -46,72 +172,224 @@ class WhooshEngine(StoredIndexEngine):
             try:
                 self.ix: Index = index.open_dir(self.ix_path, schema=self.schema)
                 logging.info(f"A total of {self.ix.doc_count()} documents in the index")
+                self.docs = DocStore(os.path.join(self.ix_path, "docstore"))
+                if len(self.docs) != self.ix.doc_count():
+                    raise Exception(f"Document store is out of sync: {len(self.docs)} documents")
                 self.parser: QueryParser = MultifieldParser(["title", "text"],
-                                                            self.ix.schema)
+                                                            self.ix.schema,
+                                                            group=self.group)
+                self.searchers = SearcherPool(self.ix)
             except Exception as e:
                 logging.exception("Error upon reading the index, cleaning. Should rebuild.")
                 self.ix: Index = None
                 self.parser: QueryParser = None
+                self.searchers = None
+                self.docs = None
 
                 # Удаляем нечитаемый индекс
                 shutil.rmtree(self.ix_path)
                 logging.warning("Index directory removed successfully.")
 
-    def index(self, csv_file="data/all-ru.csv"):
-        """ Собственно индексирование """
+    def index(self,
+              csv_file="data/all-ru.csv",
+              procs: int = None,
+              limitmb: int = 256,
+              multisegment: bool = True):
+        """
+            Собственно индексирование
+
+            Если индекс пуст, он строится "оптом": документы только добавляются
+              (add_document без проверки уникальности docno), а разбор текстов
+              распределяется по `procs` процессам (по умолчанию -- по числу ядер);
+              `limitmb` -- память на процесс, `multisegment` -- не сливать
+              сегменты процессов в один (быстрее, но поиск по нескольким сегментам)
+
+            Иначе индекс обновляется по манифесту (хэши документов): переиндексируются
+              только новые и изменённые документы, исчезнувшие из CSV удаляются,
+              а если сам CSV не менялся (размер и mtime), не делается ничего;
+              мелкие сегменты потом сливаются в фоне
+        """
 
         # Если нет, создаём, если есть -- пытаемся дополнить
         if not os.path.exists(self.ix_path):
             os.mkdir(self.ix_path)
             self.ix = index.create_in(self.ix_path, schema=self.schema)
-        else:
+        elif self.ix is None:
             # if already indexed
             self.ix = index.open_dir(self.ix_path, schema=self.schema)
+        # уже открытый индекс не переоткрываем: тот же объект Index видит
+        #   новые коммиты, а поисковики пула обновятся через refresh()
+
+        bulk = self.ix.doc_count_all() == 0
+        manifest = IndexManifest(os.path.join(self.ix_path, "manifest.json"))
+
+        if bulk:
+            manifest.hashes = {}
+        elif manifest.is_unchanged(csv_file):
+            logging.info(f"{csv_file} has not changed since the last indexing, skipping.")
+            self._ensure_searchable()
+            return
+
+        # Дожидаемся фонового слияния: двух пишущих объектов сразу быть не может
+        self._wait_for_merge()
+
+        if self.docs is None:
+            self.docs = DocStore(os.path.join(self.ix_path, "docstore"))
+        docs_writer = self.docs.writer(rebuild=bulk)
 
         # Создаём специальный пишущий объект
-        writer = self.ix.writer()
+        if bulk:
+            procs = procs or os.cpu_count() or 1
+            logging.info(f"Empty index, bulk build with {procs} process(es).")
+            writer = self.ix.writer(procs=procs, limitmb=limitmb, multisegment=multisegment)
+            add = writer.add_document
+        else:
+            writer = self.ix.writer(limitmb=limitmb)
+            add = writer.update_document
+
+        start_time, doc_count, changed_count = time.time(), 0, 0
+        seen = set()
 
-        with open(csv_file, "r", encoding="utf-8") as f:
-            reader = csv.reader(f)
+        for docno, title, text in tqdm(read_documents(csv_file), "lines indexed"):
+            doc_count += 1
+            seen.add(docno)
 
-            # Пропускаем заголовок
-            next(reader)
+            digest = content_hash(title, text)
+            if manifest.hashes.get(docno) == digest:
+                continue
 
-            for row in tqdm(reader, "lines indexed"):
-                docno, title, text = row
-                writer.update_document(
-                    docno=docno.strip(),
-                    title=title.strip(),
-                    text=text.strip()
-                )
+            add(docno=docno, title=title, text=text)
+            docs_writer.add(docno, title, text)
+            manifest.hashes[docno] = digest
+            changed_count += 1
+
+        removed = set(manifest.hashes) - seen
+        for docno in removed:
+            writer.delete_by_term("docno", docno)
+            docs_writer.delete(docno)
+            del manifest.hashes[docno]
 
         # Командуем, чтобы всё было точно записано на диск
-        #   и доступно для поиска по индексу
-        writer.commit()
+        #   и доступно для поиска по индексу;
+        #   при обновлении -- без слияния сегментов, его сделаем в фоне
+        if changed_count or removed:
+            writer.commit(merge=bulk)
+        else:
+            writer.cancel()
+        docs_writer.commit()
+        manifest.save(csv_file)
+        flush_lemma_cache()
+
+        elapsed = time.time() - start_time
+        logging.info(f"{doc_count} documents read in {elapsed:.2f} s "
+                     f"({doc_count / max(elapsed, 1e-9):.1f} docs/sec): "
+                     f"{changed_count} added or updated, {len(removed)} removed")
+
+        if changed_count or removed:
+            self.generation += 1
+            self.snippets.clear()
+        self._ensure_searchable()
+
+        if not bulk and (changed_count or removed):
+            self._merge_thread = threading.Thread(target=self._merge_segments, daemon=True)
+            self._merge_thread.start()
 
+    def _ensure_searchable(self):
         # Индекса в этот момент могло не быть, так что задаём парсер здесь
         self.parser: QueryParser = MultifieldParser(["title", "text"],
-                                                    self.ix.schema)
+                                                    self.ix.schema,
+                                                    group=self.group)
+
+        # Появились новые сегменты -- поисковики пула нужно обновить
+        if self.searchers is None:
+            self.searchers = SearcherPool(self.ix)
+        else:
+            self.searchers.reset(self.ix)
+
+    def _merge_segments(self):
+        """ Пустой коммит с политикой слияния по умолчанию сливает мелкие сегменты """
+        try:
+            writer = self.ix.writer(timeout=60.0)
+            writer.commit(merge=True)
+            self.searchers.reset(self.ix)
+            logging.info("Small segments merged.")
+
+            # заодно -- место, занятое старыми версиями документов
+            if self.docs.compact():
+                logging.info(f"Document store compacted to {len(self.docs)} documents.")
+        except Exception:
+            logging.exception("Background segment merge failed.")
+
+    def _wait_for_merge(self):
+        if self._merge_thread is not None:
+            self._merge_thread.join()
+            self._merge_thread = None
 
     def search(self, query_string: str, limit: int = 10):
 
-        if self.ix is None:
-            raise Exception("Index has not been built.")
+        # ix появляется в начале первой сборки, а поисковики -- только в конце
+        if self.ix is None or self.searchers is None:
+            raise IndexNotBuiltError("Index has not been built.")
+
+        try:
+            with STAGE_SECONDS.time(stage="parse"):
+                query: Query = self.parser.parse(query_string)
+
+                if self.expander is not None:
+                    query = self.expander.expand(query)
+        except QueryParserError as e:
+            raise BadQueryError(f"Cannot parse query: {e}") from e
+
+        # docno, совпавшие термы и их смещения в тексте читаются,
+        #   пока поисковик ещё не вернулся в пул
+        with self.searchers.searcher() as searcher:
+            with STAGE_SECONDS.time(stage="search"):
+                try:
+                    results: Results = searcher.search(query, limit=limit, terms=True)
+                except QueryError as e:
+                    # например, фраза по полю без позиций слов
+                    raise BadQueryError(f"Cannot run query: {e}") from e
+            with STAGE_SECONDS.time(stage="fetch"):
+                hits = [(hit["docno"], hit.rank, hit.score, hit.docnum,
+                         frozenset(text.decode("utf-8") for field, text in hit.matched_terms()
+                                   if field == "text")) for hit in results]
+                spans = matched_spans(searcher, "text", [(docnum, terms) for *_, docnum, terms in hits])
+            # len(results) обращается к поисковику, так что тоже до возврата в пул
+            found = len(results)
+
+        if log_sampled():
+            logging.info(f"q:[{query_string}] found:{found} "
+                         f"hits:[{';'.join(docno for docno, *_ in hits)}]")
+
+        # Заголовок и текст прочитаются из DocStore, а сниппет построится,
+        #   только если понадобятся
+        return [self.docs.get(docno, rank=rank, score=score, docnum=docnum,
+                              lazy={"snippet": partial(self.snippets, spans=spans[docnum])})
+                for docno, rank, score, docnum, _ in hits]
+
+    def index_stats(self) -> dict:
+        stats = super().index_stats()
+        if self.ix is not None:
+            stats["documents"] = self.ix.doc_count()
+            with self.searchers.searcher() as searcher:
+                stats["segments"] = len(searcher.leaf_searchers())
+        return stats
 
-        searcher: Searcher = self.ix.searcher()
-        query: Query = self.parser.parse(query_string)
-        results: Results = searcher.search(query, limit=limit)
+    def before_fork(self):
+        self._wait_for_merge()
 
-        logging.info(f"\nFound {len(results)} results:")
-        logging.info(f"q:[{query_string}] "
-                     f"hits:[{';'.join(str(hit['docno']) for hit in results)}]")
+    def after_fork(self):
+        # У унаследованных от родителя файлов сегментов общая с ним позиция
+        #   чтения, так что поисковики рабочего процесса открываются заново
+        if self.searchers is not None:
+            self.searchers.close()
+            self.searchers.reset(self.ix)
 
-        return [{"id": hit["docno"],
-                 "title": hit["title"],
-                 "text": hit["text"],
-                 "rank": hit.rank,
-                 "score": hit.score,
-                 "docnum": hit.docnum} for hit in results]
+    def close(self):
+        self._wait_for_merge()
+        if self.searchers is not None:
+            self.searchers.close()
+        flush_lemma_cache()
 
 
 if __name__ == "__main__":
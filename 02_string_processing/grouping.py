@@ -1,9 +1,18 @@
+import argparse
 import logging
+import os
+import re
 import sys
+import zlib
+from bisect import bisect_left
+from collections import defaultdict
 from difflib import SequenceMatcher
+from multiprocessing import Pool, shared_memory, util
 
 import numpy as np
 from scipy.cluster.hierarchy import linkage, fcluster
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,24 +26,81 @@ logging.basicConfig(
 )
 
 
-def longest_common_substring(s1, s2):
-    """ Наибольшая общая подстрока """
+class SuffixAutomaton(object):
+    """
+        Суффиксный автомат строки: принимает все её подстроки, строится за O(len(s))
+
+        Длина наибольшей общей подстроки с другой строкой t -- один проход
+          по t за O(len(t)) вместо динамики O(len(s) * len(t)), так что автомат
+          выгодно построить один раз и сравнивать с ним много строк
+    """
+
+    def __init__(self, s):
+        # для каждого состояния: переходы, суффиксная ссылка, длина самой длинной строки
+        self.next = [{}]
+        self.link = [-1]
+        self.length = [0]
+        last = 0
+
+        for ch in s:
+            current = len(self.next)
+            self.next.append({})
+            self.link.append(0)
+            self.length.append(self.length[last] + 1)
+
+            p = last
+            while p != -1 and ch not in self.next[p]:
+                self.next[p][ch] = current
+                p = self.link[p]
+
+            if p != -1:
+                q = self.next[p][ch]
+                if self.length[p] + 1 == self.length[q]:
+                    self.link[current] = q
+                else:
+                    # расщепляем q: копия с укороченной длиной
+                    clone = len(self.next)
+                    self.next.append(dict(self.next[q]))
+                    self.link.append(self.link[q])
+                    self.length.append(self.length[p] + 1)
+
+                    while p != -1 and self.next[p].get(ch) == q:
+                        self.next[p][ch] = clone
+                        p = self.link[p]
+                    self.link[q] = self.link[current] = clone
+
+            last = current
+
+    def longest_common_substring(self, t):
+        """ Длина наибольшей общей подстроки t и строки автомата """
+        nxt, link, length = self.next, self.link, self.length
+        state, current, best = 0, 0, 0
+
+        for ch in t:
+            # укорачиваем совпадение, пока его нельзя продолжить символом ch
+            while state and ch not in nxt[state]:
+                state = link[state]
+                current = length[state]
+            if ch in nxt[state]:
+                state = nxt[state][ch]
+                current += 1
+                if current > best:
+                    best = current
+
+        return best
 
-    m, n = len(s1), len(s2)
-    # Матрица для дин. прогр
-    dp = [[0] * (n + 1) for _ in range(m + 1)]
-    max_length = 0
 
-    for i in range(m):
-        for j in range(n):
-            if s1[i] == s2[j]:
-                dp[i + 1][j + 1] = dp[i][j] + 1
-                if dp[i + 1][j + 1] > max_length:
-                    max_length = dp[i + 1][j + 1]
-            else:
-                dp[i + 1][j + 1] = 0
+def longest_common_substring(s1, s2):
+    """ Наибольшая общая подстрока (длина); автомат строится по более короткой строке """
+    if len(s1) > len(s2):
+        s1, s2 = s2, s1
+    return SuffixAutomaton(s1).longest_common_substring(s2)
 
-    return max_length
+
+def longest_common_substrings(s, others):
+    """ Пакетно: длины наибольших общих подстрок s с каждой из строк `others` """
+    automaton = SuffixAutomaton(s)
+    return np.array([automaton.longest_common_substring(t) for t in others], dtype=np.int64)
 
 
 def normalized_lcs_distance(s1, s2):
@@ -52,31 +118,649 @@ def normalized_lcs_distance(s1, s2):
     return 1.0 - similarity
 
 
+def normalized_lcs_distances(s, others):
+    """ Пакетно: normalized_lcs_distance(s, t) для каждой t из `others` """
+    if not others:
+        return np.zeros(0)
+    lengths = np.array([len(t) for t in others])
+    max_lens = np.maximum(lengths, len(s))
+    lcs_lens = longest_common_substrings(s, others)
+    # две пустые строки совпадают
+    return np.where(max_lens > 0, 1.0 - lcs_lens / np.maximum(max_lens, 1), 0.0)
+
+
 def difflib_distance(s1, s2):
     """ Расстояние на основе сходства Gestalt """
     return 1.0 - SequenceMatcher(a=s1, b=s2).ratio()
 
 
-def compute_condensed_distance_matrix(strings):
-    """ Верхняя диагональная матрица со всеми расстояниями """
-    n = len(strings)
-    dists = []
+NON_WORD_RE = re.compile(r"[\W_]+")
+TOKEN_RE = re.compile(r"[^\W\d_]+")
+
+# Размерность пространства символьных n-грамм (хэшируются по модулю)
+NGRAM_DIM = 1 << 20
+
+
+def normalize_for_blocking(s):
+    """
+        Для поиска кандидатов: нижний регистр, без пробелов и пунктуации --
+          в битых ссылках пробелы стоят посреди слов ("T riangulated")
+    """
+    return NON_WORD_RE.sub("", s.lower())
+
+
+def levenshtein(s, t, masks=None):
+    """
+        Расстояние Левенштейна битово-параллельным алгоритмом Майерса (Hyyrö):
+          столбец динамики для s хранится в двух целых как битовые векторы
+          и пересчитывается за O(1) операций над длинными целыми на символ t
+
+        masks -- позиции символов s битами (см. char_masks), если уже посчитаны
+    """
+    m = len(s)
+    if not m:
+        return len(t)
+    if masks is None:
+        masks = char_masks(s)
+
+    full, high = (1 << m) - 1, 1 << (m - 1)
+    pv, mv, score = full, 0, m
+
+    for ch in t:
+        eq = masks.get(ch, 0)
+        xv = eq | mv
+        xh = (((eq & pv) + pv) ^ pv) | eq
+        ph = mv | (~(xh | pv) & full)
+        mh = pv & xh
+        if ph & high:
+            score += 1
+        elif mh & high:
+            score -= 1
+        ph = ((ph << 1) | 1) & full
+        mh = (mh << 1) & full
+        pv = mh | (~(xv | ph) & full)
+        mv = ph & xv
+
+    return score
+
+
+def char_masks(s):
+    """ Символ -> битовая маска его позиций в s """
+    masks = {}
+    for i, ch in enumerate(s):
+        masks[ch] = masks.get(ch, 0) | (1 << i)
+    return masks
+
+
+def char_positions(s):
+    """ Символ -> список его позиций в s (по возрастанию) """
+    positions = {}
+    for i, ch in enumerate(s):
+        positions.setdefault(ch, []).append(i)
+    return positions
+
+
+def jaro_winkler_similarity(s1, s2, positions2=None, prefix_scale=0.1):
+    """
+        Сходство Джаро-Винклера: доля символов, совпавших в окне
+          max(len) / 2 - 1, с поправкой на перестановки и общий префикс (до 4 символов)
+
+        positions2 -- char_positions(s2), если уже посчитаны: совпадения
+          ищутся по позициям символа, а не перебором всего окна
+    """
+    if s1 == s2:
+        return 1.0
+    n1, n2 = len(s1), len(s2)
+    if not n1 or not n2:
+        return 0.0
+    if positions2 is None:
+        positions2 = char_positions(s2)
+
+    window = max(max(n1, n2) // 2 - 1, 0)
+    used = [False] * n2
+    matched1 = []
+
+    for i, ch in enumerate(s1):
+        positions = positions2.get(ch)
+        if not positions:
+            continue
+        hi = i + window
+        for j in positions[bisect_left(positions, i - window):]:
+            if j > hi:
+                break
+            if not used[j]:
+                used[j] = True
+                matched1.append(ch)
+                break
+
+    m = len(matched1)
+    if not m:
+        return 0.0
+
+    matched2 = [s2[j] for j in range(n2) if used[j]]
+    transpositions = sum(a != b for a, b in zip(matched1, matched2)) // 2
+    jaro = (m / n1 + m / n2 + (m - transpositions) / m) / 3
+
+    prefix = 0
+    for a, b in zip(s1[:4], s2[:4]):
+        if a != b:
+            break
+        prefix += 1
+
+    return jaro + prefix * prefix_scale * (1.0 - jaro)
+
+
+class StringDistance(object):
+    """
+        Бэкенд расстояния между строками (0 -- совпадают, 1 -- ничего общего)
+
+        Подготовка строки (нормализация, n-граммы, битовые маски) делается
+          один раз на строку, а не на пару: prepare(s) кэшируется, compare(p, q)
+          сравнивает уже подготовленные строки. row() -- расстояния от одной
+          строки до многих; наследники переопределяют его, где можно пакетом
+    """
+
+    # кэш сбрасывается целиком, когда в нём столько строк (потоковый режим)
+    max_cache = 200000
+
+    def __init__(self):
+        self._cache = {}
+
+    def __getstate__(self):
+        # в процессы пула кэш не передаём: там он наполнится заново
+        state = dict(self.__dict__)
+        state["_cache"] = {}
+        return state
+
+    def prepare(self, s):
+        return s
+
+    def compare(self, p, q):
+        raise NotImplementedError
+
+    def prepared(self, s):
+        p = self._cache.get(s)
+        if p is None:
+            if len(self._cache) >= self.max_cache:
+                self._cache.clear()
+            p = self._cache[s] = self.prepare(s)
+        return p
+
+    def __call__(self, s1, s2):
+        return self.compare(self.prepared(s1), self.prepared(s2))
+
+    def row(self, s, others):
+        p, prepared, compare = self.prepared(s), self.prepared, self.compare
+        return np.fromiter((compare(p, prepared(t)) for t in others), dtype=np.float64, count=len(others))
+
+    def condensed(self, strings):
+        """ Вся сжатая матрица сразу, если бэкенд умеет её считать векторно; иначе None """
+        return None
+
+
+class FunctionDistance(StringDistance):
+    """ Любая функция двух строк без подготовки (например, difflib_distance) """
+
+    def __init__(self, function):
+        super().__init__()
+        self.function = function
+
+    def prepared(self, s):
+        return s
+
+    def compare(self, p, q):
+        return self.function(p, q)
+
+
+class LcsDistance(StringDistance):
+    """
+        normalized_lcs_distance; строка -- пакетом, с одним суффиксным автоматом.
+          normalize=True -- сравнивать строки без регистра, пробелов и пунктуации
+    """
+
+    function = staticmethod(normalized_lcs_distance)
+
+    def __init__(self, normalize=False):
+        super().__init__()
+        self.normalize = normalize
+
+    def prepare(self, s):
+        return (normalize_for_blocking(s) or s) if self.normalize else s
+
+    def prepared(self, s):
+        return super().prepared(s) if self.normalize else s
+
+    def compare(self, p, q):
+        return normalized_lcs_distance(p, q)
+
+    def row(self, s, others):
+        return normalized_lcs_distances(self.prepared(s), [self.prepared(t) for t in others])
+
+
+class LevenshteinDistance(StringDistance):
+    """ Расстояние Левенштейна, делённое на длину более длинной строки """
+
+    def prepare(self, s):
+        return s, char_masks(s)
+
+    def compare(self, p, q):
+        (s, masks), (t, _) = p, q
+        max_len = max(len(s), len(t))
+        return levenshtein(s, t, masks) / max_len if max_len else 0.0
+
+
+class JaroWinklerDistance(StringDistance):
+    """ 1 - сходство Джаро-Винклера; регистр и лишние пробелы не учитываются """
+
+    def prepare(self, s):
+        s = " ".join(s.lower().split())
+        return s, char_positions(s)
+
+    def compare(self, p, q):
+        return 1.0 - jaro_winkler_similarity(p[0], q[0], q[1])
+
+
+class TokenJaccardDistance(StringDistance):
+    """
+        1 - коэффициент Жаккара множеств слов (фамилии, инициалы, слова названия)
+          в нижнем регистре; числа (годы, страницы, тома) не учитываются
+    """
+
+    def prepare(self, s):
+        return frozenset(TOKEN_RE.findall(s.lower().replace("ё", "е")))
+
+    def compare(self, p, q):
+        union = len(p | q)
+        return 1.0 - len(p & q) / union if union else 0.0
+
+
+class NgramCosineDistance(StringDistance):
+    """
+        1 - косинус между векторами частот символьных n-грамм нормализованных
+          строк (normalize_for_blocking). Векторы разреженные: n-граммы хэшируются
+          в NGRAM_DIM координат; вся матрица считается произведением X * X^T
+          по блокам строк
+    """
+
+    # строк в блоке при подсчёте матрицы: блок -- плотный block_rows x n
+    block_rows = 256
+
+    def __init__(self, n=3):
+        super().__init__()
+        self.n = n
+
+    def prepare(self, s):
+        s = normalize_for_blocking(s) or s
+        n = self.n
+        grams = [s] if len(s) <= n else [s[i:i + n] for i in range(len(s) - n + 1)]
+        hashes = np.fromiter((zlib.crc32(g.encode("utf-8")) % NGRAM_DIM for g in grams),
+                             dtype=np.int64, count=len(grams))
+        indices, counts = np.unique(hashes, return_counts=True)
+        values = counts / np.sqrt(np.dot(counts, counts))
+        return indices, values
+
+    def compare(self, p, q):
+        _, i, j = np.intersect1d(p[0], q[0], assume_unique=True, return_indices=True)
+        return max(1.0 - float(np.dot(p[1][i], q[1][j])), 0.0)
+
+    def vectors(self, prepared):
+        """ Подготовленные строки -> разреженная матрица (строка на строку) """
+        indptr = np.zeros(len(prepared) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum([len(indices) for indices, _ in prepared])
+        indices = np.concatenate([indices for indices, _ in prepared]) if prepared else np.zeros(0, np.int64)
+        values = np.concatenate([values for _, values in prepared]) if prepared else np.zeros(0)
+        return csr_matrix((values, indices, indptr), shape=(len(prepared), NGRAM_DIM))
+
+    def row(self, s, others):
+        if not len(others):
+            return np.zeros(0)
+        x = self.vectors([self.prepared(s)])
+        sims = (self.vectors([self.prepared(t) for t in others]) @ x.T).toarray().ravel()
+        return np.maximum(1.0 - sims, 0.0)
+
+    def condensed(self, strings):
+        n = len(strings)
+        X = self.vectors([self.prepared(s) for s in strings])
+        XT = X.T.tocsc()
+        dists = np.empty(n * (n - 1) // 2, dtype=np.float32)
+
+        for start in range(0, n, self.block_rows):
+            sims = (X[start:start + self.block_rows] @ XT).toarray()
+            for i in range(start, min(start + self.block_rows, n)):
+                dists[condensed_offset(n, i):condensed_offset(n, i + 1)] = \
+                    np.maximum(1.0 - sims[i - start, i + 1:], 0.0)
+
+        return dists
+
+
+# Бэкенды расстояний: --distance в командной строке, distance= в cluster_strings*
+DISTANCES = {
+    "lcs": LcsDistance(),
+    # то же на строках без регистра, пробелов и пунктуации -- по умолчанию для lsh и stream
+    "lcs_normalized": LcsDistance(normalize=True),
+    "difflib": FunctionDistance(difflib_distance),
+    "levenshtein": LevenshteinDistance(),
+    "jaro_winkler": JaroWinklerDistance(),
+    "token_jaccard": TokenJaccardDistance(),
+    "ngram_cosine": NgramCosineDistance(),
+}
+
+
+def get_distance(distance=None, default="lcs"):
+    """ Бэкенд по имени из DISTANCES; готовый бэкенд; или функция двух строк """
+    if distance is None:
+        distance = default
+    if isinstance(distance, StringDistance):
+        return distance
+    if isinstance(distance, str):
+        if distance not in DISTANCES:
+            raise ValueError(f"Unknown distance '{distance}', expected one of: {', '.join(DISTANCES)}")
+        return DISTANCES[distance]
+
+    for backend in DISTANCES.values():
+        if getattr(backend, "function", None) is distance:
+            return backend
+    return FunctionDistance(distance)
+
+
+def condensed_offset(n, i):
+    """ Где в сжатой матрице n x n начинается строка i (пары (i, i + 1), (i, i + 2), ...) """
+    return i * (2 * n - i - 1) // 2
+
+
+def balanced_row_chunks(n, chunks):
+    """ Строки матрицы -> `chunks` отрезков [начало, конец) с примерно равным числом пар """
+    total = n * (n - 1) // 2
+    bounds, target = [0], total / max(chunks, 1)
+
     for i in range(n):
-        for j in range(i + 1, n):
-            dist = normalized_lcs_distance(strings[i], strings[j])
-            # dist = difflib_distance(strings[i], strings[j])
-            dists.append(dist)
-    return np.array(dists)
+        if condensed_offset(n, i + 1) >= target * len(bounds) and len(bounds) < chunks:
+            bounds.append(i + 1)
+    if bounds[-1] != n:
+        bounds.append(n)
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+# Состояние процесса пула: строки, бэкенд расстояния и общий массив результата
+_worker = {}
+
+
+def _init_worker(strings, distance, shm_name, size):
+    # Процесс пула только подключается к памяти: удаляет её (unlink) родитель.
+    #   С 3.13 подключение можно не регистрировать в resource_tracker,
+    #   иначе он удалит память при выходе первого же процесса (при spawn)
+    if sys.version_info >= (3, 13):
+        shm = shared_memory.SharedMemory(name=shm_name, track=False)
+    else:
+        shm = shared_memory.SharedMemory(name=shm_name)
+    _worker.update(strings=strings, distance=distance, shm=shm,
+                   out=np.ndarray((size,), dtype=np.float32, buffer=shm.buf))
+    # atexit в процессах пула не вызывается, а финализаторы multiprocessing -- да
+    util.Finalize(None, _close_worker, exitpriority=10)
+
+
+def _close_worker():
+    # сначала массив поверх буфера, иначе close() не даст закрыть память
+    _worker.pop("out", None)
+    shm = _worker.pop("shm", None)
+    if shm is not None:
+        shm.close()
+
+
+def _fill_rows(rows):
+    start, end = rows
+    strings, distance, out = _worker["strings"], _worker["distance"], _worker["out"]
+    n = len(strings)
+
+    for i in range(start, end):
+        out[condensed_offset(n, i):condensed_offset(n, i + 1)] = \
+            distance.row(strings[i], strings[i + 1:])
+
+    return condensed_offset(n, end) - condensed_offset(n, start)
+
+
+def compute_condensed_distance_matrix(strings, distance=None, processes=None):
+    """
+        Верхняя диагональная матрица со всеми расстояниями (float32)
+
+        Строки матрицы делятся на отрезки с примерно равным числом пар,
+          отрезки считаются в `processes` процессах (по умолчанию -- по числу ядер)
+          и пишутся сразу в общий массив в разделяемой памяти.
+          distance -- имя из DISTANCES, бэкенд или функция двух строк
+
+        Бэкенды, которые считают матрицу векторно (ngram_cosine), процессы не запускают
+    """
+    distance = get_distance(distance)
+    n = len(strings)
+    size = n * (n - 1) // 2
+    processes = processes or os.cpu_count() or 1
+
+    dists = distance.condensed(strings)
+    if dists is not None:
+        return dists
+
+    if processes == 1 or size < 10000:
+        dists = np.empty(size, dtype=np.float32)
+        for i in range(n):
+            dists[condensed_offset(n, i):condensed_offset(n, i + 1)] = \
+                distance.row(strings[i], strings[i + 1:])
+        return dists
+
+    shm = shared_memory.SharedMemory(create=True, size=max(size, 1) * 4)
+    try:
+        done = 0
+        with Pool(processes, initializer=_init_worker,
+                  initargs=(strings, distance, shm.name, size)) as pool:
+            for pairs in pool.imap_unordered(_fill_rows, balanced_row_chunks(n, processes * 16)):
+                done += pairs
+                logging.info(f"{done}/{size} distances computed ({100.0 * done / size:.0f}%)")
+            # процессы завершаются сами (и закрывают память), а не по terminate()
+            pool.close()
+            pool.join()
+
+        return np.ndarray((size,), dtype=np.float32, buffer=shm.buf).copy()
+    finally:
+        shm.close()
+        shm.unlink()
+
+
+# Простое число для хэш-функций MinHash: h(x) = (a * x + b) mod p;
+#   хэши k-грамм (crc32) и коэффициенты a, b меньше 2^32, так что
+#   a * x + b < 2^64 и в uint64 не переполняется
+MINHASH_PRIME = (1 << 61) - 1
+MINHASH_MAX_COEFFICIENT = 1 << 32
+
+
+def char_shingles(s, k=5):
+    """ Множество хэшей символьных k-грамм строки """
+    if len(s) <= k:
+        return {zlib.crc32(s.encode("utf-8"))}
+    return {zlib.crc32(s[i:i + k].encode("utf-8")) for i in range(len(s) - k + 1)}
+
+
+def minhash_permutations(num_perm=128, seed=42):
+    """ Коэффициенты (a, b) хэш-функций MinHash; сигнатуры сравнимы только при одних и тех же """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MINHASH_MAX_COEFFICIENT, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MINHASH_MAX_COEFFICIENT, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=42, permutations=None):
+    """
+        Сигнатуры MinHash: для каждой из num_perm хэш-функций -- минимум
+          по k-граммам строки; доля совпавших позиций двух сигнатур
+          оценивает коэффициент Жаккара их множеств k-грамм.
+          permutations -- готовые minhash_permutations(), если сигнатуры
+          считаются по частям (иначе создаются по num_perm и seed)
+    """
+    a, b = permutations if permutations is not None else minhash_permutations(num_perm, seed)
+    num_perm = len(a)
+
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint64)
+    for i, shingles in enumerate(shingle_sets):
+        x = np.fromiter(shingles, dtype=np.uint64, count=len(shingles))
+        # остаток -- до минимума: минимум берётся по значениям h(x), а не a * x + b
+        signatures[i] = ((np.outer(x, a) + b) % MINHASH_PRIME).min(axis=0)
+
+    return signatures
+
+
+def lsh_candidate_pairs(signatures, bands=32, max_bucket=200):
+    """
+        Locality-sensitive hashing: сигнатура режется на `bands` полос,
+          строки с совпавшей хотя бы одной полосой -- кандидаты в дубликаты.
+          При r = num_perm / bands строк в полосе пара с коэффициентом Жаккара s
+          становится кандидатом с вероятностью 1 - (1 - s^r)^bands
+
+        Корзины больше `max_bucket` (шаблонные строки) пропускаются,
+          чтобы число пар не стало снова квадратичным
+    """
+    n, num_perm = signatures.shape
+    rows = num_perm // bands
+    pairs = set()
+
+    for band in range(bands):
+        buckets = defaultdict(list)
+        chunk = np.ascontiguousarray(signatures[:, band * rows:(band + 1) * rows])
+        for i in range(n):
+            buckets[chunk[i].tobytes()].append(i)
+
+        for members in buckets.values():
+            if 1 < len(members) <= max_bucket:
+                pairs.update((members[x], members[y])
+                             for x in range(len(members)) for y in range(x + 1, len(members)))
+
+    return sorted(pairs)
+
+
+def cluster_strings_blocked(strings, max_distance=0.5, k=5, num_perm=128, bands=32,
+                            distance=None):
+    """
+        Кластеризация без полной матрицы расстояний
+
+          1) кандидаты в дубликаты -- MinHash-LSH по символьным k-граммам
+             нормализованных строк, почти линейно по числу строк;
+          2) точное расстояние (бэкенд `distance`, по умолчанию lcs_normalized) --
+             только для пар-кандидатов;
+          3) пары ближе `max_distance` -- рёбра разреженного графа,
+             кластеры -- его компоненты связности
+
+        Returns:
+          Словарь: метка кластера -> набор строк
+    """
+    if len(strings) == 0:
+        return {}
+    distance = get_distance(distance, default="lcs_normalized")
+
+    logging.info("Computing MinHash signatures...")
+    normalized = [normalize_for_blocking(s) or s for s in strings]
+    signatures = minhash_signatures([char_shingles(s, k) for s in normalized], num_perm)
+
+    logging.info("Looking for candidate pairs...")
+    pairs = lsh_candidate_pairs(signatures, bands)
+    n = len(strings)
+    logging.info(f"{len(pairs)} candidate pairs instead of {n * (n - 1) // 2}")
+
+    # кандидаты сгруппированы по первой строке пары: одна пачка row() на группу
+    by_first = defaultdict(list)
+    for i, j in pairs:
+        by_first[i].append(j)
+    edges = [(i, j) for i, js in by_first.items()
+             for j, d in zip(js, distance.row(strings[i], [strings[j] for j in js]))
+             if d <= max_distance]
+    logging.info(f"{len(edges)} pairs within distance {max_distance}")
+
+    rows = np.array([i for i, _ in edges], dtype=np.int64)
+    cols = np.array([j for _, j in edges], dtype=np.int64)
+    graph = coo_matrix((np.ones(len(edges)), (rows, cols)), shape=(n, n))
+    _, labels = connected_components(graph, directed=False)
+
+    clusters = {}
+    for label, string in zip(labels, strings):
+        clusters.setdefault(label + 1, []).append(string)
+
+    return clusters
+
+
+def iter_strings_from_file(filepath):
+    """ Чтение строк из файла по одной, без загрузки файла в память """
+    with open(filepath, "r", encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                yield line
 
 
 def read_strings_from_file(filepath):
     """ Чтение строк из файла """
-    with open(filepath, "r", encoding="utf-8") as f:
-        lines = [line.strip() for line in f if line.strip()]
-    return lines
+    return list(iter_strings_from_file(filepath))
 
 
-def cluster_strings(strings, max_clusters=120, linkage_method="ward"):
+def cluster_strings_streaming(strings, max_distance=0.5, k=5, num_perm=128, bands=32,
+                              max_bucket=200, log_every=10000, distance=None):
+    """
+        Потоковая кластеризация "по лидерам" для файлов, которым не хватит
+          памяти на матрицу расстояний: память -- O(n)
+
+        Строки приходят по одной (подойдёт iter_strings_from_file); первая
+          строка кластера -- его лидер. Новая строка сравнивается (точно) только
+          с лидерами, у которых совпала хотя бы одна полоса MinHash-LSH, и
+          присоединяется к ближайшему, если он ближе `max_distance`
+          (бэкенд `distance`, по умолчанию lcs_normalized),
+          иначе сама становится лидером нового кластера
+
+        Returns:
+          Словарь: метка кластера -> набор строк
+    """
+    distance = get_distance(distance, default="lcs_normalized")
+    clusters = {}
+    # лидеры: строка и метка кластера
+    leaders, leader_labels = [], []
+    # полоса сигнатуры -> номера лидеров с такой полосой
+    buckets = defaultdict(list)
+    rows = num_perm // bands
+    # хэш-функции одни на все строки: создаются один раз, а не на каждую строку
+    permutations = minhash_permutations(num_perm)
+    count = 0
+
+    for count, string in enumerate(strings, 1):
+        normalized = normalize_for_blocking(string) or string
+        signature = minhash_signatures([char_shingles(normalized, k)], permutations=permutations)[0]
+        keys = [(band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(bands)]
+
+        candidates = sorted({leader for key in keys for leader in buckets.get(key, ())})
+        best = None
+        if candidates:
+            # новая строка готовится (для lcs -- автомат) один раз на всех кандидатов
+            distances = distance.row(string, [leaders[c] for c in candidates])
+            nearest = int(np.argmin(distances))
+            if distances[nearest] <= max_distance:
+                best = candidates[nearest]
+
+        if best is None:
+            label = len(leaders) + 1
+            leaders.append(string)
+            leader_labels.append(label)
+            for key in keys:
+                # в переполненные корзины (шаблонные строки) больше не добавляем
+                if len(buckets[key]) < max_bucket:
+                    buckets[key].append(label - 1)
+        else:
+            label = leader_labels[best]
+
+        clusters.setdefault(label, []).append(string)
+
+        if count % log_every == 0:
+            logging.info(f"{count} strings read, {len(leaders)} clusters")
+
+    logging.info(f"{count} strings read, {len(leaders)} clusters")
+    return clusters
+
+
+def cluster_strings(strings, max_clusters=120, linkage_method="ward", distance=None,
+                    processes=None):
     """
         Иерархическая кластеризация
 
@@ -85,6 +769,8 @@ def cluster_strings(strings, max_clusters=120, linkage_method="ward"):
           - threshold: порог для разрезания дендрограммы
           - linkage_method: метод объединения кластеров, linkage
                             (e.g., 'single', 'complete', 'average').
+          - distance: имя бэкенда из DISTANCES (по умолчанию lcs), бэкенд или функция двух строк
+          - processes: число процессов для матрицы расстояний
         Returns:
           Словарь: метка кластера -> набор строк
     """
@@ -92,7 +778,7 @@ def cluster_strings(strings, max_clusters=120, linkage_method="ward"):
         return {}
 
     logging.info("Computing distance matrix...")
-    dist_matrix = compute_condensed_distance_matrix(strings)
+    dist_matrix = compute_condensed_distance_matrix(strings, distance, processes)
 
     logging.info("Building linkage...")
     Z = linkage(dist_matrix, method=linkage_method)
@@ -107,28 +793,47 @@ def cluster_strings(strings, max_clusters=120, linkage_method="ward"):
     return clusters
 
 
-def main(input_file="references-petrov.txt", max_clusters=None):
-    try:
-        strings = read_strings_from_file(input_file)
-    except Exception as e:
-        print(f"Error reading file '{input_file}': {e}", file=sys.stderr)
-        sys.exit(1)
-
-    if not strings:
-        print("No strings found in the input file.")
-        sys.exit(0)
-
-    if max_clusters is None:
-        max_clusters = int(len(strings) * 0.87)  # заплати налоги и спи спокойно
-
-    clusters = cluster_strings(strings,
-                               max_clusters=max_clusters,  # а может лучше по threshold?
-                               linkage_method="average")  # ward? complete? single?
+def main(input_file="references-petrov.txt", max_clusters=None, method="hierarchical",
+         max_distance=0.5, processes=None, distance=None):
+    if method == "stream":
+        # файл читается построчно и целиком в память не загружается
+        try:
+            clusters = cluster_strings_streaming(iter_strings_from_file(input_file),
+                                                 max_distance=max_distance, distance=distance)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error reading file '{input_file}': {e}", file=sys.stderr)
+            sys.exit(1)
+
+        if not clusters:
+            print("No strings found in the input file.")
+            sys.exit(0)
+    else:
+        try:
+            strings = read_strings_from_file(input_file)
+        except (OSError, UnicodeDecodeError) as e:
+            print(f"Error reading file '{input_file}': {e}", file=sys.stderr)
+            sys.exit(1)
+
+        if not strings:
+            print("No strings found in the input file.")
+            sys.exit(0)
+
+        if method == "lsh":
+            clusters = cluster_strings_blocked(strings, max_distance=max_distance, distance=distance)
+        else:
+            if max_clusters is None:
+                max_clusters = int(len(strings) * 0.87)  # заплати налоги и спи спокойно
+
+            clusters = cluster_strings(strings,
+                                       max_clusters=max_clusters,  # а может лучше по threshold?
+                                       linkage_method="average",  # ward? complete? single?
+                                       distance=distance,
+                                       processes=processes)
 
     clusters_sorted = sorted([(len(cluster), cid, cluster)
                               for cid, cluster in clusters.items()])
 
-    logging.info(f"Clusters (max_clusters={max_clusters}):")
+    logging.info(f"Clusters ({method}, {len(clusters)} in total):")
 
     result = []
     for cluster_size, cluster_id, clustered_strings in clusters_sorted:
@@ -146,9 +851,22 @@ if __name__ == "__main__":
         2) что можно придумать, чтобы он работал разумное время на references-all-mkn.txt?
         3) попробуйте добиться разумного времени работы при сохранении достойного качества
     """
+    arg_parser = argparse.ArgumentParser()
+    # ссылки из дипломных работ выпускников Фёдора Владимировича
+    arg_parser.add_argument("--input", default="references-petrov.txt")
+    # lsh -- для больших файлов: python grouping.py --input references-all-mkn.txt --method lsh
+    # stream -- если и строки не помещаются в память целиком
+    arg_parser.add_argument("--method", choices=["hierarchical", "lsh", "stream"], default="hierarchical")
+    arg_parser.add_argument("--max-clusters", type=int, default=None)
+    arg_parser.add_argument("--max-distance", type=float, default=0.5)
+    arg_parser.add_argument("--processes", type=int, default=None)
+    # по умолчанию lcs, для lsh и stream -- lcs_normalized; порог --max-distance у каждого свой
+    arg_parser.add_argument("--distance", choices=list(DISTANCES), default=None)
+    args = arg_parser.parse_args()
+
     logging.info("Starting work.")
 
-    # ссылки из дипломных работ выпускников Фёдора Владимировича
-    main(input_file="references-petrov.txt")
+    main(input_file=args.input, max_clusters=args.max_clusters, method=args.method,
+         max_distance=args.max_distance, processes=args.processes, distance=args.distance)
 
     logging.info("Done.")
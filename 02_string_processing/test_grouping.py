@@ -0,0 +1,188 @@
+""" Проверки grouping.py: python -m pytest test_grouping.py """
+import random
+
+import numpy as np
+
+import grouping
+
+ALPHABET = "abcdefghijklmnopqrstuvwxyz"
+
+
+def random_string(rng, length):
+    return "".join(rng.choice(ALPHABET) for _ in range(length))
+
+
+def with_typos(rng, s, typos):
+    """ Несколько замен, вставок и удалений символов """
+    s = list(s)
+    for _ in range(typos):
+        i = rng.randrange(len(s))
+        edit = rng.choice("sid")
+        if edit == "s":
+            s[i] = rng.choice(ALPHABET)
+        elif edit == "i":
+            s.insert(i, rng.choice(ALPHABET))
+        elif len(s) > 1:
+            del s[i]
+    return "".join(s)
+
+
+def test_lsh_finds_near_duplicates():
+    rng = random.Random(0)
+    originals = [random_string(rng, 80) for _ in range(200)]
+    copies = [with_typos(rng, s, 2) for s in originals]
+    strings = originals + copies
+
+    signatures = grouping.minhash_signatures([grouping.char_shingles(s) for s in strings])
+    pairs = set(grouping.lsh_candidate_pairs(signatures))
+
+    found = sum((i, i + len(originals)) in pairs for i in range(len(originals)))
+    # у пары с двумя опечатками на 80 символов Жаккард 5-грамм ~0.8: почти наверняка кандидаты
+    assert found >= 0.95 * len(originals)
+    # а случайные строки -- почти никогда
+    assert len(pairs) < 2 * len(originals)
+
+
+def test_minhash_is_exact_modulo_prime():
+    rng = random.Random(7)
+    shingle_sets = [grouping.char_shingles(random_string(rng, 40)) for _ in range(20)]
+    # крайние значения: при переполнении uint64 они разошлись бы первыми
+    shingle_sets.append({0, 2 ** 32 - 1})
+    a, b = grouping.minhash_permutations(16)
+
+    signatures = grouping.minhash_signatures(shingle_sets, permutations=(a, b))
+    expected = [[min((int(ai) * x + int(bi)) % grouping.MINHASH_PRIME for x in shingles)
+                 for ai, bi in zip(a, b)]
+                for shingles in shingle_sets]
+    assert signatures.tolist() == expected
+
+
+def test_blocked_clusters_join_near_duplicates():
+    rng = random.Random(1)
+    originals = [random_string(rng, 60) for _ in range(50)]
+    strings = originals + [with_typos(rng, s, 1) for s in originals]
+
+    clusters = grouping.cluster_strings_blocked(strings, max_distance=0.5)
+    label = {s: c for c, members in clusters.items() for s in members}
+    assert sum(label[s] == label[t] for s, t in zip(originals, strings[len(originals):])) >= 48
+    # разные строки в один кластер не попадают
+    assert len({label[s] for s in originals}) == len(originals)
+
+
+def test_parallel_matrix_matches_serial():
+    rng = random.Random(2)
+    # больше 10000 пар, иначе матрица считается в одном процессе
+    strings = [random_string(rng, rng.randint(5, 40)) for _ in range(160)]
+
+    serial = grouping.compute_condensed_distance_matrix(strings, "levenshtein", processes=1)
+    parallel = grouping.compute_condensed_distance_matrix(strings, "levenshtein", processes=3)
+    assert parallel.dtype == np.float32
+    assert np.array_equal(serial, parallel)
+
+
+def levenshtein_dp(s, t):
+    """ Эталон: динамика по строкам таблицы """
+    previous = list(range(len(t) + 1))
+    for i, a in enumerate(s, 1):
+        current = [i]
+        for j, b in enumerate(t, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (a != b)))
+        previous = current
+    return previous[-1]
+
+
+def jaro_winkler_reference(s1, s2, prefix_scale=0.1):
+    """ Эталон: совпадения ищутся перебором всего окна """
+    if s1 == s2:
+        return 1.0
+    if not s1 or not s2:
+        return 0.0
+    window = max(max(len(s1), len(s2)) // 2 - 1, 0)
+    used = [False] * len(s2)
+    matched1 = []
+    for i, ch in enumerate(s1):
+        for j in range(max(0, i - window), min(len(s2), i + window + 1)):
+            if not used[j] and s2[j] == ch:
+                used[j] = True
+                matched1.append(ch)
+                break
+    m = len(matched1)
+    if not m:
+        return 0.0
+    matched2 = [s2[j] for j in range(len(s2)) if used[j]]
+    transpositions = sum(a != b for a, b in zip(matched1, matched2)) // 2
+    jaro = (m / len(s1) + m / len(s2) + (m - transpositions) / m) / 3
+    prefix = 0
+    for a, b in zip(s1[:4], s2[:4]):
+        if a != b:
+            break
+        prefix += 1
+    return jaro + prefix * prefix_scale * (1.0 - jaro)
+
+
+def longest_common_substring_dp(s1, s2):
+    """ Эталон: исходная динамика по всей таблице m x n """
+    dp = [[0] * (len(s2) + 1) for _ in range(len(s1) + 1)]
+    max_length = 0
+    for i in range(len(s1)):
+        for j in range(len(s2)):
+            if s1[i] == s2[j]:
+                dp[i + 1][j + 1] = dp[i][j] + 1
+                max_length = max(max_length, dp[i + 1][j + 1])
+    return max_length
+
+
+def test_lcs_matches_dynamic_programming():
+    assert grouping.longest_common_substring("abcdefgh", "xxcdefyy") == 4
+    assert grouping.longest_common_substring("", "abc") == 0
+    assert grouping.normalized_lcs_distance("", "") == 0.0
+
+    rng = random.Random(6)
+    for _ in range(300):
+        # короткий алфавит -- много повторов, на них автомат и ошибся бы
+        alphabet = rng.choice(["ab", "abc", ALPHABET])
+        s = "".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40)))
+        others = ["".join(rng.choice(alphabet) for _ in range(rng.randint(0, 40))) for _ in range(5)]
+
+        expected = [longest_common_substring_dp(s, t) for t in others]
+        assert [grouping.longest_common_substring(s, t) for t in others] == expected, (s, others)
+        assert grouping.longest_common_substrings(s, others).tolist() == expected, (s, others)
+
+        distances = [1.0 - lcs / max(len(s), len(t)) if s or t else 0.0 for lcs, t in zip(expected, others)]
+        assert np.allclose([grouping.normalized_lcs_distance(s, t) for t in others], distances)
+        assert np.allclose(grouping.normalized_lcs_distances(s, others), distances)
+        assert np.allclose(grouping.DISTANCES["lcs"].row(s, others), distances)
+
+
+def test_levenshtein_matches_dynamic_programming():
+    rng = random.Random(3)
+    assert grouping.levenshtein("kitten", "sitting") == 3
+    assert grouping.levenshtein("", "abc") == 3
+    assert grouping.levenshtein("abc", "") == 3
+
+    for _ in range(500):
+        # короткий алфавит -- много совпадений; длины и за 64 бита
+        s = "".join(rng.choice("abc") for _ in range(rng.randint(0, 90)))
+        t = "".join(rng.choice("abc") for _ in range(rng.randint(0, 90)))
+        assert grouping.levenshtein(s, t) == levenshtein_dp(s, t), (s, t)
+
+
+def test_jaro_winkler_matches_reference():
+    assert round(grouping.jaro_winkler_similarity("MARTHA", "MARHTA"), 4) == 0.9611
+    assert round(grouping.jaro_winkler_similarity("DWAYNE", "DUANE"), 4) == 0.84
+    assert round(grouping.jaro_winkler_similarity("DIXON", "DICKSONX"), 4) == 0.8133
+
+    rng = random.Random(4)
+    for _ in range(500):
+        s = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 30)))
+        t = "".join(rng.choice("abcd") for _ in range(rng.randint(0, 30)))
+        assert abs(grouping.jaro_winkler_similarity(s, t) - jaro_winkler_reference(s, t)) < 1e-12, (s, t)
+
+
+def test_distance_backends_are_normalized():
+    rng = random.Random(5)
+    strings = [random_string(rng, rng.randint(0, 20)) for _ in range(30)]
+    for name, backend in grouping.DISTANCES.items():
+        row = backend.row(strings[0], strings)
+        assert np.all((row >= -1e-9) & (row <= 1 + 1e-9)), name
+        assert abs(backend(strings[1], strings[1])) < 1e-9, name
@@ -0,0 +1,115 @@
+""" Меры связности биграмм (PMI^k, NPMI, t-score, хи-квадрат, log-likelihood) над массивами частот """
+from typing import List, Tuple
+
+import numpy as np
+
+from ngram_counts import NgramCounts, top_indices
+
+MEASURES = ("pmi", "npmi", "t_score", "chi2", "llr")
+
+
+class BigramStats(object):
+    """
+        Частоты для оценки биграмм (x, y), все -- массивы одной длины:
+          c_xy -- частота биграммы, c_x и c_y -- частоты слов в корпусе.
+          Меры считаются сразу для всех биграмм, без цикла по ним
+
+        Для хи-квадрат и log-likelihood нужна согласованная таблица 2 x 2,
+          поэтому там x и y считаются по самим биграммам: сколько биграмм
+          начинается с x (row) и сколько кончается на y (col)
+    """
+
+    def __init__(self, left: np.ndarray, right: np.ndarray, c_xy: np.ndarray,
+                 unigram_counts: np.ndarray, total_unigrams: int, total_bigrams: int):
+        self.left, self.right = left, right
+        self.c_xy = c_xy.astype(np.float64)
+        self.c_x = unigram_counts[left].astype(np.float64)
+        self.c_y = unigram_counts[right].astype(np.float64)
+        self.total_unigrams = total_unigrams
+        self.total_bigrams = total_bigrams
+
+        self.row = np.bincount(left, weights=c_xy, minlength=len(unigram_counts))[left]
+        self.col = np.bincount(right, weights=c_xy, minlength=len(unigram_counts))[right]
+
+    @classmethod
+    def from_counts(cls, counts: NgramCounts, min_count: int = 1) -> "BigramStats":
+        """ Биграммы реже `min_count` отбрасываются до подсчёта мер """
+        left, right, c_xy = counts.bigrams()
+        stats = cls(left, right, c_xy, counts.unigram_counts, counts.total_unigrams, counts.total_bigrams)
+        return stats.filtered(stats.c_xy >= min_count) if min_count > 1 else stats
+
+    def filtered(self, mask: np.ndarray) -> "BigramStats":
+        stats = BigramStats.__new__(BigramStats)
+        stats.__dict__.update({name: value[mask] if isinstance(value, np.ndarray) else value
+                               for name, value in self.__dict__.items()})
+        return stats
+
+    def __len__(self):
+        return len(self.c_xy)
+
+    def pmi(self, k: float = 1) -> np.ndarray:
+        """
+            PMI^k = log p(x, y)^k / (p(x) p(y)): при k > 1 частые пары
+              поднимаются выше редких (у чистой PMI наверху -- единичные пары)
+        """
+        joint = k * (np.log2(self.c_xy) - np.log2(self.total_bigrams))
+        return joint - np.log2(self.c_x) - np.log2(self.c_y) + 2 * np.log2(self.total_unigrams)
+
+    def npmi(self) -> np.ndarray:
+        """ PMI / -log p(x, y): от -1 до 1, 1 -- слова встречаются только вместе """
+        log_joint = np.log2(self.c_xy) - np.log2(self.total_bigrams)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(log_joint < 0, self.pmi() / -log_joint, 1.0)
+
+    def t_score(self) -> np.ndarray:
+        """ (наблюдаемая - ожидаемая частота) / sqrt(наблюдаемой) """
+        expected = self.c_x * self.c_y / self.total_unigrams
+        return (self.c_xy - expected) / np.sqrt(self.c_xy)
+
+    def _table(self) -> Tuple[np.ndarray, ...]:
+        """ Наблюдаемые частоты таблицы 2 x 2: (x, y), (x, не y), (не x, y), (не x, не y) """
+        n = float(self.total_bigrams)
+        o11 = self.c_xy
+        o12 = self.row - o11
+        o21 = self.col - o11
+        o22 = n - self.row - self.col + o11
+        return n, o11, o12, o21, o22
+
+    def chi2(self) -> np.ndarray:
+        n, o11, o12, o21, o22 = self._table()
+        denominator = (o11 + o12) * (o11 + o21) * (o12 + o22) * (o21 + o22)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(denominator > 0, n * (o11 * o22 - o12 * o21) ** 2 / denominator, 0.0)
+
+    def llr(self) -> np.ndarray:
+        """ Логарифм отношения правдоподобия Даннинга: 2 * sum O * ln(O / E), 0 * ln 0 = 0 """
+        n, o11, o12, o21, o22 = self._table()
+        rows, cols = (o11 + o12, o21 + o22), (o11 + o21, o12 + o22)
+        result = np.zeros(len(self))
+
+        for observed, row, col in ((o11, rows[0], cols[0]), (o12, rows[0], cols[1]),
+                                   (o21, rows[1], cols[0]), (o22, rows[1], cols[1])):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                terms = observed * np.log(observed * n / (row * col))
+            result += np.where(observed > 0, terms, 0.0)
+
+        return 2 * result
+
+    def score(self, measure: str = "pmi", k: float = 1) -> np.ndarray:
+        if measure not in MEASURES:
+            raise ValueError(f"Unknown measure '{measure}', expected one of: {', '.join(MEASURES)}")
+        return self.pmi(k) if measure == "pmi" else getattr(self, measure)()
+
+
+def top_collocations(counts: NgramCounts, n: int = 5, measure: str = "pmi", k: float = 1,
+                     min_count: int = 1) -> List[Tuple[str, str, float, int, int, int]]:
+    """
+        n лучших биграмм по мере `measure`: (x, y, мера, c_xy, c_x, c_y);
+          лучшие выбираются partition, без сортировки всех биграмм;
+          при равной мере -- по (id левого, id правого токена)
+    """
+    stats = BigramStats.from_counts(counts, min_count)
+    scores = stats.score(measure, k)
+    return [(counts.tokens[stats.left[i]], counts.tokens[stats.right[i]], float(scores[i]),
+             int(stats.c_xy[i]), int(stats.c_x[i]), int(stats.c_y[i]))
+            for i in top_indices(scores, n)]
@@ -1,8 +1,9 @@
-import math
+import argparse
 import os
-from collections import Counter
+import shutil
 
-from tqdm import tqdm
+from collocations import MEASURES, top_collocations
+from count_store import CountStore
 
 """
     Убедитесь, что использование PMI в чистом виде
@@ -21,35 +22,58 @@ from tqdm import tqdm
 
 if __name__ == "__main__":
 
-    if not os.path.exists("sentences.txt"):
-        print("Please run `prepare_data.py` first. "
-              "Make sure you have a stable Internet connection.")
-
-    bigram_counter = Counter()
-    unigram_counter = Counter()
-
-    with open("sentences.txt", "r", encoding="utf-8") as rf:
-
-        for line in tqdm(rf):
-            tokens = line.strip().split(" ")
-
-            for i in range(len(tokens) - 1):
-                bigram_counter[(tokens[i], tokens[i + 1])] += 1
-                unigram_counter[tokens[i]] += 1
-
-            unigram_counter[tokens[-1]] += 1
+    arg_parser = argparse.ArgumentParser()
+    arg_parser.add_argument("--measure", choices=MEASURES, default="pmi")
+    arg_parser.add_argument("--k", type=float, default=1)
+    # биграммы реже этого отбрасываются до подсчёта мер
+    arg_parser.add_argument("--min-count", type=int, default=1)
+    arg_parser.add_argument("--top", type=int, default=5)
+    # частоты считаются один раз и хранятся на диске (см. count_store.py)
+    arg_parser.add_argument("--store", default="counts")
+    arg_parser.add_argument("--recount", action="store_true")
+    # дописать в хранилище частоты ещё нескольких файлов
+    arg_parser.add_argument("--append", nargs="*", default=[])
+    args = arg_parser.parse_args()
+
+    if args.recount and os.path.exists(args.store):
+        shutil.rmtree(args.store)
+
+    store = CountStore(args.store)
+
+    # файлы поменялись после подсчёта -- старые частоты не годятся
+    stale = store.stale_sources()
+    if stale:
+        print(f"Recounting {args.store}: changed since counting: {', '.join(stale)}")
+        store.recount()
+        store.save()
+
+    if not store.sentences:
+        if not os.path.exists("sentences.txt"):
+            print("Please run `prepare_data.py` first. "
+                  "Make sure you have a stable Internet connection.")
+
+        # токены -- целые id, биграммы -- ключи int64; файл считается кусками в нескольких процессах
+        store.append_file("sentences.txt")
+        store.save()
+
+    if args.append:
+        for path in args.append:
+            store.append_file(path)
+        store.save()
+
+    counts = store.ngram_counts()
 
     print("Common ngrams:")
 
-    for (a, b), count in bigram_counter.most_common(6):
+    for (a, b), count in counts.most_common_bigrams(6):
         print(f"[{a}]+[{b}]\t({count})")
 
-    for w, count in unigram_counter.most_common(6):
+    for w, count in counts.most_common_unigrams(6):
         print(f"[{w}]\t({count})")
 
-    print("Total unigrams (unique tokens):", len(unigram_counter))
-    print("Total unigrams occurrences    :", sum(unigram_counter.values()))
-    print("Total bigrams occurrences     :", sum(bigram_counter.values()))
+    print("Total unigrams (unique tokens):", len(counts.tokens))
+    print("Total unigrams occurrences    :", counts.total_unigrams)
+    print("Total bigrams occurrences     :", counts.total_bigrams)
     print()
 
     """
@@ -60,29 +84,15 @@ if __name__ == "__main__":
     probability of co-occurrence gets a small PMI score. 
     """
 
-    total_unigrams = sum(unigram_counter.values())
-    total_bigrams = sum(bigram_counter.values())
-    pmi_values = []
-
     # The additional factors of p (x,y) inside the logarithm are intended
     #   to correct the bias of PMI towards low-frequency events,
     #   by boosting the scores of frequent pairs.
-    k = 1
-
-    for (a, b), count in bigram_counter.items():
-        # логарифмированный числитель: p(x, y)
-        joint = math.log2(bigram_counter[(a, b)]) - math.log2(total_bigrams)
-        joint = k * joint
-        # логарифмированный знаменатель p(x)p(y) входит как -log(p(x)) - log(p(y))
-        pmi_k = - math.log2(unigram_counter[a]) + 2 * math.log2(total_unigrams) \
-                - math.log2(unigram_counter[b]) \
-                + joint
-        pmi_values.append((pmi_k, (a, b)))
-
-    pmi_sorted = sorted(pmi_values, reverse=True)
-
-    for pmi, (a, b) in pmi_sorted[:5]:
-        print(f"[{a}]+[{b}]\t{pmi:.4f}\t"
-              f"xy={bigram_counter[(a, b)]}\t"
-              f"x={unigram_counter[a]}\t"
-              f"y={unigram_counter[b]}")
+    #
+    # Меры считаются сразу по массивам частот (см. collocations.py):
+    #   --measure pmi|npmi|t_score|chi2|llr, --k, --min-count
+    for a, b, score, xy, x, y in top_collocations(counts, n=args.top, measure=args.measure,
+                                                  k=args.k, min_count=args.min_count):
+        print(f"[{a}]+[{b}]\t{score:.4f}\t"
+              f"xy={xy}\t"
+              f"x={x}\t"
+              f"y={y}")
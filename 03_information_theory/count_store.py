@@ -0,0 +1,269 @@
+""" Частоты корпуса на диске: пополняются новыми текстами и загружаются без пересчёта """
+import json
+import os
+from multiprocessing import Pool
+from typing import Iterable, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+from ngram_counts import (CHUNK_BYTES, NgramCounts, distance_pairs, encode_lines, file_chunks,
+                          pack_bigrams, read_chunk, reduce_counts, unpack_bigrams)
+
+
+def count_chunk(lines: Iterable[str], max_distance: int):
+    """
+        Счётчики куска корпуса для хранилища
+
+        Returns:
+          токены куска (id -- позиция в списке), частоты токенов,
+          для каждого расстояния 1..max_distance -- ключи пар и их частоты,
+          число предложений
+    """
+    tokens, ids = encode_lines(lines)
+    unigram_counts = np.bincount(ids[ids >= 0], minlength=len(tokens)).astype(np.int64)
+
+    pairs = []
+    for distance in range(1, max_distance + 1):
+        keys, counts = np.unique(distance_pairs(ids, distance), return_counts=True)
+        pairs.append((keys, counts.astype(np.int64)))
+
+    return tokens, unigram_counts, pairs, int((ids < 0).sum())
+
+
+def count_store_chunk(args: Tuple[str, int, int, int]):
+    path, start, end, max_distance = args
+    return count_chunk(read_chunk(path, start, end), max_distance)
+
+
+class CountStore(object):
+    """
+        Частоты корпуса в каталоге `path`:
+          vocab.txt -- токены по одному в строке (id -- номер строки),
+          unigrams.npy -- частоты токенов,
+          pairs{d}.keys.npy, pairs{d}.counts.npy -- упорядоченные ключи пар (x, y),
+            где y стоит через d позиций после x (pack_bigrams), и их частоты,
+            d = 1..max_distance; pairs1 -- обычные биграммы,
+          meta.json -- max_distance, число предложений, добавленные файлы
+            (путь, размер и время изменения)
+
+        Массивы отображаются в память, так что загрузка занимает миллисекунды,
+          а PMI^k или окно другого размера считаются без нового подсчёта.
+          Тексты добавляются append_file/append_lines, шарды -- merge; новые
+          токены дописываются в конец словаря, старые id не меняются.
+          На диск изменения попадают после save()
+
+        Если добавленный файл с тех пор изменился, частоты устарели:
+          это проверяет stale_sources(), а пересчитывает recount()
+    """
+
+    def __init__(self, path: str, max_distance: int = 2):
+        self.path = path
+        meta_path = os.path.join(path, "meta.json")
+
+        if os.path.exists(meta_path):
+            with open(meta_path, "r", encoding="utf-8") as rf:
+                meta = json.load(rf)
+            # у существующего хранилища расстояние уже выбрано при создании
+            self.max_distance = meta["max_distance"]
+            self.sentences = meta["sentences"]
+            self.sources = meta["sources"]
+
+            # токены -- по одному в строке и сами могут быть пустыми или содержать
+            #   \x0b, \u2028..., поэтому делим только по \n, а не splitlines()
+            with open(os.path.join(path, "vocab.txt"), "r", encoding="utf-8", newline="") as rf:
+                self.tokens: List[str] = rf.read().split("\n")[:-1]
+
+            self.unigram_counts = np.load(os.path.join(path, "unigrams.npy"), mmap_mode="r")
+            self.pairs = [(np.load(os.path.join(path, f"pairs{d}.keys.npy"), mmap_mode="r"),
+                           np.load(os.path.join(path, f"pairs{d}.counts.npy"), mmap_mode="r"))
+                          for d in range(1, self.max_distance + 1)]
+        else:
+            self._reset(max_distance)
+
+        self._token_ids = None
+
+    def _reset(self, max_distance: int):
+        self.max_distance = max_distance
+        self.sentences = 0
+        self.sources = []
+        self.tokens = []
+        self.unigram_counts = np.zeros(0, dtype=np.int64)
+        self.pairs = [(np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64))
+                      for _ in range(max_distance)]
+        self._token_ids = None
+
+    @property
+    def token_ids(self) -> dict:
+        """ Токен -> id; строится при первом обращении """
+        if self._token_ids is None:
+            self._token_ids = {token: i for i, token in enumerate(self.tokens)}
+        return self._token_ids
+
+    def append_file(self, path: str, processes: int = None, chunk_bytes: int = CHUNK_BYTES):
+        """
+            Добавить частоты файла (строка -- предложение); куски файла
+              считаются в `processes` процессах, как в ngram_counts.count_file
+        """
+        # размер и время изменения -- до чтения: если файл меняется во время подсчёта,
+        #   хранилище окажется устаревшим, а не наоборот
+        stat = os.stat(path)
+        chunks = [(path, start, end, self.max_distance) for start, end in file_chunks(path, chunk_bytes)]
+        processes = min(processes or os.cpu_count() or 1, max(len(chunks), 1))
+
+        if processes == 1:
+            self._add(tqdm(map(count_store_chunk, chunks), "chunks", total=len(chunks)))
+        else:
+            with Pool(processes) as pool:
+                self._add(tqdm(pool.imap(count_store_chunk, chunks), "chunks", total=len(chunks)))
+
+        self.sources.append({"path": os.path.abspath(path), "size": stat.st_size, "mtime": stat.st_mtime})
+
+    def append_lines(self, lines: Iterable[str]):
+        """ Добавить частоты строк не из файла: пересчитать их recount() не сможет """
+        chunk = count_chunk(lines, self.max_distance)
+        self._add([chunk])
+        self.sources.append({"path": None, "sentences": chunk[-1]})
+
+    def stale_sources(self) -> List[str]:
+        """ Добавленные файлы, которые изменились или пропали после подсчёта """
+        stale = []
+        for source in self.sources:
+            path = source["path"]
+            if path is None:
+                continue
+            try:
+                stat = os.stat(path)
+            except FileNotFoundError:
+                stale.append(path)
+                continue
+            # у хранилищ без mtime (старый формат) проверить нечего -- считаем устаревшими
+            if stat.st_size != source["size"] or stat.st_mtime != source.get("mtime"):
+                stale.append(path)
+        return stale
+
+    def recount(self, processes: int = None, chunk_bytes: int = CHUNK_BYTES):
+        """
+            Посчитать всё заново по тем же файлам; если каких-то файлов нет
+              (или частоты добавлялись append_lines), пересчитать нельзя -- ValueError
+        """
+        paths = [source["path"] for source in self.sources]
+        missing = [path for path in paths if path is None or not os.path.exists(path)]
+        if missing:
+            raise ValueError(f"Cannot recount {self.path}: sources are not available: "
+                             f"{', '.join(path or '<lines>' for path in missing)}")
+
+        self._reset(self.max_distance)
+        for path in paths:
+            self.append_file(path, processes, chunk_bytes)
+
+    def merge(self, other: "CountStore"):
+        """ Слить частоты другого хранилища (шарда) """
+        if other.max_distance < self.max_distance:
+            raise ValueError(f"Cannot merge a store with max_distance={other.max_distance} "
+                             f"into one with max_distance={self.max_distance}")
+        self._add([(other.tokens, other.unigram_counts, other.pairs, other.sentences)])
+        self.sources.extend(other.sources)
+
+    def _intern(self, tokens: List[str]) -> np.ndarray:
+        token_ids = self.token_ids
+        for token in tokens:
+            if token not in token_ids:
+                token_ids[token] = len(self.tokens)
+                self.tokens.append(token)
+        return np.fromiter((token_ids[token] for token in tokens), dtype=np.int64, count=len(tokens))
+
+    def _add(self, chunks):
+        unigram_counts = np.zeros(len(self.tokens), dtype=np.int64)
+        unigram_counts[:len(self.unigram_counts)] = self.unigram_counts
+        # для каждого расстояния: сведённые частоты и ещё не сведённые куски
+        merged = [(np.asarray(keys), np.asarray(counts)) for keys, counts in self.pairs]
+        pending = [[] for _ in range(self.max_distance)]
+        pending_size = 0
+
+        for tokens, chunk_unigrams, chunk_pairs, sentences in chunks:
+            remap = self._intern(tokens)
+            if len(unigram_counts) < len(self.tokens):
+                unigram_counts = np.concatenate(
+                    [unigram_counts, np.zeros(len(self.tokens) - len(unigram_counts), dtype=np.int64)]
+                )
+            # в одном куске id не повторяются
+            unigram_counts[remap] += chunk_unigrams
+            self.sentences += sentences
+
+            for d, (keys, counts) in enumerate(chunk_pairs[:self.max_distance]):
+                left, right = unpack_bigrams(np.asarray(keys))
+                pending[d].append((pack_bigrams(remap[left], remap[right]), np.asarray(counts)))
+                pending_size += len(keys)
+
+            if pending_size > max(len(merged[0][0]), 1 << 20):
+                merged = self._reduce(merged, pending)
+                pending, pending_size = [[] for _ in range(self.max_distance)], 0
+
+        self.unigram_counts = unigram_counts
+        self.pairs = self._reduce(merged, pending)
+
+    @staticmethod
+    def _reduce(merged, pending):
+        return [reduce_counts(np.concatenate([keys] + [k for k, _ in chunk]),
+                              np.concatenate([counts] + [c for _, c in chunk]))
+                for (keys, counts), chunk in zip(merged, pending)]
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+
+        # Пишем рядом и подменяем: старые файлы ещё могут быть отображены в память
+        arrays = {"unigrams": self.unigram_counts}
+        for d, (keys, counts) in enumerate(self.pairs, 1):
+            arrays[f"pairs{d}.keys"], arrays[f"pairs{d}.counts"] = keys, counts
+
+        for name, array in arrays.items():
+            array_path = os.path.join(self.path, f"{name}.npy")
+            with open(array_path + ".new", "wb") as wf:
+                np.save(wf, np.asarray(array, dtype=np.int64))
+            os.replace(array_path + ".new", array_path)
+
+        vocab_path = os.path.join(self.path, "vocab.txt")
+        with open(vocab_path + ".new", "w", encoding="utf-8", newline="\n") as wf:
+            wf.write("".join(token + "\n" for token in self.tokens))
+        os.replace(vocab_path + ".new", vocab_path)
+
+        # meta.json -- последним: по нему хранилище считается готовым
+        meta_path = os.path.join(self.path, "meta.json")
+        with open(meta_path + ".new", "w", encoding="utf-8") as wf:
+            json.dump({"max_distance": self.max_distance,
+                       "sentences": self.sentences,
+                       "sources": self.sources}, wf, ensure_ascii=False, indent=2)
+        os.replace(meta_path + ".new", meta_path)
+
+    def ngram_counts(self) -> NgramCounts:
+        """ Униграммы и биграммы (pairs1) для collocations.py, без копирования массивов """
+        counts = NgramCounts()
+        counts.tokens = self.tokens
+        counts.token_ids = self.token_ids
+        counts.unigram_counts = self.unigram_counts
+        counts.bigram_keys, counts.bigram_counts = self.pairs[0]
+        return counts
+
+    def word_context(self, window: int) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+            Частоты (слово, контекст) для симметричного окна: контекст -- слова
+              не дальше `window` позиций слева и справа в том же предложении
+
+            Returns:
+              id слов, id контекстов и частоты; пары упорядочены по (слово, контекст)
+        """
+        if not 1 <= window <= self.max_distance:
+            raise ValueError(f"Window {window} is not within 1..{self.max_distance} stored")
+
+        keys, counts = [], []
+        for d in range(window):
+            pair_keys, pair_counts = self.pairs[d]
+            left, right = unpack_bigrams(np.asarray(pair_keys))
+            # y справа от x -- это и x слева от y
+            keys += [np.asarray(pair_keys), pack_bigrams(right, left)]
+            counts += [np.asarray(pair_counts)] * 2
+
+        keys, counts = reduce_counts(np.concatenate(keys), np.concatenate(counts))
+        words, contexts = unpack_bigrams(keys)
+        return words, contexts, counts
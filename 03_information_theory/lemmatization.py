@@ -0,0 +1,121 @@
+""" Лемматизация текста в несколько процессов: предложения -> нормальные формы слов """
+import logging
+import os
+import re
+import sys
+from multiprocessing import Pool
+from typing import Dict, Iterable, Iterator, List, Tuple
+
+from nltk.tokenize import sent_tokenize
+from pymorphy2 import MorphAnalyzer
+from sacrebleu.tokenizers.tokenizer_13a import Tokenizer13a
+from tqdm import tqdm
+
+# Таблица "слово -> лемма" между запусками -- тот же LemmaCache, что у поиска.
+#   Лабораторные -- отдельные каталоги со скриптами, которые запускаются каждый
+#   из своего каталога (пакета и setup.py нет), поэтому каталог 01 добавляется
+#   в путь поиска модулей; в конец, чтобы модули этого каталога не перекрывались
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "01_information_retrieval"))
+
+from lemma_cache import LemmaCache  # noqa: E402
+
+LEMMA_CACHE = "lemmas.tsv"
+
+# Примерный размер куска текста для одного процесса
+CHUNK_CHARS = 1 << 20
+
+SENTENCE_END_RE = re.compile(r"[.!?…][\"»)]*$")
+
+
+def text_chunks(text: str, chunk_chars: int = CHUNK_CHARS) -> Iterator[str]:
+    """
+        Куски текста примерно по chunk_chars символов
+
+        Режем по переводу строки сразу после конца предложения, чтобы
+          sent_tokenize в разных процессах не разрезал предложение; если
+          такого нет на протяжении четырёх кусков -- по любому переводу строки
+    """
+    start = 0
+    while len(text) - start > chunk_chars:
+        limit = min(len(text), start + 4 * chunk_chars)
+        cut = pos = start + chunk_chars
+
+        while True:
+            pos = text.find("\n", pos, limit)
+            if pos < 0:
+                newline = text.find("\n", start + chunk_chars, limit)
+                cut = newline + 1 if newline >= 0 else limit
+                break
+            if SENTENCE_END_RE.search(text[max(start, pos - 16):pos].rstrip()):
+                cut = pos + 1
+                break
+            pos += 1
+
+        yield text[start:cut]
+        start = cut
+
+    if start < len(text):
+        yield text[start:]
+
+
+# Состояние процесса пула: свой анализатор и своя таблица лемм
+_worker = {}
+
+
+def _init_worker(lemmas: Dict[str, str]):
+    _worker.update(morph=MorphAnalyzer(), tokenizer=Tokenizer13a(), lemmas=dict(lemmas))
+
+
+def lemmatize_chunk(text: str) -> Tuple[List[List[str]], Dict[str, str]]:
+    """
+        Предложения куска в виде списков лемм (слова из букв и цифр)
+          и леммы слов, которых ещё не было в таблице процесса
+
+        Not the best option for Russian lemmatization, but it's fast,
+          and context-independence allows to parse each word form once
+    """
+    morph, tokenizer, lemmas = _worker["morph"], _worker["tokenizer"], _worker["lemmas"]
+    new_lemmas = {}
+    sentences = []
+
+    for sentence in sent_tokenize(text, language="russian"):
+        sentences.append([])
+        for token in tokenizer(sentence).split(" "):
+            if token.isalnum():
+                lemma = lemmas.get(token)
+                if lemma is None:
+                    lemma = lemmas[token] = new_lemmas[token] = morph.parse(token)[0].normal_form
+                sentences[-1].append(lemma)
+
+    return sentences, new_lemmas
+
+
+def lemmatize_text(text: str, lemmas: LemmaCache = None, processes: int = None,
+                   chunk_chars: int = CHUNK_CHARS) -> Iterator[List[str]]:
+    """
+        Предложения текста (списки лемм) по порядку, по мере готовности
+
+        Куски текста обрабатываются в `processes` процессах (по умолчанию --
+          по числу ядер). Каждый процесс начинает с лемм из кэша `lemmas`
+          (по умолчанию -- LEMMA_CACHE), новые леммы добавляются в него же
+    """
+    lemmas = LemmaCache(LEMMA_CACHE) if lemmas is None else lemmas
+    chunks = list(text_chunks(text, chunk_chars))
+    processes = min(processes or os.cpu_count() or 1, max(len(chunks), 1))
+    logging.info(f"Lemmatizing {len(chunks)} chunks in {processes} processes, "
+                 f"{len(lemmas)} word forms already known")
+
+    known = lemmas.lemmas()
+    if processes == 1:
+        _init_worker(known)
+        yield from _collect(map(lemmatize_chunk, chunks), lemmas, len(chunks))
+    else:
+        with Pool(processes, initializer=_init_worker, initargs=(known,)) as pool:
+            yield from _collect(pool.imap(lemmatize_chunk, chunks), lemmas, len(chunks))
+
+
+def _collect(results: Iterable[Tuple[List[List[str]], Dict[str, str]]],
+             lemmas: LemmaCache, total: int) -> Iterator[List[str]]:
+    for sentences, new_lemmas in tqdm(results, "chunks", total=total):
+        lemmas.update(new_lemmas)
+        yield from sentences
@@ -0,0 +1,241 @@
+""" Подсчёт униграмм и биграмм больших корпусов: целочисленные id, NumPy и несколько процессов """
+import io
+import os
+from multiprocessing import Pool
+from typing import Iterator, List, Tuple
+
+import numpy as np
+from tqdm import tqdm
+
+# Биграмма (a, b) хранится одним int64: a << ID_BITS | b
+ID_BITS = 32
+ID_MASK = (1 << ID_BITS) - 1
+
+# Сколько байт файла читает один процесс за раз
+CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def pack_bigrams(left: np.ndarray, right: np.ndarray) -> np.ndarray:
+    return (left.astype(np.int64) << ID_BITS) | right.astype(np.int64)
+
+
+def unpack_bigrams(keys: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    return keys >> ID_BITS, keys & ID_MASK
+
+
+def reduce_counts(keys: np.ndarray, counts: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """ Сумма счётчиков одинаковых ключей: сортировка и свёртка; ключи -- по возрастанию """
+    if not len(keys):
+        return keys.astype(np.int64), counts.astype(np.int64)
+    order = np.argsort(keys, kind="stable")
+    keys, counts = keys[order], counts[order]
+    starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+    return keys[starts], np.add.reduceat(counts, starts).astype(np.int64)
+
+
+def file_chunks(path: str, chunk_bytes: int = CHUNK_BYTES) -> List[Tuple[int, int]]:
+    """ Отрезки файла [начало, конец) примерно по chunk_bytes байт, по границам строк """
+    size = os.path.getsize(path)
+    bounds = [0]
+
+    with open(path, "rb") as f:
+        while bounds[-1] < size:
+            f.seek(bounds[-1] + chunk_bytes)
+            # дочитываем строку, на которую попали
+            f.readline()
+            bounds.append(min(f.tell(), size))
+
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def encode_lines(lines: Iterator[str]) -> Tuple[List[str], np.ndarray]:
+    """
+        Токены куска корпуса -> id (строка -- предложение, токены через пробел)
+
+        Токены -- line.strip().split(" "), как в исходном compute_pmi.py:
+          пустая строка и двойной пробел дают пустой токен "", и частоты
+          совпадают с подсчётом через Counter
+
+        Returns:
+          токены куска (id -- позиция в списке) и id всех токенов подряд,
+          после каждого предложения -- граница -1
+    """
+    vocabulary = {}
+    ids = []
+    for line in lines:
+        ids.extend(vocabulary.setdefault(token, len(vocabulary)) for token in line.strip().split(" "))
+        ids.append(-1)
+    return list(vocabulary), np.array(ids, dtype=np.int64)
+
+
+def distance_pairs(ids: np.ndarray, distance: int = 1) -> np.ndarray:
+    """
+        Ключи пар (x, y), где y стоит через `distance` позиций после x
+          в том же предложении; distance=1 -- обычные биграммы
+    """
+    left, right = ids[:-distance], ids[distance:]
+    sentence = np.cumsum(ids < 0)
+    inside = (left >= 0) & (right >= 0) & (sentence[:-distance] == sentence[distance:])
+    return pack_bigrams(left[inside], right[inside])
+
+
+def count_lines(lines: Iterator[str]) -> Tuple[List[str], np.ndarray, np.ndarray, np.ndarray]:
+    """
+        Счётчики для куска корпуса
+
+        Returns:
+          токены куска (id -- позиция в списке), частоты токенов,
+          ключи биграмм (по возрастанию) и их частоты; биграммы не переходят
+          через границу предложения
+    """
+    tokens, ids = encode_lines(lines)
+    unigram_counts = np.bincount(ids[ids >= 0], minlength=len(tokens)).astype(np.int64)
+    bigram_keys, bigram_counts = np.unique(distance_pairs(ids), return_counts=True)
+    return tokens, unigram_counts, bigram_keys, bigram_counts.astype(np.int64)
+
+
+def read_chunk(path: str, start: int, end: int) -> List[str]:
+    """ Строки отрезка файла -- те же, что при чтении open(path) построчно """
+    with open(path, "rb") as f:
+        f.seek(start)
+        # splitlines() резал бы строки ещё и по \x0b, \x1c, \u2028...
+        return list(io.StringIO(f.read(end - start).decode("utf-8"), newline=None))
+
+
+def count_file_chunk(args: Tuple[str, int, int]):
+    return count_lines(read_chunk(*args))
+
+
+class NgramCounts(object):
+    """
+        Частоты униграмм и биграмм корпуса
+
+        Токены заменены целыми id (tokens[id] -- сам токен), частота токена --
+          unigram_counts[id]; биграммы -- упорядоченный массив ключей int64
+          (pack_bigrams) и массив частот той же длины. На запись уходит
+          16 байт, а не сотни, как у Counter с ключами-кортежами строк
+    """
+
+    def __init__(self):
+        self.tokens: List[str] = []
+        self.token_ids = {}
+        self.unigram_counts = np.zeros(0, dtype=np.int64)
+        self.bigram_keys = np.zeros(0, dtype=np.int64)
+        self.bigram_counts = np.zeros(0, dtype=np.int64)
+
+        # счётчики кусков, ещё не сведённые в bigram_keys/bigram_counts
+        self._pending_keys, self._pending_counts = [], []
+        self._pending_size = 0
+
+    def intern(self, tokens: List[str]) -> np.ndarray:
+        """ Глобальные id токенов (новые токены получают следующие id) """
+        token_ids = self.token_ids
+        for token in tokens:
+            if token not in token_ids:
+                token_ids[token] = len(self.tokens)
+                self.tokens.append(token)
+        return np.fromiter((token_ids[token] for token in tokens), dtype=np.int64, count=len(tokens))
+
+    def update(self, chunk):
+        """ Добавить результат count_lines: id куска переводятся в глобальные """
+        tokens, unigram_counts, bigram_keys, bigram_counts = chunk
+        remap = self.intern(tokens)
+
+        if len(self.unigram_counts) < len(self.tokens):
+            grown = np.zeros(len(self.tokens), dtype=np.int64)
+            grown[:len(self.unigram_counts)] = self.unigram_counts
+            self.unigram_counts = grown
+        # в одном куске id не повторяются
+        self.unigram_counts[remap] += unigram_counts
+
+        left, right = unpack_bigrams(bigram_keys)
+        self._pending_keys.append(pack_bigrams(remap[left], remap[right]))
+        self._pending_counts.append(bigram_counts)
+        self._pending_size += len(bigram_keys)
+
+        # сводим, когда несведённых записей стало больше, чем уже сведённых
+        if self._pending_size > max(len(self.bigram_keys), 1 << 20):
+            self.compact()
+
+    def merge(self, other: "NgramCounts"):
+        """ Слить счётчики другого шарда корпуса """
+        other.compact()
+        self.update((other.tokens, other.unigram_counts, other.bigram_keys, other.bigram_counts))
+        self.compact()
+
+    def compact(self):
+        if not self._pending_keys:
+            return
+        self.bigram_keys, self.bigram_counts = reduce_counts(
+            np.concatenate([self.bigram_keys] + self._pending_keys),
+            np.concatenate([self.bigram_counts] + self._pending_counts)
+        )
+        self._pending_keys, self._pending_counts = [], []
+        self._pending_size = 0
+
+    def bigrams(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """ Массивы id левых и правых токенов биграмм и их частоты """
+        self.compact()
+        left, right = unpack_bigrams(self.bigram_keys)
+        return left, right, self.bigram_counts
+
+    @property
+    def total_unigrams(self) -> int:
+        return int(self.unigram_counts.sum())
+
+    @property
+    def total_bigrams(self) -> int:
+        self.compact()
+        return int(self.bigram_counts.sum())
+
+    def most_common_unigrams(self, n: int) -> List[Tuple[str, int]]:
+        """ При равных частотах -- в порядке первого появления, как у Counter.most_common """
+        top = top_indices(self.unigram_counts, n)
+        return [(self.tokens[i], int(self.unigram_counts[i])) for i in top]
+
+    def most_common_bigrams(self, n: int) -> List[Tuple[Tuple[str, str], int]]:
+        """
+            При равных частотах -- по (id левого, id правого токена), то есть по первому
+              появлению токенов, а не самой биграммы, как было бы у Counter.most_common
+        """
+        left, right, counts = self.bigrams()
+        top = top_indices(counts, n)
+        return [((self.tokens[left[i]], self.tokens[right[i]]), int(counts[i])) for i in top]
+
+
+def top_indices(values: np.ndarray, n: int) -> np.ndarray:
+    """
+        Номера n наибольших значений по убыванию, при равенстве -- по возрастанию
+          номера: partition, без полной сортировки
+    """
+    n = min(n, len(values))
+    if n <= 0:
+        return np.zeros(0, dtype=np.int64)
+    # все значения, равные n-му по величине: argpartition взял бы из них случайные
+    kth = np.partition(values, len(values) - n)[len(values) - n]
+    top = np.flatnonzero(values >= kth)
+    return top[np.lexsort((top, -values[top]))][:n]
+
+
+def count_file(path: str, processes: int = None, chunk_bytes: int = CHUNK_BYTES) -> NgramCounts:
+    """
+        Частоты униграмм и биграмм файла (строка -- предложение)
+
+        Файл делится на куски по границам строк; куски считаются в `processes`
+          процессах (по умолчанию -- по числу ядер), каждый сам читает свой кусок
+          с диска, а в основном процессе счётчики кусков сливаются
+    """
+    chunks = [(path, start, end) for start, end in file_chunks(path, chunk_bytes)]
+    processes = min(processes or os.cpu_count() or 1, max(len(chunks), 1))
+    counts = NgramCounts()
+
+    if processes == 1:
+        for chunk in tqdm(map(count_file_chunk, chunks), "chunks", total=len(chunks)):
+            counts.update(chunk)
+    else:
+        with Pool(processes) as pool:
+            for chunk in tqdm(pool.imap(count_file_chunk, chunks), "chunks", total=len(chunks)):
+                counts.update(chunk)
+
+    counts.compact()
+    return counts
@@ -4,14 +4,11 @@
 # from pymystem3 import Mystem
 
 import logging
-from functools import lru_cache
-from typing import List
+from typing import Iterator, List
 
 import requests
-from nltk.tokenize import sent_tokenize
-from pymorphy2 import MorphAnalyzer
-from sacrebleu.tokenizers.tokenizer_13a import Tokenizer13a
-from tqdm import tqdm
+
+from lemmatization import LEMMA_CACHE, LemmaCache, lemmatize_text
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -22,21 +19,10 @@ logging.basicConfig(
     ]
 )
 
-Lemmatizer = MorphAnalyzer()
-
-
-@lru_cache(1000000)
-def cached_parse(word):
-    """
-        Not the best option for Russian lemmatization,
-          but it's fast, and context-independence allows to cache stuff
-    """
-    return Lemmatizer.parse(word)[0].normal_form
-
-
-def download_and_process_text(url="http://www.lib.ru/PROZA/DOMBROWSKIJ/faculty.txt_Ascii.txt"):
 
-    tokenizer = Tokenizer13a()
+def download_and_process_text(url="http://www.lib.ru/PROZA/DOMBROWSKIJ/faculty.txt_Ascii.txt",
+                              lemmas: LemmaCache = None) -> Iterator[List[str]]:
+    """ Предложения текста в виде списков лемм, по мере готовности (см. lemmatization.py) """
 
     logging.info("Downloading text")
     response = requests.get(url)
@@ -53,27 +39,24 @@ def download_and_process_text(url="http://www.lib.ru/PROZA/DOMBROWSKIJ/faculty.t
     logging.debug("First chars:", text[:100])
 
     text = text.replace("\n\n", "\n")
-    sentences: List[str] = sent_tokenize(text, language="russian")
-    normalized_sentences: List[List[str]] = []
-
-    for sentence in tqdm(sentences, "sentences"):
-        normalized_sentences.append([])
-        for token in tokenizer(sentence).split(" "):
-            if token.isalnum():
-                normalized_sentences[-1].append(cached_parse(token))
-
-    return normalized_sentences
+    yield from lemmatize_text(text, lemmas)
 
 
 if __name__ == "__main__":
 
-    sentences = download_and_process_text()
-    logging.info(f"Processed {len(sentences)} sentences:")
-
-    for i, sent in enumerate(sentences[:15], 1):
-        logging.debug(f"{i}. {sent}")
+    # леммы уже встречавшихся слов -- с прошлых запусков
+    lemmas = LemmaCache(LEMMA_CACHE)
+    count = 0
 
+    # предложения пишутся по мере готовности и в памяти не копятся;
+    #   перевод строки -- между предложениями, как раньше в "\n".join(...)
     with open("sentences.txt", "w", encoding="utf-8") as wf:
-        wf.write("\n".join([" ".join(s) for s in sentences]))
+        for count, sent in enumerate(download_and_process_text(lemmas=lemmas), 1):
+            if count <= 15:
+                logging.debug(f"{count}. {sent}")
+            wf.write(("\n" if count > 1 else "") + " ".join(sent))
+
+    lemmas.flush()
+    logging.info(f"Processed {count} sentences.")
 
     logging.info("Done.")
@@ -0,0 +1,77 @@
+""" Проверки collocations.py: python -m pytest test_collocations.py """
+import math
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from collocations import MEASURES, BigramStats, top_collocations
+from ngram_counts import NgramCounts, count_lines
+
+
+def corpus(seed=0, lines=500):
+    rng = random.Random(seed)
+    words = ["w%d" % i for i in range(40)]
+    return [" ".join(rng.choice(words[:rng.randint(2, 40)]) for _ in range(rng.randint(1, 12)))
+            for _ in range(lines)]
+
+
+@pytest.fixture(scope="module")
+def counts():
+    counts = NgramCounts()
+    counts.update(count_lines(corpus()))
+    return counts
+
+
+def pmi_like_compute_pmi(lines, k=1):
+    """ Цикл из исходного compute_pmi.py """
+    bigram_counter, unigram_counter = Counter(), Counter()
+    for line in lines:
+        tokens = line.strip().split(" ")
+        for i in range(len(tokens) - 1):
+            bigram_counter[(tokens[i], tokens[i + 1])] += 1
+            unigram_counter[tokens[i]] += 1
+        unigram_counter[tokens[-1]] += 1
+
+    total_unigrams = sum(unigram_counter.values())
+    total_bigrams = sum(bigram_counter.values())
+    return {(a, b): k * (math.log2(count) - math.log2(total_bigrams))
+            - math.log2(unigram_counter[a]) + 2 * math.log2(total_unigrams) - math.log2(unigram_counter[b])
+            for (a, b), count in bigram_counter.items()}
+
+
+@pytest.mark.parametrize("k", [1, 2, 3])
+def test_pmi_matches_compute_pmi(counts, k):
+    expected = pmi_like_compute_pmi(corpus(), k)
+    top = top_collocations(counts, n=20, measure="pmi", k=k)
+
+    for a, b, score, *_ in top:
+        assert score == pytest.approx(expected[(a, b)])
+    # лучшие 20 по убыванию меры -- те же, с точностью до равных значений
+    best = sorted(expected.values(), reverse=True)[:20]
+    assert [score for _, _, score, *_ in top] == pytest.approx(best)
+
+
+def test_ties_are_ordered_by_token_ids(counts):
+    # у чистой PMI наверху много пар с одинаковой оценкой
+    top = top_collocations(counts, n=50, measure="pmi")
+    keys = [(-score, counts.token_ids[a], counts.token_ids[b]) for a, b, score, *_ in top]
+    assert keys == sorted(keys)
+    assert top == top_collocations(counts, n=50, measure="pmi")
+
+
+def test_measures_on_a_two_by_two_table():
+    # 4 биграммы: (0, 1) x 3 и (2, 3) x 1; частоты слов -- по 3, 3, 1, 1
+    stats = BigramStats(np.array([0, 2]), np.array([1, 3]), np.array([3, 1]),
+                        np.array([3, 3, 1, 1]), total_unigrams=8, total_bigrams=4)
+    # x и y встречаются только вместе: хи-квадрат = n
+    assert stats.chi2() == pytest.approx([4.0, 4.0])
+    # LLR = 2 * (3 ln(4/3) + 1 ln 4) для обеих пар
+    assert stats.llr() == pytest.approx([2 * (3 * math.log(4 / 3) + math.log(4))] * 2)
+
+
+def test_min_count_drops_rare_bigrams(counts):
+    for measure in MEASURES:
+        for _, _, _, xy, _, _ in top_collocations(counts, n=30, measure=measure, min_count=5):
+            assert xy >= 5
@@ -0,0 +1,133 @@
+""" Проверки count_store.py: python -m pytest test_count_store.py """
+import os
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from count_store import CountStore
+
+
+def write_lines(path, lines):
+    with open(path, "w", encoding="utf-8") as wf:
+        wf.write("\n".join(lines))
+
+
+def corpus(seed, lines=400):
+    rng = random.Random(seed)
+    words = ["w%d" % i for i in range(30)]
+    return [" ".join(rng.choice(words) for _ in range(rng.randint(1, 10))) for _ in range(lines)]
+
+
+def pair_counts(lines, distance):
+    counts = Counter()
+    for line in lines:
+        tokens = line.strip().split(" ")
+        for i in range(len(tokens) - distance):
+            counts[(tokens[i], tokens[i + distance])] += 1
+    return counts
+
+
+def as_dicts(store):
+    unigrams = {store.tokens[i]: int(c) for i, c in enumerate(store.unigram_counts) if c}
+    pairs = []
+    for keys, counts in store.pairs:
+        keys = np.asarray(keys)
+        pairs.append({(store.tokens[k >> 32], store.tokens[k & 0xFFFFFFFF]): int(c)
+                      for k, c in zip(keys, counts)})
+    return unigrams, pairs, store.sentences
+
+
+def test_counts_match_brute_force(tmp_path):
+    lines = corpus(0)
+    write_lines(tmp_path / "a.txt", lines)
+    store = CountStore(str(tmp_path / "store"), max_distance=3)
+    store.append_file(str(tmp_path / "a.txt"), processes=1, chunk_bytes=300)
+
+    unigrams, pairs, sentences = as_dicts(store)
+    assert unigrams == dict(Counter(token for line in lines for token in line.split(" ")))
+    for distance in (1, 2, 3):
+        assert pairs[distance - 1] == dict(pair_counts(lines, distance))
+    assert sentences == len(lines)
+
+
+def test_merge_equals_counting_together(tmp_path):
+    first, second = corpus(1), corpus(2)
+    write_lines(tmp_path / "first.txt", first)
+    write_lines(tmp_path / "second.txt", second)
+    write_lines(tmp_path / "both.txt", first + second)
+
+    together = CountStore(str(tmp_path / "together"))
+    together.append_file(str(tmp_path / "both.txt"), processes=1)
+
+    shard = CountStore(str(tmp_path / "shard"))
+    shard.append_file(str(tmp_path / "second.txt"), processes=1)
+    shard.save()
+    merged = CountStore(str(tmp_path / "merged"))
+    merged.append_file(str(tmp_path / "first.txt"), processes=1)
+    merged.merge(CountStore(str(tmp_path / "shard")))
+
+    assert as_dicts(merged) == as_dicts(together)
+    assert [s["path"] for s in merged.sources] == [str(tmp_path / "first.txt"), str(tmp_path / "second.txt")]
+
+    # строки, дописанные append_lines, дают то же, что и файл целиком
+    incremental = CountStore(str(tmp_path / "incremental"))
+    incremental.append_file(str(tmp_path / "first.txt"), processes=1)
+    incremental.append_lines(second)
+    assert as_dicts(incremental) == as_dicts(together)
+
+
+def test_merge_needs_enough_distances(tmp_path):
+    with pytest.raises(ValueError):
+        CountStore(str(tmp_path / "wide"), max_distance=3).merge(CountStore(str(tmp_path / "narrow"), max_distance=1))
+
+
+def test_saved_store_loads_the_same(tmp_path):
+    # пустой токен и \x0b внутри токена не должны сбить словарь
+    lines = corpus(3) + ["", "w1  w2", "x\x0by w1"]
+    write_lines(tmp_path / "a.txt", lines)
+    store = CountStore(str(tmp_path / "store"))
+    store.append_file(str(tmp_path / "a.txt"), processes=1)
+    store.save()
+
+    loaded = CountStore(str(tmp_path / "store"))
+    assert loaded.tokens == store.tokens
+    assert as_dicts(loaded) == as_dicts(store)
+
+    words, contexts, counts = loaded.word_context(2)
+    symmetric = Counter()
+    for distance in (1, 2):
+        for (x, y), c in pair_counts(lines, distance).items():
+            symmetric[(x, y)] += c
+            symmetric[(y, x)] += c
+    assert {(loaded.tokens[w], loaded.tokens[c]): int(n) for w, c, n in zip(words, contexts, counts)} == \
+           dict(symmetric)
+
+
+def test_changed_source_is_recounted(tmp_path):
+    path = tmp_path / "a.txt"
+    write_lines(path, ["a b c", "b c"])
+    store = CountStore(str(tmp_path / "store"))
+    store.append_file(str(path), processes=1)
+    store.save()
+    assert CountStore(str(tmp_path / "store")).stale_sources() == []
+
+    write_lines(path, ["a b c", "b c", "c d"])
+    # размер мог бы и совпасть: время изменения проверяется тоже
+    os.utime(path, ns=(0, os.stat(path).st_mtime_ns + 10 ** 9))
+    store = CountStore(str(tmp_path / "store"))
+    assert store.stale_sources() == [str(path)]
+
+    store.recount(processes=1)
+    store.save()
+    store = CountStore(str(tmp_path / "store"))
+    assert store.stale_sources() == []
+    assert as_dicts(store)[0] == {"a": 1, "b": 2, "c": 3, "d": 1}
+
+
+def test_recount_refuses_without_sources(tmp_path):
+    store = CountStore(str(tmp_path / "store"))
+    store.append_lines(["a b"])
+    with pytest.raises(ValueError):
+        store.recount()
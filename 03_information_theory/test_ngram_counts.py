@@ -0,0 +1,88 @@
+""" Проверки ngram_counts.py: python -m pytest test_ngram_counts.py """
+import random
+from collections import Counter
+
+import numpy as np
+import pytest
+
+from ngram_counts import NgramCounts, count_file, count_lines, top_indices
+
+
+def write_corpus(path, lines=3000, seed=0):
+    """ Корпус с пустыми строками, двойными пробелами, \\r\\n и \\x0b внутри слов """
+    rng = random.Random(seed)
+    words = ["а", "б", "в", "г", "д\x0bе", "ж", ""]
+    with open(path, "w", encoding="utf-8", newline="") as wf:
+        for _ in range(lines):
+            sentence = " ".join(rng.choice(words) for _ in range(rng.randint(0, 8)))
+            wf.write(sentence + rng.choice(["\n", "\n", "\r\n"]))
+
+
+def count_like_compute_pmi(path):
+    """ Подсчёт из исходного compute_pmi.py """
+    bigram_counter, unigram_counter = Counter(), Counter()
+    with open(path, "r", encoding="utf-8") as rf:
+        for line in rf:
+            tokens = line.strip().split(" ")
+            for i in range(len(tokens) - 1):
+                bigram_counter[(tokens[i], tokens[i + 1])] += 1
+                unigram_counter[tokens[i]] += 1
+            unigram_counter[tokens[-1]] += 1
+    return unigram_counter, bigram_counter
+
+
+def as_dicts(counts: NgramCounts):
+    unigrams = {counts.tokens[i]: int(c) for i, c in enumerate(counts.unigram_counts)}
+    left, right, c_xy = counts.bigrams()
+    bigrams = {(counts.tokens[a], counts.tokens[b]): int(c) for a, b, c in zip(left, right, c_xy)}
+    return unigrams, bigrams
+
+
+@pytest.mark.parametrize("processes, chunk_bytes", [(1, 1 << 20), (1, 500), (2, 700)])
+def test_counts_match_compute_pmi(tmp_path, processes, chunk_bytes):
+    path = str(tmp_path / "sentences.txt")
+    write_corpus(path)
+    unigram_counter, bigram_counter = count_like_compute_pmi(path)
+
+    counts = count_file(path, processes=processes, chunk_bytes=chunk_bytes)
+    assert as_dicts(counts) == (dict(unigram_counter), dict(bigram_counter))
+    assert counts.total_unigrams == sum(unigram_counter.values())
+    assert counts.total_bigrams == sum(bigram_counter.values())
+    # при равных частотах -- первое появление, как у Counter
+    assert counts.most_common_unigrams(6) == unigram_counter.most_common(6)
+    assert [count for _, count in counts.most_common_bigrams(6)] == \
+           [count for _, count in bigram_counter.most_common(6)]
+
+
+def test_bigrams_do_not_cross_sentences():
+    counts = NgramCounts()
+    counts.update(count_lines(["а б", "в г"]))
+    assert as_dicts(counts)[1] == {("а", "б"): 1, ("в", "г"): 1}
+
+
+def test_merge_equals_counting_together():
+    lines = ["а б в", "б в", "", "в  г а", "г"]
+    together = NgramCounts()
+    together.update(count_lines(lines))
+
+    first, second = NgramCounts(), NgramCounts()
+    first.update(count_lines(lines[:2]))
+    second.update(count_lines(lines[2:]))
+    first.merge(second)
+
+    assert as_dicts(first) == as_dicts(together)
+
+
+def test_most_common_bigrams_break_ties_by_token_ids():
+    counts = NgramCounts()
+    counts.update(count_lines(["в г", "а б", "б а", "в г"]))
+    # id: в=0, г=1, а=2, б=3
+    assert counts.most_common_bigrams(3) == [(("в", "г"), 2), (("а", "б"), 1), (("б", "а"), 1)]
+
+
+def test_top_indices_orders_ties_by_index():
+    values = np.array([1, 3, 2, 3, 1, 3])
+    assert top_indices(values, 2).tolist() == [1, 3]
+    assert top_indices(values, 4).tolist() == [1, 3, 5, 2]
+    assert top_indices(values, 10).tolist() == [1, 3, 5, 2, 0, 4]
+    assert top_indices(values, 0).tolist() == []
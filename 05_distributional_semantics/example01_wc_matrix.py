@@ -1,44 +1,24 @@
 import logging
-from collections import Counter
-from itertools import chain
-from typing import Iterable, Tuple, Dict
+import os
+import sys
+from typing import Dict
 
 import numpy as np
-from scipy.sparse import dok_matrix, csr_matrix, spmatrix
+from scipy.sparse import csr_matrix, spmatrix
 from sklearn.metrics.pairwise import pairwise_distances
-from tqdm import tqdm
 
+# Хранилище частот -- общее с лекцией про PMI. Лабораторные -- отдельные каталоги
+#   со скриптами, которые запускаются каждый из своего каталога (пакета и setup.py
+#   нет), поэтому каталог 03 добавляется в путь поиска модулей; в конец, чтобы
+#   модули этого каталога не перекрывались одноимёнными оттуда
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03_information_theory"))
+
+from count_store import CountStore  # noqa: E402
 
 # does not work with sparse matrices
 # from scipy.spatial.distance import cdist
 
 
-def make_window_iter(index: int, half_window_size: int, length: int):
-    left_part = range(max(0, index - half_window_size),
-                      max(0, index - 1))
-    right_part = range(min(index + 1, length - 1),
-                       min(length - 1, index + half_window_size))
-    return chain(left_part, right_part)
-
-
-def build_word_context_counters(lines: Iterable[str]) -> Tuple[Counter, Counter]:
-    # unigram counter
-    vocab = Counter()
-
-    # word-context tuples counter
-    wc_count = Counter()
-
-    for line in tqdm(lines, "reading data, filling dicts"):
-        sentence = [t for t in line.strip().split()]
-        vocab.update(sentence)
-        for idx, target_word in enumerate(sentence):
-            window = make_window_iter(idx, window_dist, len(sentence))
-            for ctx_idx in window:
-                wc_count[(target_word, sentence[ctx_idx])] += 1
-
-    return vocab, wc_count
-
-
 def find_top_k(wc_like_matrix: spmatrix,
                word_id: int,
                id2tok: Dict[int, str],
@@ -55,7 +35,6 @@ def find_top_k(wc_like_matrix: spmatrix,
 
 
 if __name__ == "__main__":
-    import os
 
     """
         Убедитесь, что на голых счётчиках далеко не уедешь
@@ -87,26 +66,30 @@ if __name__ == "__main__":
 
     sentences, window_dist = [], 2
 
-    with open("sentences-larger.txt", "r", encoding="utf-8") as rf:
-        unigram_counter, wc_counter = build_word_context_counters(rf)
+    # Частоты считаются один раз и лежат на диске; окно можно менять от 1 до max_distance
+    #   без пересчёта. Если sentences-larger.txt изменился, частоты пересчитываются
+    store = CountStore("counts-larger", max_distance=window_dist)
 
-    total_tok = sum(unigram_counter.values())
-    total_tok_uniq = len(unigram_counter.keys())
-    print(f"Unique: {total_tok_uniq}, total: {total_tok}")
+    if store.stale_sources():
+        logging.info("sentences-larger.txt changed since counting, recounting")
+        store.recount()
+        store.save()
 
-    tok2id = {k: i for i, (k, _) in enumerate(unigram_counter.most_common())}
-    id2tok = {i: word for word, i in tok2id.items()}
-    unigram_array = np.zeros((len(tok2id),))
+    if not store.sentences:
+        store.append_file("sentences-larger.txt")
+        store.save()
 
-    for tok, i in tok2id.items():
-        unigram_array[i] = unigram_counter.get(tok, 0)
-
-    wc_count_matrix = dok_matrix((len(tok2id), len(tok2id)))
+    total_tok = int(store.unigram_counts.sum())
+    total_tok_uniq = len(store.tokens)
+    print(f"Unique: {total_tok_uniq}, total: {total_tok}")
 
-    for (tgt, ctx), count in tqdm(wc_counter.items(), "building WC matrix"):
-        wc_count_matrix[tok2id[tgt], tok2id[ctx]] = count
+    tok2id = store.token_ids
+    id2tok = dict(enumerate(store.tokens))
+    unigram_array = np.asarray(store.unigram_counts, dtype=np.float64)
 
-    wc_count_matrix = csr_matrix(wc_count_matrix)
+    targets, contexts, counts = store.word_context(window_dist)
+    wc_count_matrix = csr_matrix((counts.astype(np.float64), (targets, contexts)),
+                                 shape=(len(tok2id), len(tok2id)))
     pmi_matrix = wc_count_matrix.copy()
     """
         pmi(x,y) = log p(x,y)/p(x)/p(y)
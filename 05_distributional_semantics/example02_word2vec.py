@@ -49,6 +49,9 @@ if __name__ == "__main__":
                      negative=25,
                      epochs=170)
 
+    # пригодится для векторного поиска в 01_information_retrieval/vector_searcher.py
+    model.save("word2vec.model")
+
     seed_words = ["красный", "яблоко", "пушкин"]
 
     for query in seed_words:
@@ -30,6 +30,9 @@ if __name__ == "__main__":
                      negative=25,
                      epochs=15)
 
+    # пригодится для векторного поиска в 01_information_retrieval/vector_searcher.py
+    model.save("fasttext.model")
+
     sim = model.wv.most_similar
 
     for word in ["красный", "яблоко", "пушкин"]:
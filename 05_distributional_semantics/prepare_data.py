@@ -1,12 +1,17 @@
 import logging
-from functools import lru_cache
-from typing import List
+import os
+import sys
+from typing import Iterator, List
 
 import requests
-from tqdm import tqdm
-from nltk.tokenize import sent_tokenize
-from pymorphy2 import MorphAnalyzer
-from sacrebleu.tokenizers.tokenizer_13a import Tokenizer13a
+
+# Пайплайн лемматизации -- общий с лекцией про PMI. Лабораторные -- отдельные
+#   каталоги со скриптами, которые запускаются каждый из своего каталога (пакета
+#   и setup.py нет), поэтому каталог 03 добавляется в путь поиска модулей;
+#   в конец, чтобы этот prepare_data.py не перекрывался одноимённым оттуда
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "03_information_theory"))
+
+from lemmatization import LEMMA_CACHE, LemmaCache, lemmatize_text  # noqa: E402
 
 logging.basicConfig(
     level=logging.DEBUG,
@@ -17,21 +22,10 @@ logging.basicConfig(
     ]
 )
 
-Lemmatizer = MorphAnalyzer()
-
-
-@lru_cache(1000000)
-def cached_parse(word):
-    """
-        Not the best option for Russian lemmatization,
-          but it's fast, and context-independence allows to cache stuff
-    """
-    return Lemmatizer.parse(word)[0].normal_form
-
-
-def download_and_process_text(url="http://www.lib.ru/PROZA/DOMBROWSKIJ/faculty.txt_Ascii.txt"):
-    tokenizer = Tokenizer13a()
 
+def download_and_process_text(url="http://www.lib.ru/PROZA/DOMBROWSKIJ/faculty.txt_Ascii.txt",
+                              lemmas: LemmaCache = None) -> Iterator[List[str]]:
+    """ Предложения текста в виде списков лемм, по мере готовности (см. lemmatization.py) """
     logging.info("Downloading text")
     response = requests.get(url)
     response.encoding = response.apparent_encoding
@@ -52,42 +46,36 @@ def download_and_process_text(url="http://www.lib.ru/PROZA/DOMBROWSKIJ/faculty.t
     logging.debug("First chars:", text[:100])
 
     text = text.replace("\n\n", "\n")
-    sentences: List[str] = sent_tokenize(text, language="russian")
-    normalized_sentences: List[List[str]] = []
-
-    for sentence in tqdm(sentences, "sentences"):
-        normalized_sentences.append([])
-        for token in tokenizer(sentence).split(" "):
-            if token.isalnum():
-                normalized_sentences[-1].append(cached_parse(token))
-
-    return normalized_sentences
+    yield from lemmatize_text(text, lemmas)
 
 
 if __name__ == "__main__":
 
-    sentences = download_and_process_text()
-    logging.info(f"Processed {len(sentences)} sentences:")
-
-    for i, sent in enumerate(sentences[:15], 1):
-        logging.debug(f"{i}. {sent}")
-
-    with open("sentences.txt", "w", encoding="utf-8") as wf:
-        wf.write("\n".join([" ".join(s) for s in sentences]))
-
-    sentences_keeper = download_and_process_text("https://lib.ru/PROZA/DOMBROWSKIJ/keeper.txt_Ascii.txt")
-
-    for i, sent in enumerate(sentences_keeper[:5], 1):
-        logging.debug(f"{i}. {sent}")
-
-    sentences_monkey = download_and_process_text("https://lib.ru/PROZA/DOMBROWSKIJ/dombrovsky2.txt_Ascii.txt")
-
-    for i, sent in enumerate(sentences_monkey[:5], 1):
-        logging.debug(f"{i}. {sent}")
-
-    with open("sentences-larger.txt", "w", encoding="utf-8") as wf:
-        wf.write("\n".join([" ".join(s) for s in sentences]))
-        wf.write("\n".join([" ".join(s) for s in sentences_keeper]))
-        wf.write("\n".join([" ".join(s) for s in sentences_monkey]))
+    # леммы уже встречавшихся слов -- с прошлых запусков
+    lemmas = LemmaCache(LEMMA_CACHE)
+    count = 0
+
+    # предложения пишутся по мере готовности и в памяти не копятся;
+    #   перевод строки -- между предложениями, как раньше в "\n".join(...);
+    #   sentences-larger.txt -- этот же роман и ещё два текста
+    with open("sentences.txt", "w", encoding="utf-8") as wf, \
+            open("sentences-larger.txt", "w", encoding="utf-8") as wf_larger:
+        for count, sent in enumerate(download_and_process_text(lemmas=lemmas), 1):
+            if count <= 15:
+                logging.debug(f"{count}. {sent}")
+            wf.write(("\n" if count > 1 else "") + " ".join(sent))
+            wf_larger.write(("\n" if count > 1 else "") + " ".join(sent))
+
+        logging.info(f"Processed {count} sentences.")
+
+        for url in ("https://lib.ru/PROZA/DOMBROWSKIJ/keeper.txt_Ascii.txt",
+                    "https://lib.ru/PROZA/DOMBROWSKIJ/dombrovsky2.txt_Ascii.txt"):
+            for i, sent in enumerate(download_and_process_text(url, lemmas), 1):
+                if i <= 5:
+                    logging.debug(f"{i}. {sent}")
+                wf_larger.write(("\n" if count or i > 1 else "") + " ".join(sent))
+                count += 1
+
+    lemmas.flush()
 
     logging.info("Done.")